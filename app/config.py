@@ -10,9 +10,88 @@ class Settings(BaseSettings):
     photos_bucket: str = Field("photos", alias="PHOTOS_BUCKET")
     public_bucket: bool = Field(True, alias="PUBLIC_BUCKET")
 
+    db_pool_min_size: int = Field(2, alias="DB_POOL_MIN_SIZE")
+    db_pool_max_size: int = Field(10, alias="DB_POOL_MAX_SIZE")
+    db_pool_timeout_s: float = Field(30.0, alias="DB_POOL_TIMEOUT_S")
+    db_pool_max_waiting: int = Field(0, alias="DB_POOL_MAX_WAITING")
+    db_prepare: bool = Field(True, alias="DB_PREPARE")
+
     embedder_backend: str = Field("random", alias="EMBEDDER_BACKEND")
     embed_model_path: str = Field("models/dogid.onnx", alias="EMBED_MODEL_PATH")
     embed_vector_size: int = Field(512, alias="EMBED_VECTOR_SIZE")
+    embed_max_batch: int = Field(16, alias="EMBED_MAX_BATCH")
+    embed_max_wait_ms: float = Field(5.0, alias="EMBED_MAX_WAIT_MS")
+    onnx_intra_op_threads: int = Field(0, alias="ONNX_INTRA_OP_THREADS")
+    onnx_inter_op_threads: int = Field(0, alias="ONNX_INTER_OP_THREADS")
+    onnx_cache_dir: str | None = Field("models/cache", alias="ONNX_CACHE_DIR")
+    embed_warmup: bool = Field(True, alias="EMBED_WARMUP")
+
+    cpu_pool_mode: str = Field("thread", alias="CPU_POOL_MODE")
+    cpu_pool_workers: int = Field(0, alias="CPU_POOL_WORKERS")
+    cpu_pool_max_pending: int = Field(32, alias="CPU_POOL_MAX_PENDING")
+    cpu_pool_shm_min_bytes: int = Field(65536, alias="CPU_POOL_SHM_MIN_BYTES")
+
+    match_mode: str = Field("sql", alias="MATCH_MODE")
+    ann_nlist: int = Field(256, alias="ANN_NLIST")
+    ann_nprobe: int = Field(16, alias="ANN_NPROBE")
+    ann_candidates: int = Field(100, alias="ANN_CANDIDATES")
+    quant_kind: str = Field("binary", alias="QUANT_KIND")
+    quant_pca_dim: int = Field(0, alias="QUANT_PCA_DIM")
+    quant_candidates: int = Field(200, alias="QUANT_CANDIDATES")
+    quant_store_codes: bool = Field(False, alias="QUANT_STORE_CODES")
+    match_batch_max_photos: int = Field(8, alias="MATCH_BATCH_MAX_PHOTOS")
+    match_batch_depth: int = Field(20, alias="MATCH_BATCH_DEPTH")
+    match_rerank: bool = Field(False, alias="MATCH_RERANK")
+    match_rerank_weight: float = Field(0.3, alias="MATCH_RERANK_WEIGHT")
+    match_rerank_candidates: int = Field(20, alias="MATCH_RERANK_CANDIDATES")
+    rerank_cache_max_dogs: int = Field(50000, alias="RERANK_CACHE_MAX_DOGS")
+    patch_embedder: str = Field("random", alias="PATCH_EMBEDDER")
+    appearance_enabled: bool = Field(True, alias="APPEARANCE_ENABLED")
+    appearance_metric: str = Field("chi2", alias="APPEARANCE_METRIC")
+    appearance_lab_weight: float = Field(0.5, alias="APPEARANCE_LAB_WEIGHT")
+    appearance_match_fallback: bool = Field(False, alias="APPEARANCE_MATCH_FALLBACK")
+    match_weight_visual: float = Field(0.7, alias="MATCH_WEIGHT_VISUAL")
+    match_weight_geo: float = Field(0.2, alias="MATCH_WEIGHT_GEO")
+    match_weight_recency: float = Field(0.1, alias="MATCH_WEIGHT_RECENCY")
+    match_geo_scale_km: float = Field(5.0, alias="MATCH_GEO_SCALE_KM")
+    match_recency_days: float = Field(30.0, alias="MATCH_RECENCY_DAYS")
+
+    http2: bool = Field(False, alias="HTTP2")
+    http_timeout_s: float = Field(30.0, alias="HTTP_TIMEOUT_S")
+    http_max_connections: int = Field(100, alias="HTTP_MAX_CONNECTIONS")
+    http_max_keepalive: int = Field(20, alias="HTTP_MAX_KEEPALIVE")
+    fetch_max_bytes: int = Field(20 * 1024 * 1024, alias="FETCH_MAX_BYTES")
+    upload_max_bytes: int = Field(20 * 1024 * 1024, alias="UPLOAD_MAX_BYTES")
+    ingest_workers: int = Field(2, alias="INGEST_WORKERS")
+    ingest_queue_max: int = Field(64, alias="INGEST_QUEUE_MAX")
+    ingest_job_ttl_s: float = Field(3600.0, alias="INGEST_JOB_TTL_S")
+    fetch_per_host_concurrency: int = Field(16, alias="FETCH_PER_HOST_CONCURRENCY")
+
+    cache_max_bytes: int = Field(64 * 1024 * 1024, alias="CACHE_MAX_BYTES")
+    cache_ttl_s: float = Field(3600.0, alias="CACHE_TTL_S")
+    cache_disk_path: str | None = Field(None, alias="CACHE_DISK_PATH")
+
+    fcm_max_concurrency: int = Field(10, alias="FCM_MAX_CONCURRENCY")
+
+    analyze_max_side: int = Field(1024, alias="ANALYZE_MAX_SIDE")
+    analyze_trace_memory: bool = Field(False, alias="ANALYZE_TRACE_MEMORY")
+    histogram_engine: str = Field("reference", alias="HISTOGRAM_ENGINE")
+
+    dedup_enabled: bool = Field(True, alias="DEDUP_ENABLED")
+    dedup_max_distance: int = Field(10, alias="DEDUP_MAX_DISTANCE")
+
+    nearby_mode: str = Field("latest", alias="NEARBY_MODE")
+    nearby_cache_ttl_s: float = Field(15.0, alias="NEARBY_CACHE_TTL_S")
+    nearby_cache_max_bytes: int = Field(8 * 1024 * 1024, alias="NEARBY_CACHE_MAX_BYTES")
+    nearby_geohash_precision: int = Field(6, alias="NEARBY_GEOHASH_PRECISION")
+    nearby_tile_max_rows: int = Field(500, alias="NEARBY_TILE_MAX_ROWS")
+
+    dog_cache_ttl_s: float = Field(300.0, alias="DOG_CACHE_TTL_S")
+    dog_cache_max_bytes: int = Field(16 * 1024 * 1024, alias="DOG_CACHE_MAX_BYTES")
+
+    metrics_enabled: bool = Field(True, alias="METRICS_ENABLED")
+    metrics_slow_request_ms: float = Field(0.0, alias="METRICS_SLOW_REQUEST_MS")
+    metrics_slow_sample_rate: float = Field(1.0, alias="METRICS_SLOW_SAMPLE_RATE")
 
     api_host: str = Field("0.0.0.0", alias="API_HOST")
     api_port: int = Field(8080, alias="API_PORT")
@@ -1,49 +1,287 @@
+import asyncio
+import contextvars
+import time
 from contextlib import asynccontextmanager
-import psycopg
+from typing import Callable
+import numpy as np
 from psycopg.rows import dict_row
+from psycopg.types.json import Jsonb
+from psycopg_pool import AsyncConnectionPool
 from .config import settings
+from .services import metrics
+from .services.metrics import timed
+from .utils.centroids import CentroidAccumulator, merge_centroid
+from .utils.pgvector import register_vector
 
 _pool = None
 
+def use_prepared() -> bool | None:
+    # prepare= argument for the fixed statements: True plans them once per connection
+    # (psycopg keeps them as named server-side statements); None leaves it to the
+    # connection, which has preparation disabled when DB_PREPARE=false (e.g. behind
+    # a transaction-mode pgbouncer).
+    return True if settings.db_prepare else None
+
+async def _configure(conn):
+    await register_vector(conn)
+    if not settings.db_prepare:
+        conn.prepare_threshold = None
+
 async def init_db():
     global _pool
-    _pool = await psycopg.AsyncConnectionPool.connect(
+    _pool = AsyncConnectionPool(
         conninfo=settings.database_url,
-        min_size=1, max_size=10, kwargs={"autocommit": True}
+        min_size=settings.db_pool_min_size, max_size=max(settings.db_pool_min_size, settings.db_pool_max_size),
+        timeout=settings.db_pool_timeout_s, max_waiting=settings.db_pool_max_waiting,
+        kwargs={"autocommit": True}, configure=_configure, open=False,
     )
+    # warm-up: block startup until min_size connections are connected and configured
+    t0 = time.perf_counter()
+    await _pool.open(wait=True, timeout=settings.db_pool_timeout_s)
+    print(f"[db] Pool ready: {settings.db_pool_min_size}..{_pool.max_size} connections "
+          f"in {time.perf_counter() - t0:.2f}s (prepare={settings.db_prepare})")
 
 async def close_db():
     if _pool:
         await _pool.close()
 
+_POOL_GAUGES = ("pool_min", "pool_max", "pool_size", "pool_available", "requests_waiting")
+
+def _pool_metrics() -> list[str]:
+    if _pool is None:
+        return []
+    lines = []
+    for k, v in sorted(_pool.get_stats().items()):
+        kind = "gauge" if k in _POOL_GAUGES else "counter"
+        lines += metrics.gauge(f"petid_db_{k}", f"psycopg_pool {k}.", {"": v}, kind=kind)
+    return lines
+
+metrics.register_collector(_pool_metrics)
+
 @asynccontextmanager
-async def get_conn():
+async def _checkout():
+    t0 = time.perf_counter()
     async with _pool.connection() as conn:
+        metrics.record_stage("db.checkout", time.perf_counter() - t0)
+        yield conn
+
+class _Session:
+    # Request-scoped connection, checked out on first use and returned when the
+    # session closes, so several helpers in one handler share a single checkout.
+    def __init__(self):
+        self.conn = None
+        self._cm = None
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if self.conn is None:
+            async with self._lock:
+                if self.conn is None:
+                    cm = _checkout()
+                    self.conn = await cm.__aenter__()
+                    self._cm = cm
+        return self.conn
+
+    async def release(self, exc: BaseException | None):
+        cm, self._cm, self.conn = self._cm, None, None
+        if cm is not None:
+            await cm.__aexit__(type(exc) if exc else None, exc, exc.__traceback__ if exc else None)
+
+_session: contextvars.ContextVar[_Session | None] = contextvars.ContextVar("petid_db_session", default=None)
+
+@asynccontextmanager
+async def session():
+    if _session.get() is not None:
+        yield
+        return
+    s = _Session()
+    token = _session.set(s)
+    exc = None
+    try:
+        yield
+    except BaseException as e:
+        exc = e
+        raise
+    finally:
+        _session.reset(token)
+        await s.release(exc)
+
+@asynccontextmanager
+async def connection():
+    s = _session.get()
+    if s is not None:
+        yield await s.acquire()
+        return
+    async with _checkout() as conn:
+        yield conn
+
+@asynccontextmanager
+async def pipeline():
+    # Statements issued inside (e.g. from asyncio.gather) are sent without waiting
+    # for each other's results. Needs an open session to span several helpers.
+    async with connection() as conn:
+        async with conn.pipeline():
+            yield conn
+
+@asynccontextmanager
+async def get_conn():
+    async with connection() as conn:
         async with conn.cursor(row_factory=dict_row) as cur:
             yield conn, cur
 
+def pool_status() -> dict | None:
+    if _pool is None:
+        return None
+    st = _pool.get_stats()
+    size, available, waiting = st.get("pool_size", 0), st.get("pool_available", 0), st.get("requests_waiting", 0)
+    return {
+        "min_size": _pool.min_size,
+        "max_size": _pool.max_size,
+        "size": size,
+        "available": available,
+        "waiting": waiting,
+        "saturated": size >= _pool.max_size and available == 0 and waiting > 0,
+    }
+
+async def ping(timeout_s: float = 2.0) -> bool:
+    try:
+        async with asyncio.timeout(timeout_s):
+            async with get_conn() as (_, cur):
+                await cur.execute("select 1")
+                return (await cur.fetchone()) is not None
+    except Exception:
+        return False
+
 async def exec_sql(sql: str, params: tuple | list | None = None):
     async with get_conn() as (_, cur):
         await cur.execute(sql, params or ())
 
-async def rpc_store_photo_embedding(photo_id: str, vec: list[float]):
-    sql = "select public.store_photo_embedding(%s, %s::vector);"
+_STORE_CODE_SQL = ("update public.photos set embedding_bin = binary_quantize(embedding)::bit(%d) "
+                   "where id = %%s::uuid" % settings.embed_vector_size)
+
+@timed("db.store_photo_embedding")
+async def rpc_store_photo_embedding(photo_id: str, vec: np.ndarray):
+    sql = "select public.store_photo_embedding(%s, %b);"
     async with get_conn() as (_, cur):
-        await cur.execute(sql, (photo_id, f"[{', '.join(map(str, vec))}]"))
+        await cur.execute(sql, (photo_id, vec), prepare=use_prepared())
+        if settings.quant_store_codes:
+            # sign bits next to the float vector (ops/sql/embedding_codes.sql)
+            await cur.execute(_STORE_CODE_SQL, (photo_id,), prepare=use_prepared())
 
-async def rpc_match_dogs(vec: list[float], lat: float | None, lon: float | None, k: int = 5):
+@timed("db.match_dogs")
+async def rpc_match_dogs(vec: np.ndarray, lat: float | None, lon: float | None, k: int = 5):
     sql = """
-    select * from public.match_dogs(%s::vector, %s::double precision, %s::double precision, %s::int);
+    select * from public.match_dogs(%b, %s::double precision, %s::double precision, %s::int);
     """
     async with get_conn() as (_, cur):
-        await cur.execute(sql, (f"[{', '.join(map(str, vec))}]", lat, lon, k))
+        await cur.execute(sql, (vec, lat, lon, k), prepare=use_prepared())
         rows = await cur.fetchall()
         return rows
 
+# Geo/recency scoring shared by the index-backed match paths; {candidates} is a
+# CTE body yielding (dog_id, visual) and supplies the leading parameters.
+_SCORE_SQL = """
+with c as (
+  {candidates}
+), q as (
+  select case when %s::double precision is null or %s::double precision is null then null
+              else ST_SetSRID(ST_MakePoint(%s::double precision, %s::double precision), 4326) end as pt
+), last as (
+  select distinct on (p.dog_id) p.dog_id, p.geom, p.taken_at
+  from public.photos p
+  where p.dog_id in (select dog_id from c)
+  order by p.dog_id, p.taken_at desc nulls last
+), s as (
+  select d.id as dog_id, d.display_name, d.primary_photo_url, c.visual,
+         coalesce(exp(-(ST_DistanceSphere(l.geom::geometry, q.pt) / 1000.0) / %s::double precision), 0) as geo,
+         coalesce(exp(-(extract(epoch from now() - l.taken_at) / 86400.0) / %s::double precision), 0) as recency
+  from c
+  join public.dogs d on d.id = c.dog_id
+  left join last l on l.dog_id = c.dog_id
+  cross join q
+)
+select *, %s::double precision * visual + %s::double precision * geo + %s::double precision * recency as final_score
+from s
+order by final_score desc
+limit %s;
+"""
+
+_DOG_CANDIDATES_SQL = _SCORE_SQL.format(
+    candidates="select * from unnest(%s::uuid[], %s::double precision[]) as c(dog_id, visual)")
+
+# exact float rerank of coarse photo candidates, best photo per dog
+_PHOTO_CANDIDATES_SQL = _SCORE_SQL.format(candidates="""select p.dog_id, max(1 - (p.embedding <=> %b)) as visual
+  from public.photos p
+  where p.id = any(%s::uuid[]) and p.dog_id is not null and p.embedding is not null
+  group by p.dog_id""")
+
+def _score_params(lat: float | None, lon: float | None, k: int) -> tuple:
+    return (lat, lon, lon, lat, settings.match_geo_scale_km, settings.match_recency_days,
+            settings.match_weight_visual, settings.match_weight_geo, settings.match_weight_recency, k)
+
+# Per-shot match_dogs lists for several photos in one statement, plus the fused
+# ranking: visual is the max or the mean over shots (a shot where the dog is not
+# in the list contributes 0 to the mean), geo/recency are per dog. Rows with
+# shot = 0 are the fused result; shots are numbered from 1.
+_MATCH_BATCH_SQL = """
+with per as (
+  select q.shot::int as shot, m.*
+  from unnest(%b::vector[]) with ordinality as q(v, shot)
+  cross join lateral public.match_dogs(q.v, %s::double precision, %s::double precision, %s::int) m
+), fused as (
+  select dog_id, display_name, primary_photo_url,
+         case when %s::text = 'mean' then sum(visual) / %s::double precision else max(visual) end as visual,
+         max(geo) as geo, max(recency) as recency
+  from per
+  group by dog_id, display_name, primary_photo_url
+), ranked as (
+  select 0 as shot, dog_id, display_name, primary_photo_url, visual, geo, recency,
+         %s::double precision * visual + %s::double precision * geo + %s::double precision * recency as final_score
+  from fused
+  order by final_score desc
+  limit %s
+)
+select * from ranked
+union all
+select shot, dog_id, display_name, primary_photo_url, visual, geo, recency, final_score from per
+order by shot, final_score desc;
+"""
+
+@timed("db.match_dogs_batch")
+async def rpc_match_dogs_batch(vecs: list[np.ndarray], lat: float | None, lon: float | None,
+                               k: int = 5, depth: int = 20, fusion: str = "max") -> list[dict]:
+    params = (list(vecs), lat, lon, max(k, depth), fusion, len(vecs),
+              settings.match_weight_visual, settings.match_weight_geo, settings.match_weight_recency, k)
+    async with get_conn() as (_, cur):
+        await cur.execute(_MATCH_BATCH_SQL, params, prepare=use_prepared())
+        return await cur.fetchall()
+
+@timed("db.match_dog_candidates")
+async def rpc_match_dog_candidates(candidates: list[tuple[str, float]], lat: float | None,
+                                   lon: float | None, k: int = 5):
+    # Geo/recency scoring for visual candidates picked by the in-process index.
+    dog_ids = [d for d, _ in candidates]
+    visual = [v for _, v in candidates]
+    async with get_conn() as (_, cur):
+        await cur.execute(_DOG_CANDIDATES_SQL, (dog_ids, visual) + _score_params(lat, lon, k),
+                          prepare=use_prepared())
+        return await cur.fetchall()
+
+@timed("db.match_photo_candidates")
+async def rpc_match_photo_candidates(photo_ids: list[str], vec: np.ndarray, lat: float | None,
+                                     lon: float | None, k: int = 5):
+    # Second stage of two-stage matching: photos shortlisted from compact codes are
+    # rescored with the exact float embedding before geo/recency scoring.
+    async with get_conn() as (_, cur):
+        await cur.execute(_PHOTO_CANDIDATES_SQL, (vec, photo_ids) + _score_params(lat, lon, k),
+                          prepare=use_prepared())
+        return await cur.fetchall()
+
+@timed("db.confirm_match")
 async def rpc_confirm_match(sighting_id: str, chosen_dog_id: str | None, display_name: str | None):
     sql = "select public.confirm_match(%s::uuid, %s::uuid, %s::text);"
     async with get_conn() as (_, cur):
-        await cur.execute(sql, (sighting_id, chosen_dog_id, display_name))
+        await cur.execute(sql, (sighting_id, chosen_dog_id, display_name), prepare=use_prepared())
         row = await cur.fetchone()
         return row["confirm_match"]
 
@@ -52,16 +290,266 @@ async def api_upsert_photo_analysis(photo_id: str, phash_bytes: bytes | None,
                                     lbp_hist: list[float] | None,
                                     attributes_json: dict | None):
     sql = "select api.upsert_photo_analysis(%s, %s, %s, %s, %s);"
-    await exec_sql(sql, (photo_id, phash_bytes, lab_hist, lbp_hist, attributes_json))
+    await exec_sql(sql, (photo_id, phash_bytes, lab_hist, lbp_hist, _jsonb(attributes_json)))
+
+def _jsonb(obj: dict | None):
+    return Jsonb(obj) if obj is not None else None
+
+_PHOTO_ROWS_SQL = ("select id::text as id, dog_id::text as dog_id, ST_Y(geom::geometry) as lat, "
+                   "ST_X(geom::geometry) as lon from public.photos where id = any(%s::uuid[])")
+
+@timed("db.save_photo_analyses")
+async def api_save_photo_analyses(analyses: list[dict], update_centroids: bool = True) -> tuple[int, dict[str, dict]]:
+    # Persists analyses and their patches on one connection in one pipelined
+    # transaction. The writes are queued without waiting; the round trips are the
+    # photo-row read, the centroid read (only when owned patches were saved) and the
+    # commit, however many photos and patches the batch holds. Each item has
+    # photo_id, phash, lab, lbp, attributes and patches [{part, bbox, embedding, score}].
+    # Patches of photos that already belong to a dog are folded into its part centroids.
+    # Returns the patch count and each photo's {dog_id, lat, lon}, read in the same
+    # transaction so callers need no follow-up lookup.
+    analysis_sql = "select api.upsert_photo_analysis(%s, %s, %s, %s, %s);"
+    patch_sql = "select api.insert_photo_patch(%s, %s, %s, %b, %s);"
+    analysis_rows = [(a["photo_id"], a.get("phash"), a.get("lab"), a.get("lbp"), _jsonb(a.get("attributes")))
+                     for a in analyses]
+    patch_rows = [(a["photo_id"], p.get("part", "unknown"), p["bbox"], p["embedding"], float(p["score"]))
+                  for a in analyses for p in a.get("patches") or []]
+    changed: set[str] = set()
+    async with connection() as conn:
+        async with conn.pipeline(), conn.transaction():
+            async with conn.cursor(row_factory=dict_row) as cur:
+                await cur.executemany(analysis_sql, analysis_rows)
+                if patch_rows:
+                    await cur.executemany(patch_sql, patch_rows)
+                await cur.execute(_PHOTO_ROWS_SQL, ([a["photo_id"] for a in analyses],))
+                photos = {r["id"]: {"dog_id": r["dog_id"], "lat": r["lat"], "lon": r["lon"]}
+                          for r in await cur.fetchall()}
+                owners = {pid: p["dog_id"] for pid, p in photos.items() if p["dog_id"]}
+                owned = [r for r in patch_rows if r[0] in owners] if update_centroids else []
+                if owned:
+                    acc = CentroidAccumulator()
+                    acc.add([owners[r[0]] for r in owned], [r[1] for r in owned],
+                            np.stack([r[3] for r in owned]))
+                    await _apply_centroid_deltas(cur, acc.deltas())
+                    changed = {owners[r[0]] for r in owned}
+    _centroids_changed(changed)
+    return len(patch_rows), photos
+
+async def api_save_photo_analysis(photo_id: str, phash_bytes: bytes | None,
+                                  lab_hist: list[float] | None, lbp_hist: list[float] | None,
+                                  attributes_json: dict | None, patches: list[dict]) -> tuple[int, dict | None]:
+    # patch count and the photo's {dog_id, lat, lon} (None if the photo row is missing)
+    saved, photos = await api_save_photo_analyses([{
+        "photo_id": photo_id, "phash": phash_bytes, "lab": lab_hist, "lbp": lbp_hist,
+        "attributes": attributes_json, "patches": patches,
+    }])
+    return saved, photos.get(photo_id)
 
 async def api_insert_photo_patch(photo_id: str, part: str, bbox: list[int],
-                                 embedding_vec: list[float], score: float) -> None:
-    sql = "select api.insert_photo_patch(%s, %s, %s, %s::vector, %s);"
-    vec_literal = f"[{', '.join(map(str, embedding_vec))}]"
-    await exec_sql(sql, (photo_id, part, bbox, vec_literal, score))
+                                 embedding_vec: np.ndarray, score: float) -> None:
+    sql = "select api.insert_photo_patch(%s, %s, %s, %b, %s);"
+    await exec_sql(sql, (photo_id, part, bbox, embedding_vec, score))
+
+_UPSERT_CENTROID_SQL = "select api.upsert_dog_part_centroid(%s, %s, %b, %s);"
+
+# called with the dog ids whose part centroids changed, after the write commits
+_centroid_listeners: list[Callable[[set[str]], None]] = []
+
+def on_centroids_changed(fn: Callable[[set[str]], None]):
+    _centroid_listeners.append(fn)
+
+def _centroids_changed(dog_ids):
+    dogs = {d for d in dog_ids if d}
+    if dogs:
+        for fn in _centroid_listeners:
+            fn(dogs)
+
+# Per-dog transaction lock shared by the incremental merge and the full rebuild.
+# Row locks alone cannot cover a part that has no centroid row yet.
+_LOCK_DOGS_SQL = ("select pg_advisory_xact_lock(hashtextextended('dog_part_centroids:' || d, 0)) "
+                  "from (select distinct unnest(%s::text[]) as d order by 1) s")
+
+async def _apply_centroid_deltas(cur, deltas: dict[tuple[str, str], tuple[np.ndarray, int]]):
+    # Must run inside a transaction: locks the affected dogs and centroid rows, merges
+    # the running sums and writes them back (or drops parts whose count reaches zero).
+    keys = list(deltas)
+    await cur.execute(_LOCK_DOGS_SQL, ([d for d, _ in keys],))
+    await cur.execute("""
+    select c.dog_id::text as dog_id, c.part, c.centroid, c.n_patches
+    from public.dog_part_centroids c
+    join unnest(%s::uuid[], %s::text[]) as k(dog_id, part) on k.dog_id = c.dog_id and k.part = c.part
+    for update of c
+    """, ([d for d, _ in keys], [p for _, p in keys]), binary=True)
+    existing = {(r["dog_id"], r["part"]): (r["centroid"], r["n_patches"]) for r in await cur.fetchall()}
+    upserts, dropped = [], []
+    for key, (dsum, dn) in deltas.items():
+        mean, n = merge_centroid(existing.get(key), dsum, dn)
+        if n > 0:
+            upserts.append((key[0], key[1], mean, n))
+        elif key in existing:
+            dropped.append(key)
+    if upserts:
+        await cur.executemany(_UPSERT_CENTROID_SQL, upserts)
+    if dropped:
+        await cur.execute("""
+        delete from public.dog_part_centroids c
+        using unnest(%s::uuid[], %s::text[]) as k(dog_id, part)
+        where c.dog_id = k.dog_id and c.part = k.part
+        """, ([d for d, _ in dropped], [p for _, p in dropped]))
+
+async def api_upsert_dog_part_centroids(rows: list[tuple[str, str, np.ndarray, int]]) -> None:
+    async with connection() as conn:
+        async with conn.pipeline(), conn.transaction():
+            async with conn.cursor() as cur:
+                await cur.executemany(_UPSERT_CENTROID_SQL, rows)
+    _centroids_changed(r[0] for r in rows)
+
+async def api_remove_photo_patches(photo_id: str) -> dict:
+    # Deletes a photo's patches and subtracts them from its dog's part centroids.
+    async with connection() as conn:
+        async with conn.transaction():
+            async with conn.cursor(row_factory=dict_row) as cur:
+                await cur.execute("""
+                delete from public.photo_patches pp
+                using public.photos p
+                where pp.photo_id = p.id and pp.photo_id = %s::uuid
+                returning p.dog_id::text as dog_id, coalesce(pp.part, 'unknown') as part, pp.embedding
+                """, (photo_id,), binary=True)
+                rows = await cur.fetchall()
+                owned = [r for r in rows if r["dog_id"]]
+                if owned:
+                    acc = CentroidAccumulator()
+                    acc.add_rows(owned, sign=-1)
+                    await _apply_centroid_deltas(cur, acc.deltas())
+    _centroids_changed(r["dog_id"] for r in owned)
+    return {"patches_removed": len(rows), "parts_updated": sorted({r["part"] for r in owned})}
+
+async def iter_patch_embeddings(dog_ids: list[str], batch_size: int = 2000):
+    # Streams (dog_id, part, embedding) rows through a server-side cursor.
+    sql = """
+    select p.dog_id::text as dog_id, coalesce(pp.part, 'unknown') as part, pp.embedding
+    from public.photo_patches pp
+    join public.photos p on p.id = pp.photo_id
+    where p.dog_id = any(%s::uuid[])
+    """
+    async with connection() as conn:
+        async with conn.transaction():
+            async with conn.cursor(name="patch_stream", row_factory=dict_row) as cur:
+                await cur.execute(sql, (dog_ids,), binary=True)
+                while rows := await cur.fetchmany(batch_size):
+                    yield rows
+
+async def api_rebuild_dog_part_centroids(dog_ids: list[str],
+                                         batch_size: int = 2000) -> list[tuple[str, str, np.ndarray, int]]:
+    # Full rebuild in one transaction: takes the dogs' locks (so incremental merges
+    # wait), recomputes every part from photo_patches, then replaces the dogs'
+    # centroid rows. Parts whose patches are gone are deleted.
+    acc = CentroidAccumulator()
+    async with session():
+        async with connection() as conn:
+            async with conn.transaction():
+                async with conn.cursor() as cur:
+                    await cur.execute(_LOCK_DOGS_SQL, (dog_ids,))
+                    await cur.execute("select 1 from public.dog_part_centroids "
+                                      "where dog_id = any(%s::uuid[]) for update", (dog_ids,))
+                    async for rows in iter_patch_embeddings(dog_ids, batch_size):
+                        acc.add_rows(rows)
+                    results = acc.results()
+                    await cur.execute("delete from public.dog_part_centroids where dog_id = any(%s::uuid[])",
+                                      (dog_ids,))
+                    if results:
+                        await cur.executemany(_UPSERT_CENTROID_SQL, results)
+    _centroids_changed(dog_ids)
+    return results
+
+async def fetch_dog_ids(after: str | None, limit: int) -> list[str]:
+    sql = "select id::text as id from public.dogs where (%s::uuid is null or id > %s::uuid) order by id limit %s"
+    async with get_conn() as (_, cur):
+        await cur.execute(sql, (after, after, limit))
+        return [r["id"] for r in await cur.fetchall()]
 
 async def api_upsert_dog_part_centroid(dog_id: str, part: str,
-                                       centroid_vec: list[float], n_patches: int) -> None:
-    sql = "select api.upsert_dog_part_centroid(%s, %s, %s::vector, %s);"
-    vec_literal = f"[{', '.join(map(str, centroid_vec))}]"
-    await exec_sql(sql, (dog_id, part, vec_literal, n_patches))
+                                       centroid_vec: np.ndarray, n_patches: int) -> None:
+    sql = "select api.upsert_dog_part_centroid(%s, %s, %b, %s);"
+    await exec_sql(sql, (dog_id, part, centroid_vec, n_patches))
+    _centroids_changed([dog_id])
+
+async def fetch_part_centroids(dog_ids: list[str]) -> list[dict]:
+    sql = ("select dog_id::text as dog_id, part, centroid from public.dog_part_centroids "
+           "where dog_id = any(%s::uuid[]) and n_patches > 0 order by dog_id, part")
+    async with get_conn() as (_, cur):
+        await cur.execute(sql, (dog_ids,), binary=True, prepare=use_prepared())
+        return await cur.fetchall()
+
+async def fetch_photo_embeddings(dog_id: str | None = None) -> tuple[list[str], list[str | None], np.ndarray]:
+    sql = "select id::text as id, dog_id::text as dog_id, embedding from public.photos where embedding is not null"
+    params: tuple = ()
+    if dog_id is not None:
+        sql += " and dog_id = %s::uuid"
+        params = (dog_id,)
+    photo_ids, dog_ids, vecs = [], [], []
+    async with get_conn() as (_, cur):
+        await cur.execute(sql, params, binary=True)
+        async for r in cur:
+            photo_ids.append(r["id"])
+            dog_ids.append(r["dog_id"])
+            vecs.append(r["embedding"])
+    mat = np.stack(vecs) if vecs else np.empty((0, settings.embed_vector_size), dtype=np.float32)
+    return photo_ids, dog_ids, mat
+
+async def fetch_photo_codes(dog_id: str | None = None) -> tuple[list[str], list[str | None], np.ndarray]:
+    # stored sign codes (text form of bit(n)), packed to bytes like quantize.sign_bits
+    sql = ("select id::text as id, dog_id::text as dog_id, embedding_bin::text as code "
+           "from public.photos where embedding_bin is not null")
+    params: tuple = ()
+    if dog_id is not None:
+        sql += " and dog_id = %s::uuid"
+        params = (dog_id,)
+    photo_ids, dog_ids, raw = [], [], []
+    async with get_conn() as (_, cur):
+        await cur.execute(sql, params)
+        async for r in cur:
+            photo_ids.append(r["id"])
+            dog_ids.append(r["dog_id"])
+            raw.append(r["code"])
+    bits = np.frombuffer("".join(raw).encode(), dtype=np.uint8).reshape(len(raw), -1) - ord("0") \
+        if raw else np.empty((0, settings.embed_vector_size), dtype=np.uint8)
+    return photo_ids, dog_ids, np.packbits(bits, axis=1)
+
+async def fetch_photo_dog_ids(photo_ids: list[str]) -> dict[str, str | None]:
+    sql = "select id::text as id, dog_id::text as dog_id from public.photos where id = any(%s::uuid[])"
+    async with get_conn() as (_, cur):
+        await cur.execute(sql, (photo_ids,), prepare=use_prepared())
+        rows = await cur.fetchall()
+    return {r["id"]: r["dog_id"] for r in rows}
+
+async def fetch_photo_phashes(dog_id: str | None = None) -> tuple[list[str], list[str | None], np.ndarray]:
+    sql = ("select a.photo_id::text as id, p.dog_id::text as dog_id, a.phash from public.photo_analysis a "
+           "join public.photos p on p.id = a.photo_id where a.phash is not null")
+    params: tuple = ()
+    if dog_id is not None:
+        sql += " and p.dog_id = %s::uuid"
+        params = (dog_id,)
+    photo_ids, dog_ids, raw = [], [], []
+    async with get_conn() as (_, cur):
+        await cur.execute(sql, params, binary=True)
+        async for r in cur:
+            photo_ids.append(r["id"])
+            dog_ids.append(r["dog_id"])
+            raw.append(bytes(r["phash"]))
+    codes = np.frombuffer(b"".join(raw), dtype=">u8").astype(np.uint64)
+    return photo_ids, dog_ids, codes
+
+async def fetch_photo_histograms(dog_id: str | None = None) -> list[dict]:
+    # stored appearance histograms with each photo's dog and location
+    sql = ("select a.photo_id::text as id, p.dog_id::text as dog_id, a.lab_histogram as lab, "
+           "a.lbp_histogram as lbp, ST_Y(p.geom::geometry) as lat, ST_X(p.geom::geometry) as lon "
+           "from public.photo_analysis a join public.photos p on p.id = a.photo_id "
+           "where a.lab_histogram is not null and a.lbp_histogram is not null")
+    params: tuple = ()
+    if dog_id is not None:
+        sql += " and p.dog_id = %s::uuid"
+        params = (dog_id,)
+    async with get_conn() as (_, cur):
+        await cur.execute(sql, params, binary=True)
+        return await cur.fetchall()
@@ -1,18 +1,111 @@
-from fastapi import FastAPI
+import time
+_T_IMPORT = time.perf_counter()
+
+import asyncio
+import logging
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from .config import settings
 from .db import init_db, close_db
-from .services.embedding import init_embedder
-from .routers import health, match, photos, analyze, centroids, dogs, notify, links
+from .services.embedding import init_embedder, close_embedder
+from .services import ann, appearance, dedup
+from .services.cache import init_cache, init_dog_cache, init_nearby_cache
+from .services.fcm import close_fcm
+from .services.metrics import MetricsMiddleware, gauge, register_collector
+from .services.http_client import init_http, close_http, FetchTooLarge
+from .services.jobs import JobQueueFull, close_jobs
+from .services.uploads import UploadFormatError, UploadTooLarge
+from .services.workers import init_workers, close_workers, PoolSaturated
+from .routers import health, match, photos, analyze, centroids, dogs, notify, links, metrics
 
 app = FastAPI(title="PetID API", version="1.2")
+app.add_middleware(MetricsMiddleware)
+
+# seconds per startup phase; "imports" covers this module's import graph (FastAPI and routers)
+startup_report: dict[str, float] = {}
+
+async def _phase(name: str, fn, *args):
+    t0 = time.perf_counter()
+    try:
+        res = fn(*args)
+        return await res if asyncio.iscoroutine(res) else res
+    finally:
+        startup_report[name] = time.perf_counter() - t0
+
+# uvicorn's error logger, which also reports failed startups (with the traceback)
+log = logging.getLogger("uvicorn.error")
+
+async def _load_index(tag: str, load, fallback: str):
+    # a failed index load degrades the feature instead of failing startup
+    try:
+        await load()
+    except Exception:
+        log.exception(f"[{tag}] Index load failed, {fallback}")
 
 @app.on_event("startup")
 async def _startup():
-    await init_db()
-    init_embedder()
+    t0 = time.perf_counter()
+    # The embedder (ONNX session build + warm-up) is CPU-bound and independent of the
+    # database, so it runs on a thread while the pool connects and the indexes load.
+    embedder = asyncio.create_task(_phase("embedder", asyncio.to_thread, init_embedder))
+    try:
+        await _phase("db", init_db)
+        init_workers()
+        init_http()
+        if settings.cache_max_bytes > 0:
+            init_cache()
+        if settings.dog_cache_ttl_s > 0 and settings.dog_cache_max_bytes > 0:
+            init_dog_cache()
+        if settings.nearby_cache_ttl_s > 0 and settings.nearby_cache_max_bytes > 0:
+            init_nearby_cache()
+        loads = []
+        if ann.enabled():
+            loads.append(_phase("ann_index", _load_index, "ann", ann.load_index,
+                                "falling back to SQL matching"))
+        if dedup.enabled():
+            loads.append(_phase("dedup_index", _load_index, "dedup", dedup.load_index,
+                                "duplicate checks disabled"))
+        if appearance.enabled():
+            loads.append(_phase("appearance_index", _load_index, "appearance", appearance.load_index,
+                                "appearance search disabled"))
+        await asyncio.gather(*loads)
+    finally:
+        await embedder
+    startup_report["startup"] = time.perf_counter() - t0
+    print("[startup] " + " ".join(f"{k}={v:.2f}s" for k, v in startup_report.items()))
+
+register_collector(lambda: gauge("petid_startup_seconds", "Duration of each startup phase.",
+                                 startup_report, label="phase"))
 
 @app.on_event("shutdown")
 async def _shutdown():
+    # background jobs use the pool and the embedder, so they stop first
+    await close_jobs()
     await close_db()
+    close_embedder()
+    close_workers()
+    await close_http()
+    await close_fcm()
+
+@app.exception_handler(PoolSaturated)
+async def _pool_saturated(request: Request, exc: PoolSaturated):
+    return JSONResponse({"detail": str(exc)}, status_code=503, headers={"Retry-After": "1"})
+
+@app.exception_handler(JobQueueFull)
+async def _job_queue_full(request: Request, exc: JobQueueFull):
+    return JSONResponse({"detail": str(exc)}, status_code=503, headers={"Retry-After": "5"})
+
+@app.exception_handler(FetchTooLarge)
+async def _fetch_too_large(request: Request, exc: FetchTooLarge):
+    return JSONResponse({"detail": str(exc)}, status_code=413)
+
+@app.exception_handler(UploadTooLarge)
+async def _upload_too_large(request: Request, exc: UploadTooLarge):
+    return JSONResponse({"detail": str(exc)}, status_code=413)
+
+@app.exception_handler(UploadFormatError)
+async def _upload_format(request: Request, exc: UploadFormatError):
+    return JSONResponse({"detail": str(exc)}, status_code=400)
 
 app.include_router(health.router)
 app.include_router(match.router)
@@ -22,3 +115,6 @@ app.include_router(centroids.router)
 app.include_router(dogs.router)
 app.include_router(notify.router)
 app.include_router(links.router)
+app.include_router(metrics.router)
+
+startup_report["imports"] = time.perf_counter() - _T_IMPORT
@@ -1,49 +1,217 @@
 from typing import Optional
-import httpx
 from fastapi import APIRouter, UploadFile, File, HTTPException, Query
-from PIL import Image
 import numpy as np
-import io
 
-from ..db import api_upsert_photo_analysis, api_insert_photo_patch
-from ..services.markings import phash64, lab_histogram, lbp_histogram, pick_distinctive_patches
+from ..config import settings
+from ..db import api_save_photo_analysis, rpc_store_photo_embedding, session
+from ..services import ann, appearance, dedup, embedding, metrics
+from ..services.cache import content_digest, get_features_cache, invalidate_dogs
+from ..services.http_client import fetch_bytes
+from ..services.jobs import get_queue
+from ..services.markings import appearance_histograms, extract_ingest_features, extract_markings, patch_tensors, phash_image_bytes
+from ..services.uploads import store_object
+from ..services.workers import run_cpu
 
 router = APIRouter(prefix="/v1", tags=["analyze"])
 
-async def _load_image(file: UploadFile | None, url: Optional[str]) -> Image.Image:
+async def _load_bytes(file: UploadFile | None, url: Optional[str]) -> bytes:
     if file is not None:
         data = await file.read()
         if not data:
             raise HTTPException(400, "Empty file")
-        return Image.open(io.BytesIO(data)).convert("RGB")
+        return data
     if url:
-        async with httpx.AsyncClient(timeout=30) as client:
-            r = await client.get(url)
-            r.raise_for_status()
-            return Image.open(io.BytesIO(r.content)).convert("RGB")
+        return await fetch_bytes(url)
     raise HTTPException(400, "Provide file or url")
 
-def _rand_vec(dim: int = 128) -> list[float]:
+async def _digest(data: bytes) -> str | None:
+    return await run_cpu(content_digest, data) if get_features_cache() is not None else None
+
+async def _markings(data: bytes, k: int = 5, win: int = 64, stride: int = 32,
+                    digest: str | None = None) -> dict:
+    cache = get_features_cache()
+    key = None
+    if cache is not None:
+        key = f"mk:{settings.histogram_engine}:{k}:{win}:{stride}:{digest or await run_cpu(content_digest, data)}"
+        feats = await cache.aget(key)
+        if feats is not None:
+            return feats
+    with metrics.stage("markings"):
+        feats = await run_cpu(extract_markings, data, k=k, win=win, stride=stride)
+    if key is not None:
+        await cache.aput(key, feats)
+    return feats
+
+async def _phash(data: bytes, digest: str | None = None) -> bytes:
+    cache = get_features_cache()
+    key = None
+    if cache is not None:
+        key = f"ph:{digest or await run_cpu(content_digest, data)}"
+        ph = await cache.aget(key)
+        if ph is not None:
+            return ph
+    with metrics.stage("phash"):
+        ph = await run_cpu(phash_image_bytes, data)
+    if key is not None:
+        await cache.aput(key, ph)
+    return ph
+
+def _rand_vec(dim: int = 128) -> np.ndarray:
     v = np.random.rand(dim).astype("float32")
     v /= (np.linalg.norm(v) + 1e-9)
-    return v.tolist()
+    return v
+
+def _model_patches() -> bool:
+    # PATCH_EMBEDDER=model embeds patch crops with the image embedder, which is what
+    # part re-ranking in /v1/match compares against; "random" keeps placeholder vectors
+    return settings.patch_embedder.lower().strip() == "model"
+
+async def _patches(feats: dict, data: bytes | None = None) -> list[dict]:
+    boxes = feats["patches"]
+    if _model_patches() and boxes:
+        tensors = feats.get("patch_tensors")
+        if tensors is None:
+            tensors = await run_cpu(patch_tensors, data, boxes)
+        vecs = list(await embedding.embed_tensors(tensors))
+    else:
+        vecs = [_rand_vec(128) for _ in boxes]
+    return [{"part": "unknown", "bbox": [x, y, w, h], "embedding": v, "score": float(score)}
+            for (x, y, w, h, score), v in zip(boxes, vecs)]
 
 @router.post("/analyze")
 async def analyze(
     photo_id: str = Query(..., description="Existing public.photos.id"),
     file: UploadFile | None = File(None),
-    url: Optional[str] = Query(None)
+    url: Optional[str] = Query(None),
+    dedup_max_distance: Optional[int] = Query(None, ge=0, le=64,
+                                              description="Skip analysis if a stored photo is this close in pHash")
+):
+    if dedup.index is not None and (dedup_max_distance or 0) > dedup.index.max_distance:
+        raise HTTPException(400, f"dedup_max_distance is limited to {dedup.index.max_distance}")
+    data = await _load_bytes(file, url)
+    digest = await _digest(data)
+    if dedup_max_distance is not None and dedup.index is not None:
+        dups = dedup.find_duplicates(await _phash(data, digest), dedup_max_distance, exclude=photo_id, limit=1)
+        if dups:
+            return {"photo_id": photo_id, "patches_saved": 0, "duplicate_of": dups[0]}
+    feats = await _markings(data, k=5, win=64, stride=32, digest=digest)
+    patches = await _patches(feats, data)
+    async with session():
+        saved, photo = await api_save_photo_analysis(photo_id, feats["phash"], feats["lab"], feats["lbp"],
+                                                     attributes_json={}, patches=patches)
+        dog_id = photo["dog_id"] if photo else None
+        dedup.on_analyze(photo_id, feats["phash"], dog_id)
+        appearance.on_analyze(photo_id, feats["lab"], feats["lbp"], photo)
+        invalidate_dogs([dog_id])
+
+    return {"photo_id": photo_id, "patches_saved": saved, "memory": feats.get("memory")}
+
+async def _run_ingest(photo_id: str, data: bytes) -> dict:
+    # one decode feeds both the embedding and the markings
+    with metrics.stage("decode"):
+        tensor, feats = await run_cpu(extract_ingest_features, data, k=5, win=64, stride=32,
+                                      crops=_model_patches())
+    with metrics.stage("embed"):
+        vec = await embedding.embed_async(tensor)
+    patches = await _patches(feats)
+    async with session():
+        await rpc_store_photo_embedding(photo_id, vec)
+        saved, photo = await api_save_photo_analysis(photo_id, feats["phash"], feats["lab"], feats["lbp"],
+                                                     attributes_json={}, patches=patches)
+        dog_id = photo["dog_id"] if photo else None
+        ann.add_photo(photo_id, vec, dog_id)
+        dedup.on_analyze(photo_id, feats["phash"], dog_id)
+        appearance.on_analyze(photo_id, feats["lab"], feats["lbp"], photo)
+        invalidate_dogs([dog_id])
+    return {"photo_id": photo_id, "embedding_dim": len(vec), "patches_saved": saved,
+            "phash": feats["phash"].hex(), "memory": feats["memory"]}
+
+@router.post("/ingest", status_code=202)
+async def ingest(
+    photo_id: str = Query(..., description="Existing public.photos.id"),
+    file: UploadFile = File(...)
 ):
-    img = await _load_image(file, url)
-    phash = phash64(img)
-    lab  = lab_histogram(img, bins=16)
-    gray = np.asarray(img.convert("L"), dtype=np.float32)
-    lbp  = lbp_histogram(gray)
-
-    patches = pick_distinctive_patches(img, k=5, win=64, stride=32)
-    await api_upsert_photo_analysis(photo_id, phash, lab, lbp, attributes_json={})
-    for (x, y, w, h, score) in patches:
-        vec = _rand_vec(128)
-        await api_insert_photo_patch(photo_id=photo_id, part="unknown", bbox=[x, y, w, h], embedding_vec=vec, score=float(score))
-
-    return {"photo_id": photo_id, "patches_saved": len(patches)}
+    # Stores the photo, then embeds, analyzes and persists it in the background.
+    # Returns once the object is in storage; poll /v1/ingest/{job_id} for the rest.
+    if embedding.batcher is None:
+        raise HTTPException(500, "Embedder not initialized")
+    data = await _load_bytes(file, None)
+    if len(data) > settings.upload_max_bytes:
+        raise HTTPException(413, f"Upload exceeds {settings.upload_max_bytes} bytes")
+    # hold the queue slot while storing so concurrent uploads can't all store
+    # an object and then be refused
+    queue = get_queue()
+    queue.reserve()
+    try:
+        url = await store_object(data, file.content_type)
+    except BaseException:
+        queue.release()
+        raise
+    job = queue.submit("ingest", _run_ingest, photo_id, data, reserved=True, photo_id=photo_id, url=url)
+    return {"job_id": job["job_id"], "status": job["status"], "photo_id": photo_id, "url": url,
+            "status_url": f"/v1/ingest/{job['job_id']}"}
+
+@router.get("/ingest/{job_id}")
+async def ingest_status(job_id: str):
+    job = get_queue().get(job_id)
+    if job is None:
+        raise HTTPException(404, "Unknown or expired job")
+    return job
+
+@router.post("/duplicates")
+async def find_duplicates(
+    file: UploadFile | None = File(None),
+    url: Optional[str] = Query(None),
+    max_distance: Optional[int] = Query(None, ge=0, le=64),
+    limit: int = Query(10, gt=0, le=100)
+):
+    data = await _load_bytes(file, url)
+    ph = await _phash(data, await _digest(data))
+    if dedup.index is None:
+        return {"phash": ph.hex(), "loaded": False, "duplicates": []}
+    n = settings.dedup_max_distance if max_distance is None else max_distance
+    return {"phash": ph.hex(), "loaded": True, "max_distance": min(n, dedup.index.max_distance),
+            "duplicates": dedup.find_duplicates(ph, n, limit=limit)}
+
+@router.get("/duplicates/index")
+async def duplicates_index_stats():
+    if dedup.index is None:
+        return {"enabled": dedup.enabled(), "loaded": False}
+    return {"enabled": dedup.enabled(), "loaded": True, **dedup.index.stats()}
+
+@router.post("/appearance/search")
+async def appearance_search(
+    file: UploadFile | None = File(None),
+    url: Optional[str] = Query(None),
+    photo_id: Optional[str] = Query(None, description="Query with this photo's stored histograms"),
+    k: int = Query(10, gt=0, le=200),
+    metric: Optional[str] = Query(None, description="chi2 or intersection"),
+    lat: Optional[float] = Query(None),
+    lon: Optional[float] = Query(None),
+    radius_km: Optional[float] = Query(None, gt=0),
+    group: str = Query("dog", description="dog: best photo per dog; photo: every photo")
+):
+    if appearance.index is None:
+        return {"loaded": False, "results": []}
+    m = (metric or appearance.metric()).lower()
+    if m not in appearance.METRICS or group not in ("dog", "photo"):
+        raise HTTPException(400, "metric must be chi2 or intersection, group dog or photo")
+    if photo_id and file is None and not url:
+        q = appearance.index.row_of(photo_id)
+        if q is None:
+            raise HTTPException(404, "No stored histograms for this photo")
+    else:
+        data = await _load_bytes(file, url)
+        with metrics.stage("appearance.histograms"):
+            q = appearance.histogram_row(*await run_cpu(appearance_histograms, data))
+    with metrics.stage("appearance.search"):
+        results = appearance.index.search(q, k, m, settings.appearance_lab_weight, lat, lon, radius_km,
+                                          by_dog=group == "dog", exclude=photo_id)
+    return {"loaded": True, "metric": m, "group": group, "results": results}
+
+@router.get("/appearance/index")
+async def appearance_index_stats():
+    if appearance.index is None:
+        return {"enabled": appearance.enabled(), "loaded": False}
+    return {"enabled": appearance.enabled(), "loaded": True, "metric": appearance.metric(),
+            **appearance.index.stats()}
@@ -1,37 +1,29 @@
 from fastapi import APIRouter, HTTPException, Query
-from ..db import get_conn, api_upsert_dog_part_centroid
-import numpy as np
+from ..db import api_rebuild_dog_part_centroids, api_remove_photo_patches, fetch_dog_ids
 
 router = APIRouter(prefix="/v1", tags=["centroids"])
 
 @router.post("/centroids/refresh-dog")
 async def refresh_dog_centroids(dog_id: str = Query(...)):
-    sql = """
-    select
-      pp.part,
-      pp.embedding
-    from public.photo_patches pp
-    join public.photos p on p.id = pp.photo_id
-    where p.dog_id = %s
-    """
-    parts = {}
-    async with get_conn() as (_, cur):
-        await cur.execute(sql, (dog_id,))
-        rows = await cur.fetchall()
-
-    for r in rows:
-        part = r["part"] or "unknown"
-        vec = np.array(r["embedding"], dtype=np.float32)
-        parts.setdefault(part, []).append(vec)
-
-    if not parts:
+    rows = await api_rebuild_dog_part_centroids([dog_id])
+    if not rows:
         raise HTTPException(404, "No patches found for this dog")
+    return {"dog_id": dog_id, "parts_updated": [p for _, p, _, _ in rows]}
 
-    for part, vecs in parts.items():
-        V = np.stack(vecs, axis=0)
-        mean = V.mean(axis=0)
-        norm = np.linalg.norm(mean) + 1e-9
-        centroid = (mean / norm).astype("float32").tolist()
-        await api_upsert_dog_part_centroid(dog_id, part, centroid, len(vecs))
+@router.post("/centroids/refresh-all")
+async def refresh_all_centroids(dogs_per_txn: int = Query(100, gt=0, le=5000)):
+    dogs = parts = 0
+    after = None
+    while True:
+        batch = await fetch_dog_ids(after, dogs_per_txn)
+        if not batch:
+            break
+        parts += len(await api_rebuild_dog_part_centroids(batch))
+        dogs += len(batch)
+        after = batch[-1]
+    return {"dogs_scanned": dogs, "parts_updated": parts}
 
-    return {"dog_id": dog_id, "parts_updated": list(parts.keys())}
+@router.post("/centroids/remove-photo")
+async def remove_photo_from_centroids(photo_id: str = Query(...)):
+    res = await api_remove_photo_patches(photo_id)
+    return {"photo_id": photo_id, **res}
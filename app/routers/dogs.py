@@ -1,8 +1,87 @@
-from fastapi import APIRouter, Query, HTTPException
-from ..db import get_conn
+import json
+import numpy as np
+from fastapi import APIRouter, Header, Query, HTTPException, Response
+from psycopg.errors import UndefinedTable
+from ..config import settings
+from ..db import get_conn, use_prepared
+from ..services.cache import content_digest, get_dog_cache, get_nearby_cache
+from ..utils.geo import geohash_encode, geohash_center, haversine_km, radius_bucket
 
 router = APIRouter(prefix="/v1", tags=["dogs"])
 
+# Latest sighting per dog. "latest" reads public.dog_last_seen (ops/sql/dog_last_seen.sql),
+# whose geography column the GiST index covers without casts; "distinct" needs no
+# migration and derives the same rows from public.photos.
+_NEARBY_LATEST_SQL = """
+with q as (select ST_SetSRID(ST_MakePoint(%(lon)s, %(lat)s), 4326)::geography as g)
+select d.id as dog_id,
+       d.display_name,
+       d.status,
+       d.primary_photo_url,
+       s.taken_at as last_seen_at,
+       ST_Y(s.geog::geometry) as last_seen_lat,
+       ST_X(s.geog::geometry) as last_seen_lon,
+       ST_Distance(s.geog, q.g, false) / 1000.0 as distance_km
+from q
+join public.dog_last_seen s on ST_DWithin(s.geog, q.g, %(r_m)s)
+join public.dogs d on d.id = s.dog_id
+order by distance_km asc, last_seen_at desc
+limit %(limit)s;
+"""
+
+_NEARBY_DISTINCT_SQL = """
+with q as (select ST_SetSRID(ST_MakePoint(%(lon)s, %(lat)s), 4326)::geography as g),
+near as (
+  select distinct p.dog_id
+  from public.photos p, q
+  where p.dog_id is not null and ST_DWithin(p.geom::geography, q.g, %(r_m)s)
+)
+select d.id as dog_id,
+       d.display_name,
+       d.status,
+       d.primary_photo_url,
+       s.taken_at as last_seen_at,
+       ST_Y(s.geom::geometry) as last_seen_lat,
+       ST_X(s.geom::geometry) as last_seen_lon,
+       ST_Distance(s.geom::geography, q.g, false) / 1000.0 as distance_km
+from near
+cross join q
+cross join lateral (
+  select p.taken_at, p.geom from public.photos p
+  where p.dog_id = near.dog_id and p.geom is not null
+  order by p.taken_at desc nulls last
+  limit 1
+) s
+join public.dogs d on d.id = near.dog_id
+where ST_DWithin(s.geom::geography, q.g, %(r_m)s)
+order by distance_km asc, last_seen_at desc
+limit %(limit)s;
+"""
+
+_has_last_seen = True
+
+async def _nearby_query(lat: float, lon: float, radius_km: float, limit: int) -> list[dict]:
+    global _has_last_seen
+    params = {"lat": lat, "lon": lon, "r_m": radius_km * 1000.0, "limit": limit}
+    if settings.nearby_mode.lower().strip() == "latest" and _has_last_seen:
+        try:
+            async with get_conn() as (_, cur):
+                await cur.execute(_NEARBY_LATEST_SQL, params, prepare=use_prepared())
+                return await cur.fetchall()
+        except UndefinedTable:
+            _has_last_seen = False
+            print("[dogs] public.dog_last_seen missing, nearby falls back to photos; apply ops/sql/dog_last_seen.sql")
+    async with get_conn() as (_, cur):
+        await cur.execute(_NEARBY_DISTINCT_SQL, params, prepare=use_prepared())
+        return await cur.fetchall()
+
+def _refine(rows: list[dict], lat: float, lon: float, radius_km: float, limit: int) -> list[dict]:
+    if not rows:
+        return []
+    dist = haversine_km(lat, lon, [r["last_seen_lat"] for r in rows], [r["last_seen_lon"] for r in rows])
+    keep = [i for i in np.argsort(dist, kind="stable").tolist() if dist[i] <= radius_km][:limit]
+    return [{**rows[i], "distance_km": float(dist[i])} for i in keep]
+
 @router.get("/dogs/nearby")
 async def dogs_nearby(
     lat: float = Query(..., ge=-90, le=90),
@@ -10,51 +89,71 @@ async def dogs_nearby(
     radius_km: float = Query(10.0, gt=0),
     limit: int = Query(50, gt=0, le=200)
 ):
-    sql = """
-    with params as (
-      select %s::double precision as lat, %s::double precision as lon, %s::double precision as r_km
-    )
-    select d.id as dog_id,
-           d.display_name,
-           d.status,
-           d.primary_photo_url,
-           p.taken_at as last_seen_at,
-           ST_Y(p.geom::geometry) as last_seen_lat,
-           ST_X(p.geom::geometry) as last_seen_lon,
-           ST_DistanceSphere(p.geom::geometry, ST_SetSRID(ST_MakePoint((select lon from params),(select lat from params)),4326)) / 1000.0 as distance_km
-    from public.dogs d
-    join public.photos p on p.dog_id = d.id
-    where p.geom is not null
-      and ST_DWithin(
-            p.geom::geography,
-            ST_SetSRID(ST_MakePoint((select lon from params),(select lat from params)),4326)::geography,
-            (select r_km from params) * 1000.0
-          )
-    order by distance_km asc, last_seen_at desc
-    limit %s;
-    """
-    async with get_conn() as (_, cur):
-        await cur.execute(sql, (lat, lon, radius_km, limit))
-        rows = await cur.fetchall()
-    return {"results": rows}
+    cache = get_nearby_cache()
+    if cache is None:
+        return {"results": await _nearby_query(lat, lon, radius_km, limit)}
+    # One entry per geohash cell and radius bucket, queried from the cell centre with
+    # the radius grown by the cell's half-diagonal so it covers every point in the
+    # cell; each poll then re-filters and re-sorts that superset for its own point.
+    tile = geohash_encode(lat, lon, settings.nearby_geohash_precision)
+    bucket = radius_bucket(radius_km)
+    key = f"nb:{settings.nearby_mode}:{tile}:{bucket}"
+    entry = cache.get(key)
+    if entry is None:
+        clat, clon, half_km = geohash_center(tile)
+        cap = settings.nearby_tile_max_rows
+        rows = await _nearby_query(clat, clon, bucket + half_km, cap + 1)
+        entry = {"rows": rows[:cap], "complete": len(rows) <= cap}
+        cache.put(key, entry)
+    if not entry["complete"]:
+        return {"results": await _nearby_query(lat, lon, radius_km, limit)}
+    return {"results": _refine(entry["rows"], lat, lon, radius_km, limit)}
 
-@router.get("/dogs/{dog_id}")
-async def dog_detail(dog_id: str):
-    sql = """
-    select d.*, 
-           coalesce(d.primary_photo_url, (select url from public.photos where dog_id=d.id order by taken_at desc limit 1)) as photo_url
-    from public.dogs d
-    where d.id = %s::uuid
-    """
+# One round trip: the dog row, its recent photos and the latest photo url as a
+# single jsonb document, which is also what gets cached and hashed for the ETag.
+_DOG_DETAIL_SQL = """
+select to_jsonb(d)
+       || jsonb_build_object(
+            'photo_url', coalesce(d.primary_photo_url, ph.photos->0->>'url'),
+            'photos', coalesce(ph.photos, '[]'::jsonb)) as dog
+from public.dogs d
+left join lateral (
+  select jsonb_agg(jsonb_build_object('id', p.id, 'url', p.url, 'taken_at', p.taken_at)
+                   order by p.taken_at desc) as photos
+  from (select id, url, taken_at from public.photos
+        where dog_id = d.id order by taken_at desc limit 12) p
+) ph on true
+where d.id = %s::uuid
+"""
+
+async def _dog_detail_entry(dog_id: str) -> tuple[str, bytes]:
+    cache = get_dog_cache()
+    key = f"dog:{dog_id}"
+    if cache is not None:
+        entry = cache.get(key)
+        if entry is not None:
+            return entry
     async with get_conn() as (_, cur):
-        await cur.execute(sql, (dog_id,))
+        await cur.execute(_DOG_DETAIL_SQL, (dog_id,), prepare=use_prepared())
         row = await cur.fetchone()
-        if not row:
-            raise HTTPException(404, "Dog not found")
-    # recent photos
-    sql_ph = "select id, url, taken_at from public.photos where dog_id=%s::uuid order by taken_at desc limit 12;"
-    async with get_conn() as (_, cur):
-        await cur.execute(sql_ph, (dog_id,))
-        photos = await cur.fetchall()
-    row["photos"] = photos
-    return row
+    if not row:
+        raise HTTPException(404, "Dog not found")
+    body = json.dumps(row["dog"], separators=(",", ":"), default=str).encode()
+    entry = (f'"{content_digest(body)}"', body)
+    if cache is not None:
+        cache.put(key, entry)
+    return entry
+
+def _etag_matches(header: str | None, etag: str) -> bool:
+    if not header:
+        return False
+    tags = [t.strip() for t in header.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+@router.get("/dogs/{dog_id}")
+async def dog_detail(dog_id: str, if_none_match: str | None = Header(None)):
+    etag, body = await _dog_detail_entry(dog_id)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
@@ -1,6 +1,28 @@
 from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+from ..db import ping, pool_status
+from ..services.cache import get_dog_cache, get_features_cache, get_nearby_cache
+
 router = APIRouter(prefix="/v1", tags=["health"])
 
 @router.get("/health")
-async def health():
-    return {"ok": True}
+async def health(ready: bool = False):
+    # ready=true is the readiness probe: 503 while the pool is saturated or the database is unreachable
+    out = {"ok": True}
+    pool = pool_status()
+    if pool is not None:
+        out["db"] = pool
+    if ready:
+        out["ready"] = pool is not None and not pool["saturated"] and await ping()
+        if not out["ready"]:
+            return JSONResponse(out, status_code=503)
+    return out
+
+@router.get("/cache/stats")
+async def cache_stats():
+    cache = get_features_cache()
+    nearby = get_nearby_cache()
+    dogs = get_dog_cache()
+    return {"features": cache.stats() if cache is not None else None,
+            "nearby": nearby.stats() if nearby is not None else None,
+            "dogs": dogs.stats() if dogs is not None else None}
@@ -1,44 +1,174 @@
+import asyncio
 import base64
-import httpx
-from fastapi import APIRouter, UploadFile, File, HTTPException
-from ..services.embedding import embedder
-from ..utils.images import load_image_from_bytes, preprocess_for_embedding
-from ..db import rpc_store_photo_embedding, rpc_match_dogs, rpc_confirm_match
+from fastapi import APIRouter, UploadFile, File, HTTPException, Query
+from pydantic import BaseModel
+from ..config import settings
+from ..services import ann, appearance, dedup, embedding, metrics, parts
+from ..services.cache import invalidate_dogs
+from ..services.http_client import fetch_bytes
+from ..services.markings import appearance_histograms, phash_image_bytes
+from ..services.workers import run_cpu
+from ..db import (fetch_photo_dog_ids, rpc_store_photo_embedding, rpc_match_dogs, rpc_match_dogs_batch,
+                  rpc_match_dog_candidates, rpc_match_photo_candidates, rpc_confirm_match, session, pipeline)
 
 router = APIRouter(prefix="/v1", tags=["match"])
 
 @router.post("/embed")
 async def embed_photo(photo_id: str, file: UploadFile = File(...)):
-    if embedder is None:
+    if embedding.batcher is None:
         raise HTTPException(500, "Embedder not initialized")
     raw = await file.read()
-    img = load_image_from_bytes(raw)
-    tensor = preprocess_for_embedding(img)
-    vec = embedder.embed(tensor)
-    await rpc_store_photo_embedding(photo_id, vec)
+    vec = await embedding.embed_image_bytes(raw)
+    async with session(), pipeline():
+        # the owner lookup shares the store's round trip; the index only learns
+        # the vector once it is stored
+        _, owners = await asyncio.gather(rpc_store_photo_embedding(photo_id, vec),
+                                         fetch_photo_dog_ids([photo_id]))
+    dog_id = owners.get(photo_id)
+    ann.add_photo(photo_id, vec, dog_id)
+    invalidate_dogs([dog_id])
     return {"photo_id": photo_id, "embedding_dim": len(vec)}
 
+async def _appearance_match(data: bytes, lat: float | None, lon: float | None, k: int) -> list[dict]:
+    # histogram similarity stands in for the visual score: visual = 1 - distance
+    with metrics.stage("appearance.histograms"):
+        q = appearance.histogram_row(*await run_cpu(appearance_histograms, data))
+    with metrics.stage("appearance.search"):
+        hits = appearance.index.search(q, max(k, settings.ann_candidates), appearance.metric(),
+                                       settings.appearance_lab_weight, by_dog=True)
+    cands = [(h["dog_id"], 1.0 - h["distance"]) for h in hits]
+    return await rpc_match_dog_candidates(cands, lat, lon, k) if cands else []
+
 @router.post("/match")
-async def match(photo_bytes_b64: str = None, photo_url: str = None, lat: float | None = None, lon: float | None = None, k: int = 5):
-    if embedder is None:
+async def match(photo_bytes_b64: str = None, photo_url: str = None, lat: float | None = None, lon: float | None = None, k: int = 5,
+                dedup_max_distance: int | None = Query(None, ge=0, le=64)):
+    if embedding.batcher is None:
         raise HTTPException(500, "Embedder not initialized")
+    if dedup.index is not None and (dedup_max_distance or 0) > dedup.index.max_distance:
+        raise HTTPException(400, f"dedup_max_distance is limited to {dedup.index.max_distance}")
     data = None
     if photo_bytes_b64:
         data = base64.b64decode(photo_bytes_b64)
     elif photo_url:
-        async with httpx.AsyncClient(timeout=30) as client:
-            r = await client.get(photo_url)
-            r.raise_for_status()
-            data = r.content
+        data = await fetch_bytes(photo_url)
     else:
         raise HTTPException(400, "Provide photo_bytes_b64 or photo_url")
-    img = load_image_from_bytes(data)
-    tensor = preprocess_for_embedding(img)
-    vec = embedder.embed(tensor)
-    rows = await rpc_match_dogs(vec, lat, lon, k)
+    if dedup_max_distance is not None and dedup.index is not None:
+        # a near-identical photo already attached to a dog answers the match outright
+        dups = dedup.find_duplicates(await run_cpu(phash_image_bytes, data), dedup_max_distance)
+        owned = [d for d in dups if d["dog_id"]]
+        if owned:
+            return {"duplicate_of": owned[0], "candidates": []}
+    if appearance.fallback_active():
+        return {"candidates": await _appearance_match(data, lat, lon, k), "ranked_by": "appearance"}
+    vec = await embedding.embed_image_bytes(data)
+    # with re-ranking, more candidates are scored than returned
+    n = max(k, settings.match_rerank_candidates) if parts.enabled() else k
+    if ann.index is not None and ann.mode() == "two_stage":
+        with metrics.stage("ann.coarse"):
+            photo_ids = ann.index.coarse(vec, max(n, settings.quant_candidates))
+        rows = await rpc_match_photo_candidates(photo_ids, vec, lat, lon, n) if photo_ids else []
+    elif ann.index is not None:
+        with metrics.stage("ann.search"):
+            cands = ann.index.search(vec, max(n, settings.ann_candidates))
+        rows = await rpc_match_dog_candidates(cands, lat, lon, n) if cands else []
+    else:
+        rows = await rpc_match_dogs(vec, lat, lon, n)
+    if parts.enabled():
+        rows = await parts.rerank(data, rows, k)
     return {"candidates": rows}
 
+class MatchPhoto(BaseModel):
+    photo_bytes_b64: str | None = None
+    photo_url: str | None = None
+
+class BatchMatchRequest(BaseModel):
+    photos: list[MatchPhoto]
+    lat: float | None = None
+    lon: float | None = None
+    k: int = 5
+    fusion: str = "max"
+
+async def _photo_bytes(p: MatchPhoto) -> bytes:
+    if p.photo_bytes_b64:
+        return base64.b64decode(p.photo_bytes_b64)
+    if p.photo_url:
+        return await fetch_bytes(p.photo_url)
+    raise HTTPException(400, "Each photo needs photo_bytes_b64 or photo_url")
+
+def _fuse(per_shot: list[list[tuple[str, float]]], fusion: str) -> list[tuple[str, float]]:
+    # same rule as the SQL path: max, or mean with 0 for shots that missed the dog
+    acc: dict[str, list[float]] = {}
+    for cands in per_shot:
+        for dog_id, visual in cands:
+            acc.setdefault(dog_id, []).append(visual)
+    n = len(per_shot)
+    fused = {d: max(v) if fusion == "max" else sum(v) / n for d, v in acc.items()}
+    return sorted(fused.items(), key=lambda kv: -kv[1])
+
+def _rescore(cands: list[tuple[str, float]], scored: dict[str, dict], k: int) -> list[dict]:
+    # geo/recency depend only on the dog, so one scoring query serves every shot
+    rows = []
+    for dog_id, visual in cands:
+        r = scored.get(dog_id)
+        if r is None:
+            continue
+        final = (settings.match_weight_visual * visual + settings.match_weight_geo * r["geo"]
+                 + settings.match_weight_recency * r["recency"])
+        rows.append({**r, "visual": visual, "final_score": final})
+    rows.sort(key=lambda r: -r["final_score"])
+    return rows[:k]
+
+@router.post("/match/batch")
+async def match_batch(req: BatchMatchRequest):
+    # Several shots of one sighting: fetched concurrently, embedded as one batch and
+    # matched with one DB round trip. "candidates" is the fused ranking, "photos"
+    # the per-shot lists in request order.
+    if embedding.batcher is None:
+        raise HTTPException(500, "Embedder not initialized")
+    if not 1 <= len(req.photos) <= settings.match_batch_max_photos:
+        raise HTTPException(400, f"Provide 1 to {settings.match_batch_max_photos} photos")
+    if req.fusion not in ("max", "mean"):
+        raise HTTPException(400, "fusion must be 'max' or 'mean'")
+    datas = await asyncio.gather(*(_photo_bytes(p) for p in req.photos))
+    vecs = await embedding.embed_images_bytes(list(datas))
+    depth = max(req.k, settings.match_batch_depth)
+    if ann.index is not None and ann.mode() == "ann":
+        with metrics.stage("ann.search"):
+            per_shot = [ann.index.search(v, max(depth, settings.ann_candidates)) for v in vecs]
+        fused = _fuse(per_shot, req.fusion)
+        rows = await rpc_match_dog_candidates(fused, req.lat, req.lon, len(fused)) if fused else []
+        scored = {str(r["dog_id"]): r for r in rows}
+        candidates = _rescore(fused, scored, req.k)
+        shots = [_rescore(c, scored, req.k) for c in per_shot]
+    else:
+        # sql and two_stage modes both use the array-valued match_dogs query
+        rows = await rpc_match_dogs_batch(vecs, req.lat, req.lon, req.k, depth, req.fusion)
+        by_shot: dict[int, list[dict]] = {}
+        for r in rows:
+            r = dict(r)
+            by_shot.setdefault(r.pop("shot"), []).append(r)
+        candidates = by_shot.get(0, [])
+        shots = [by_shot.get(i + 1, [])[:req.k] for i in range(len(vecs))]
+    return {"fusion": req.fusion, "candidates": candidates,
+            "photos": [{"index": i, "candidates": c} for i, c in enumerate(shots)]}
+
+@router.get("/match/index")
+async def match_index_stats(recall_k: int | None = None, samples: int = 100):
+    rerank = parts.matrix.stats() if parts.enabled() and parts.matrix is not None else None
+    if ann.index is None:
+        return {"mode": settings.match_mode, "loaded": False, "rerank": rerank}
+    out = {"mode": settings.match_mode, "loaded": True, **ann.index.stats(), "rerank": rerank}
+    if recall_k and hasattr(ann.index, "recall_at_k"):
+        out["recall_at_k"] = {"k": recall_k, "samples": samples,
+                              "recall": ann.index.recall_at_k(recall_k, samples)}
+    return out
+
 @router.post("/confirm")
 async def confirm(sighting_id: str, chosen_dog_id: str | None = None, display_name: str | None = None):
-    dog_id = await rpc_confirm_match(sighting_id, chosen_dog_id, display_name)
+    async with session():
+        dog_id = await rpc_confirm_match(sighting_id, chosen_dog_id, display_name)
+        async with pipeline():
+            await asyncio.gather(ann.on_confirm(dog_id), dedup.on_confirm(dog_id), appearance.on_confirm(dog_id))
+    invalidate_dogs([dog_id])
     return {"dog_id": dog_id}
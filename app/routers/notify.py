@@ -7,11 +7,11 @@ router = APIRouter(prefix="/v1", tags=["notify"])
 async def register_token(user_id: str, fcm_token: str = Body(..., embed=True), platform: str | None = None):
     # upsert token
     try:
-        sql = "
+        sql = """
         insert into public.user_devices (user_id, fcm_token, platform)
         values (%s::uuid, %s, %s)
         on conflict (user_id, fcm_token) do update set last_seen_at=now(), platform=excluded.platform;
-        "
+        """
         await exec_sql(sql, (user_id, fcm_token, platform))
         return {"ok": True}
     except Exception as e:
@@ -40,6 +40,9 @@ PROJECT_ID = os.getenv("FCM_PROJECT_ID", "")
 
 @router.post("/notify/send-to-user")
 async def send_to_user(user_id: str, title: str, body: str, dog_id: str | None = None):
+    if not PROJECT_ID:
+        # without a project every send 404s; fail instead of reporting tokens as undeliverable
+        raise HTTPException(500, "FCM_PROJECT_ID is not set")
     # fetch tokens
     async with get_conn() as (_, cur):
         await cur.execute("select fcm_token from public.user_devices where user_id=%s::uuid", (user_id,))
@@ -47,5 +50,9 @@ async def send_to_user(user_id: str, title: str, body: str, dog_id: str | None =
     tokens = [r["fcm_token"] for r in rows]
     if not tokens: return {"sent": [], "note": "no tokens"}
     data = {"dog_id": dog_id} if dog_id else {}
-    res = send_fcm(PROJECT_ID, tokens, title, body, data=data)
+    res = await send_fcm(PROJECT_ID, tokens, title, body, data=data)
+    if res["dead_tokens"]:
+        await exec_sql("delete from public.user_devices where user_id=%s::uuid and fcm_token = any(%s);",
+                       (user_id, res["dead_tokens"]))
+    res["pruned"] = len(res["dead_tokens"])
     return res
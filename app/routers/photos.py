@@ -1,7 +1,12 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException
-import httpx
-import uuid
+from fastapi import APIRouter, UploadFile, File, HTTPException, Request
+import asyncio
 from ..config import settings
+from ..services import ann, embedding
+from ..services.cache import content_digest, invalidate_dogs
+from ..services.workers import run_cpu
+from ..services.uploads import (IncrementalDecoder, UploadFormatError, UploadStream, body_file, delete_object,
+                               peek, store_object)
+from ..db import fetch_photo_dog_ids, rpc_store_photo_embedding, session, pipeline
 
 router = APIRouter(prefix="/v1", tags=["photos"])
 
@@ -10,15 +15,44 @@ async def upload_photo(file: UploadFile = File(...)):
     data = await file.read()
     if len(data) == 0:
         raise HTTPException(400, "Empty file")
-    object_name = f"{uuid.uuid4()}.jpg"
-    url = f"{settings.supabase_url}/storage/v1/object/{settings.photos_bucket}/{object_name}"
-    headers = {
-        "Authorization": f"Bearer {settings.supabase_service_key}",
-        "Content-Type": file.content_type or "image/jpeg",
-        "x-upsert": "true",
-    }
-    async with httpx.AsyncClient(timeout=60) as client:
-        r = await client.post(url, headers=headers, content=data)
-        r.raise_for_status()
-    public_url = f"{settings.supabase_url}/storage/v1/object/public/{settings.photos_bucket}/{object_name}"
-    return {"url": public_url}
+    if len(data) > settings.upload_max_bytes:
+        raise HTTPException(413, f"Upload exceeds {settings.upload_max_bytes} bytes")
+    public_url, digest = await asyncio.gather(store_object(data, file.content_type),
+                                              run_cpu(content_digest, data))
+    return {"url": public_url, "size": len(data), "digest": digest}
+
+@router.post("/upload/stream")
+async def upload_photo_stream(request: Request, embed: bool = False, photo_id: str | None = None):
+    # Accepts multipart/form-data (field "file") or a raw image body and forwards
+    # the bytes to storage while they arrive. With embed (implied by photo_id) the
+    # same chunks are decoded on a thread so the embedding is ready as soon as the
+    # last chunk is in; with photo_id it is stored like /v1/embed does.
+    want_embed = embed or photo_id is not None
+    if want_embed and embedding.batcher is None:
+        raise HTTPException(500, "Embedder not initialized")
+    content_type, chunks = await body_file(request.stream(), request.headers.get("content-type"))
+    first, chunks = await peek(chunks)
+    if not first:
+        raise HTTPException(400, "Empty file")
+    stream = UploadStream(chunks, settings.upload_max_bytes, IncrementalDecoder() if want_embed else None)
+    public_url = await store_object(stream, content_type)
+    out = {"url": public_url, "size": stream.size, "digest": stream.digest}
+    if want_embed:
+        # the bytes are already in storage; don't leave an object behind for a
+        # body that turns out not to be an image
+        try:
+            img = await stream.decoder.close()
+        except UploadFormatError:
+            await delete_object(public_url)
+            raise
+        vec = await embedding.embed_image(img, stream.digest)
+        out["embedding_dim"] = len(vec)
+        if photo_id is not None:
+            async with session(), pipeline():
+                _, owners = await asyncio.gather(rpc_store_photo_embedding(photo_id, vec),
+                                                 fetch_photo_dog_ids([photo_id]))
+            dog_id = owners.get(photo_id)
+            ann.add_photo(photo_id, vec, dog_id)
+            invalidate_dogs([dog_id])
+            out["photo_id"] = photo_id
+    return out
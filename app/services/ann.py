@@ -0,0 +1,227 @@
+import time
+import numpy as np
+from ..config import settings
+from ..db import fetch_photo_embeddings, fetch_photo_codes
+from .quantize import QuantizedIndex
+
+def _normalize(m: np.ndarray) -> np.ndarray:
+    m = np.asarray(m, dtype=np.float32)
+    return m / (np.linalg.norm(m, axis=-1, keepdims=True) + 1e-9)
+
+def _kmeans(x: np.ndarray, k: int, iters: int = 10, seed: int = 0) -> np.ndarray:
+    # spherical k-means: inputs and centroids are unit vectors, similarity is a dot product
+    rng = np.random.default_rng(seed)
+    c = x[rng.choice(len(x), k, replace=False)].copy()
+    for _ in range(iters):
+        assign = np.argmax(x @ c.T, axis=1)
+        sums = np.zeros_like(c)
+        np.add.at(sums, assign, x)
+        counts = np.bincount(assign, minlength=k)
+        empty = counts == 0
+        sums[empty] = c[empty]
+        c = _normalize(sums)
+    return c
+
+class IvfIndex:
+    # Inverted-file index over unit-norm photo embeddings labelled with their dog.
+    # Rows live in one growable matrix; each coarse list holds row numbers, and
+    # _pos[row] is the row's slot in its list so moves are O(1) swap-removes.
+    # Below nlist rows the index is flat; it trains once it reaches nlist.
+    def __init__(self, dim: int, nlist: int = 256, nprobe: int = 16, train_sample: int = 20000):
+        self.dim = dim
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.train_sample = train_sample
+        self._reset()
+
+    def _reset(self):
+        dim = self.dim
+        self.centroids: np.ndarray | None = None
+        self._vecs = np.empty((0, dim), dtype=np.float32)
+        self._size = 0
+        self._photo_ids: list[str] = []
+        self._dog_ids: list[str | None] = []
+        self._row: dict[str, int] = {}
+        self._assign: list[int] = []
+        self._pos: list[int] = []
+        self._lists: list[list[int]] = []
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def trained(self) -> bool:
+        return self.centroids is not None
+
+    def _grow(self, n: int):
+        need = self._size + n
+        if need <= len(self._vecs):
+            return
+        cap = max(need, 2 * len(self._vecs), 1024)
+        vecs = np.empty((cap, self.dim), dtype=np.float32)
+        vecs[:self._size] = self._vecs[:self._size]
+        self._vecs = vecs
+
+    def _nearest_lists(self, x: np.ndarray, n: int) -> np.ndarray:
+        sims = x @ self.centroids.T
+        if n >= sims.shape[1]:
+            return np.argsort(-sims, axis=1)
+        return np.argpartition(-sims, n - 1, axis=1)[:, :n]
+
+    def _assign_lists(self, vecs: np.ndarray) -> np.ndarray:
+        return np.concatenate([self._nearest_lists(vecs[i:i+4096], 1)[:, 0]
+                               for i in range(0, len(vecs), 4096)] or [np.empty(0, dtype=np.int64)])
+
+    def _unlist(self, row: int):
+        lst = self._lists[self._assign[row]]
+        last = lst.pop()
+        if last != row:
+            lst[self._pos[row]] = last
+            self._pos[last] = self._pos[row]
+
+    def _list(self, row: int, lst: int):
+        self._assign[row] = lst
+        self._pos[row] = len(self._lists[lst])
+        self._lists[lst].append(row)
+
+    def _train(self):
+        n = self._size
+        vecs = self._vecs[:n]
+        rng = np.random.default_rng(0)
+        sample = vecs if n <= self.train_sample else vecs[rng.choice(n, self.train_sample, replace=False)]
+        self.centroids = _kmeans(sample, self.nlist)
+        self._lists = [[] for _ in range(self.nlist)]
+        for row, lst in enumerate(self._assign_lists(vecs).tolist()):
+            self._list(row, lst)
+
+    def build(self, photo_ids: list[str], dog_ids: list[str | None], vecs: np.ndarray):
+        self._reset()
+        self.add(photo_ids, dog_ids, vecs)
+
+    def add(self, photo_ids: list[str], dog_ids: list[str | None], vecs: np.ndarray):
+        vecs = _normalize(vecs).reshape(-1, self.dim)
+        assign = self._assign_lists(vecs) if self.trained else None
+        self._grow(len(vecs))
+        for i, (pid, did) in enumerate(zip(photo_ids, dog_ids)):
+            lst = int(assign[i]) if assign is not None else -1
+            row = self._row.get(pid)
+            if row is None:
+                row = self._size
+                self._size += 1
+                self._row[pid] = row
+                self._photo_ids.append(pid)
+                self._dog_ids.append(did)
+                self._assign.append(-1)
+                self._pos.append(-1)
+            elif did is not None:
+                self._dog_ids[row] = did
+            if self._assign[row] != lst:
+                if self._assign[row] >= 0:
+                    self._unlist(row)
+                if lst >= 0:
+                    self._list(row, lst)
+            self._vecs[row] = vecs[i]
+        if not self.trained and self._size >= self.nlist:
+            self._train()
+
+    def _best_per_dog(self, rows: np.ndarray, sims: np.ndarray, n: int) -> list[tuple[str, float]]:
+        best: dict[str, float] = {}
+        for i in np.argsort(-sims):
+            did = self._dog_ids[rows[i]]
+            if did is None or did in best:
+                continue
+            best[did] = float(sims[i])
+            if len(best) >= n:
+                break
+        return list(best.items())
+
+    def search_exact(self, vec: np.ndarray, n: int) -> list[tuple[str, float]]:
+        q = _normalize(vec).reshape(self.dim)
+        rows = np.arange(self._size)
+        return self._best_per_dog(rows, self._vecs[:self._size] @ q, n)
+
+    def search(self, vec: np.ndarray, n: int, nprobe: int | None = None) -> list[tuple[str, float]]:
+        if not self.trained:
+            return self.search_exact(vec, n)
+        q = _normalize(vec).reshape(1, self.dim)
+        probe = self._nearest_lists(q, nprobe or self.nprobe)[0]
+        rows = np.fromiter((r for l in probe for r in self._lists[l]), dtype=np.int64)
+        if rows.size == 0:
+            return []
+        return self._best_per_dog(rows, self._vecs[rows] @ q[0], n)
+
+    def recall_at_k(self, k: int = 10, samples: int = 100, seed: int = 0) -> float:
+        # Uses stored vectors as queries and compares the dog sets against exact search.
+        if self._size == 0:
+            return 1.0
+        rng = np.random.default_rng(seed)
+        rows = rng.choice(self._size, min(samples, self._size), replace=False)
+        hit = total = 0
+        for r in rows:
+            q = self._vecs[r]
+            truth = {d for d, _ in self.search_exact(q, k)}
+            got = {d for d, _ in self.search(q, k)}
+            hit += len(truth & got)
+            total += len(truth)
+        return hit / total if total else 1.0
+
+    def stats(self) -> dict:
+        sizes = [len(l) for l in self._lists]
+        return {
+            "size": self._size,
+            "dim": self.dim,
+            "trained": self.trained,
+            "nlist": len(self._lists),
+            "nprobe": self.nprobe,
+            "max_list": max(sizes) if sizes else 0,
+        }
+
+# MATCH_MODE=ann keeps float vectors in an IvfIndex; MATCH_MODE=two_stage keeps
+# only compact codes in a QuantizedIndex and reranks its shortlist in SQL.
+index: IvfIndex | QuantizedIndex | None = None
+
+def mode() -> str:
+    return settings.match_mode.lower().strip()
+
+def enabled() -> bool:
+    return mode() in ("ann", "two_stage")
+
+def _stored_codes() -> bool:
+    # stored sign codes equal what a QuantizedIndex would compute, so floats need not be loaded
+    return settings.quant_store_codes and settings.quant_kind == "binary" and not settings.quant_pca_dim
+
+async def load_index():
+    global index
+    t0 = time.perf_counter()
+    if mode() == "two_stage":
+        idx = QuantizedIndex(settings.embed_vector_size, settings.quant_kind, settings.quant_pca_dim)
+        if _stored_codes():
+            idx.add_codes(*await fetch_photo_codes())
+        else:
+            idx.build(*await fetch_photo_embeddings())
+        index = idx
+        st = idx.stats()
+        print(f"[ann] Loaded {len(idx)} {st['kind']} codes ({st['code_bytes']} B each) "
+              f"in {time.perf_counter() - t0:.2f}s")
+        return
+    photo_ids, dog_ids, vecs = await fetch_photo_embeddings()
+    idx = IvfIndex(settings.embed_vector_size, nlist=settings.ann_nlist, nprobe=settings.ann_nprobe)
+    idx.build(photo_ids, dog_ids, vecs)
+    index = idx
+    print(f"[ann] Loaded {len(idx)} embeddings in {time.perf_counter() - t0:.2f}s (trained={idx.trained})")
+
+def add_photo(photo_id: str, vec, dog_id: str | None):
+    if index is not None:
+        index.add([photo_id], [dog_id], np.asarray(vec, dtype=np.float32))
+
+async def on_confirm(dog_id: str | None):
+    if index is None or not dog_id:
+        return
+    if isinstance(index, QuantizedIndex) and _stored_codes():
+        photo_ids, dog_ids, codes = await fetch_photo_codes(dog_id=dog_id)
+        if photo_ids:
+            index.add_codes(photo_ids, dog_ids, codes)
+        return
+    photo_ids, dog_ids, vecs = await fetch_photo_embeddings(dog_id=dog_id)
+    if photo_ids:
+        index.add(photo_ids, dog_ids, vecs)
@@ -0,0 +1,172 @@
+import time
+import numpy as np
+from ..config import settings
+from ..db import fetch_photo_histograms
+from ..utils.geo import haversine_km
+
+# Appearance search over the Lab (48 bins) and LBP (256 bins) histograms that
+# /v1/analyze stores. Rows are normalized to sum 1 per histogram and kept as
+# float16 in one growable matrix (608 bytes per photo); a query is one chunked
+# vectorized pass, after an optional geo-radius mask. Distances are in [0, 1]:
+#   chi2:         0.5 * sum((a - b)^2 / (a + b))
+#   intersection: 1 - sum(min(a, b))
+# and the two histograms are blended with APPEARANCE_LAB_WEIGHT.
+
+LAB_BINS = 48
+LBP_BINS = 256
+_WIDTH = LAB_BINS + LBP_BINS
+_CHUNK = 4096
+METRICS = ("chi2", "intersection")
+
+def _normalize(h: np.ndarray) -> np.ndarray:
+    h = np.clip(np.asarray(h, dtype=np.float32), 0, None)
+    return h / np.maximum(h.sum(axis=-1, keepdims=True), 1e-9)
+
+def histogram_row(lab, lbp) -> np.ndarray | None:
+    lab, lbp = np.asarray(lab, dtype=np.float32).ravel(), np.asarray(lbp, dtype=np.float32).ravel()
+    if lab.size != LAB_BINS or lbp.size != LBP_BINS:
+        return None
+    return np.concatenate([_normalize(lab), _normalize(lbp)])
+
+def _distance(rows: np.ndarray, q: np.ndarray, metric: str) -> np.ndarray:
+    if metric == "chi2":
+        d = (rows - q) ** 2 / np.maximum(rows + q, 1e-9)
+        return 0.5 * d
+    return rows - np.minimum(rows, q)  # summed: 1 - sum(min)
+
+class AppearanceIndex:
+    def __init__(self):
+        self._hist = np.empty((0, _WIDTH), dtype=np.float16)
+        self._lat = np.empty(0, dtype=np.float32)
+        self._lon = np.empty(0, dtype=np.float32)
+        self._has_dog = np.empty(0, dtype=np.bool_)
+        self._size = 0
+        self._photo_ids: list[str] = []
+        self._dog_ids: list[str | None] = []
+        self._row: dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _grow(self, n: int):
+        need = self._size + n
+        if need <= len(self._hist):
+            return
+        cap = max(need, 2 * len(self._hist), 1024)
+        hist = np.empty((cap, _WIDTH), dtype=np.float16)
+        hist[:self._size] = self._hist[:self._size]
+        lat = np.full(cap, np.nan, dtype=np.float32)
+        lon = np.full(cap, np.nan, dtype=np.float32)
+        lat[:self._size], lon[:self._size] = self._lat[:self._size], self._lon[:self._size]
+        has_dog = np.zeros(cap, dtype=np.bool_)
+        has_dog[:self._size] = self._has_dog[:self._size]
+        self._hist, self._lat, self._lon, self._has_dog = hist, lat, lon, has_dog
+
+    def add_rows(self, rows: list[dict]) -> int:
+        # rows as returned by db.fetch_photo_histograms; upserts by photo id
+        added = 0
+        self._grow(len(rows))
+        for r in rows:
+            h = histogram_row(r["lab"], r["lbp"])
+            if h is None:
+                continue
+            i = self._row.get(r["id"])
+            if i is None:
+                i = self._size
+                self._size += 1
+                self._row[r["id"]] = i
+                self._photo_ids.append(r["id"])
+                self._dog_ids.append(r["dog_id"])
+            elif r["dog_id"] is not None:
+                self._dog_ids[i] = r["dog_id"]
+            self._has_dog[i] = self._dog_ids[i] is not None
+            self._hist[i] = h
+            self._lat[i] = np.nan if r.get("lat") is None else r["lat"]
+            self._lon[i] = np.nan if r.get("lon") is None else r["lon"]
+            added += 1
+        return added
+
+    def row_of(self, photo_id: str) -> np.ndarray | None:
+        i = self._row.get(photo_id)
+        return None if i is None else self._hist[i].astype(np.float32)
+
+    def distances(self, q: np.ndarray, metric: str = "chi2", lab_weight: float = 0.5,
+                  rows: np.ndarray | None = None) -> np.ndarray:
+        if metric not in METRICS:
+            raise ValueError(f"Unknown appearance metric: {metric}")
+        idx = np.arange(self._size) if rows is None else rows
+        q = np.asarray(q, dtype=np.float32)
+        out = np.empty(len(idx), dtype=np.float32)
+        for s in range(0, len(idx), _CHUNK):
+            block = self._hist[idx[s:s + _CHUNK]].astype(np.float32)
+            d = _distance(block, q, metric)
+            out[s:s + len(block)] = (lab_weight * d[:, :LAB_BINS].sum(axis=1)
+                                     + (1 - lab_weight) * d[:, LAB_BINS:].sum(axis=1))
+        return out
+
+    def search(self, q: np.ndarray, k: int = 10, metric: str = "chi2", lab_weight: float = 0.5,
+               lat: float | None = None, lon: float | None = None, radius_km: float | None = None,
+               by_dog: bool = False, exclude: str | None = None) -> list[dict]:
+        rows = np.arange(self._size)
+        if radius_km is not None and lat is not None and lon is not None:
+            rows = np.flatnonzero(~np.isnan(self._lat[:self._size]))
+            rows = rows[haversine_km(lat, lon, self._lat[rows], self._lon[rows]) <= radius_km]
+        if by_dog and rows.size:
+            rows = rows[self._has_dog[rows]]
+        if rows.size == 0:
+            return []
+        dist = self.distances(q, metric, lab_weight, rows)
+        out, seen = [], set()
+        for i in np.argsort(dist, kind="stable").tolist():
+            r = int(rows[i])
+            pid, did = self._photo_ids[r], self._dog_ids[r]
+            if pid == exclude:
+                continue
+            if by_dog:
+                if did in seen:
+                    continue
+                seen.add(did)
+            out.append({"photo_id": pid, "dog_id": did, "distance": float(dist[i])})
+            if len(out) >= k:
+                break
+        return out
+
+    def stats(self) -> dict:
+        return {"size": self._size, "bytes": int(self._hist.nbytes + self._lat.nbytes + self._lon.nbytes
+                                                       + self._has_dog.nbytes),
+                "dtype": "float16", "bins": _WIDTH}
+
+index: AppearanceIndex | None = None
+
+def enabled() -> bool:
+    return settings.appearance_enabled
+
+def metric() -> str:
+    return settings.appearance_metric.lower().strip()
+
+def fallback_active() -> bool:
+    # opt-in: random embeddings carry no visual signal, so /v1/match can rank by
+    # appearance instead once there are histograms to rank
+    return (settings.appearance_match_fallback and index is not None and len(index) > 0
+            and settings.embedder_backend.lower().strip() == "random")
+
+async def load_index():
+    global index
+    t0 = time.perf_counter()
+    idx = AppearanceIndex()
+    idx.add_rows(await fetch_photo_histograms())
+    index = idx
+    print(f"[appearance] Loaded {len(idx)} histograms in {time.perf_counter() - t0:.2f}s")
+
+def on_analyze(photo_id: str, lab, lbp, photo: dict | None):
+    # histograms from the analysis just saved; photo is its {dog_id, lat, lon} row
+    if index is None:
+        return
+    photo = photo or {}
+    index.add_rows([{"id": photo_id, "dog_id": photo.get("dog_id"), "lab": lab, "lbp": lbp,
+                     "lat": photo.get("lat"), "lon": photo.get("lon")}])
+
+async def on_confirm(dog_id: str | None):
+    if index is None or not dog_id:
+        return
+    index.add_rows(await fetch_photo_histograms(dog_id=dog_id))
@@ -0,0 +1,103 @@
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable
+
+import numpy as np
+
+_STOP = object()
+
+class InferenceBatcher:
+    # Collects single-image requests from any event loop into batches bounded by
+    # max_batch / max_wait_ms and runs them on one dedicated inference thread.
+    def __init__(self, run_batch: Callable[[np.ndarray], np.ndarray],
+                 max_batch: int = 16, max_wait_ms: float = 5.0,
+                 on_batch: Callable[[int, float], None] | None = None):
+        self._run_batch = run_batch
+        self._on_batch = on_batch
+        self.max_batch = max(1, int(max_batch))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+        self.batches_run = 0
+        self.items_run = 0
+        self.last_batch_size = 0
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._loop, name="inference-batcher", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float | None = 5.0):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None and thread.is_alive():
+            self._queue.put(_STOP)
+            thread.join(timeout)
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def submit(self, tensor: np.ndarray) -> Future:
+        if tensor.ndim == 3:
+            tensor = tensor[None, ...]
+        if tensor.shape[0] != 1:
+            raise ValueError("submit() takes a single image tensor")
+        fut: Future = Future()
+        if self._thread is None:
+            self.start()
+        self._queue.put((tensor, fut))
+        return fut
+
+    async def embed(self, tensor: np.ndarray) -> np.ndarray:
+        return await asyncio.wrap_future(self.submit(tensor))
+
+    async def embed_many(self, tensors: list[np.ndarray]) -> list[np.ndarray]:
+        futs = [self.submit(t) for t in tensors]
+        return list(await asyncio.gather(*(asyncio.wrap_future(f) for f in futs)))
+
+    def _loop(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            batch = [item]
+            stop = False
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+            self._dispatch(batch)
+            if stop:
+                return
+
+    def _dispatch(self, batch: list[tuple[np.ndarray, Future]]):
+        batch = [(t, f) for t, f in batch if f.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        t0 = time.perf_counter()
+        try:
+            out = self._run_batch(np.concatenate([t for t, _ in batch], axis=0))
+        except BaseException as e:
+            for _, f in batch:
+                f.set_exception(e)
+            return
+        if self._on_batch is not None:
+            self._on_batch(len(batch), time.perf_counter() - t0)
+        self.batches_run += 1
+        self.items_run += len(batch)
+        self.last_batch_size = len(batch)
+        for (_, f), row in zip(batch, out):
+            f.set_result(row)
@@ -0,0 +1,213 @@
+import asyncio
+import hashlib
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from typing import Any
+
+import numpy as np
+from ..config import settings
+from . import metrics
+
+def content_digest(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=20).hexdigest()
+
+def sizeof(value: Any) -> int:
+    if isinstance(value, np.ndarray):
+        return value.nbytes + 112
+    if isinstance(value, (bytes, bytearray, str)):
+        return len(value) + 49
+    if isinstance(value, dict):
+        return 64 + sum(sizeof(k) + sizeof(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return 56 + sum(sizeof(v) for v in value)
+    return 32
+
+class DiskTier:
+    # Second tier: one pickle file per key under `path`, expired by mtime.
+    def __init__(self, path: str, ttl_s: float):
+        self.path = path
+        self.ttl_s = ttl_s
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, key: str) -> str:
+        h = hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+        return os.path.join(self.path, h[:2], h + ".pkl")
+
+    def get(self, key: str) -> Any:
+        fn = self._file(key)
+        try:
+            if time.time() - os.path.getmtime(fn) > self.ttl_s:
+                os.remove(fn)
+                return None
+            with open(fn, "rb") as f:
+                return pickle.load(f)
+        except (OSError, pickle.PickleError, EOFError):
+            return None
+
+    def put(self, key: str, value: Any):
+        fn = self._file(key)
+        os.makedirs(os.path.dirname(fn), exist_ok=True)
+        tmp = f"{fn}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, "wb") as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, fn)
+        except OSError:
+            pass
+
+class LruCache:
+    def __init__(self, max_bytes: int, ttl_s: float, tier: DiskTier | None = None):
+        self.max_bytes = max_bytes
+        self.ttl_s = ttl_s
+        self.tier = tier
+        self._data: OrderedDict[str, tuple[float, int, Any]] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.tier_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: str) -> Any:
+        value = self._lookup(key)
+        if value is None and self.tier is not None:
+            value = self._promote(key, self.tier.get(key))
+        return value if value is not None else self._miss()
+
+    async def aget(self, key: str) -> Any:
+        # as get, with the disk tier read off the event loop
+        value = self._lookup(key)
+        if value is None and self.tier is not None:
+            value = self._promote(key, await asyncio.to_thread(self.tier.get, key))
+        return value if value is not None else self._miss()
+
+    def put(self, key: str, value: Any):
+        self._store(key, value)
+        if self.tier is not None:
+            self.tier.put(key, value)
+
+    async def aput(self, key: str, value: Any):
+        self._store(key, value)
+        if self.tier is not None:
+            await asyncio.to_thread(self.tier.put, key, value)
+
+    def _lookup(self, key: str) -> Any:
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                expires, size, value = item
+                if expires > now:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+                self._bytes -= size
+                self.expirations += 1
+        return None
+
+    def _promote(self, key: str, value: Any) -> Any:
+        if value is not None:
+            with self._lock:
+                self.tier_hits += 1
+            self._store(key, value)
+        return value
+
+    def _miss(self) -> None:
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def _store(self, key: str, value: Any):
+        size = sizeof(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._data[key] = (time.monotonic() + self.ttl_s, size, value)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, s, _) = self._data.popitem(last=False)
+                self._bytes -= s
+                self.evictions += 1
+
+    def invalidate(self, key: str):
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.tier_hits + self.misses
+        return {
+            "entries": len(self._data),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "tier_hits": self.tier_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": (self.hits + self.tier_hits) / lookups if lookups else 0.0,
+        }
+
+features: LruCache | None = None
+nearby: LruCache | None = None
+dogs: LruCache | None = None
+
+def init_cache():
+    global features
+    tier = DiskTier(settings.cache_disk_path, settings.cache_ttl_s) if settings.cache_disk_path else None
+    features = LruCache(settings.cache_max_bytes, settings.cache_ttl_s, tier=tier)
+
+def init_dog_cache():
+    global dogs
+    dogs = LruCache(settings.dog_cache_max_bytes, settings.dog_cache_ttl_s)
+
+def init_nearby_cache():
+    global nearby
+    nearby = LruCache(settings.nearby_cache_max_bytes, settings.nearby_cache_ttl_s)
+
+def get_features_cache() -> LruCache | None:
+    if features is None and settings.cache_max_bytes > 0:
+        init_cache()
+    return features
+
+def get_nearby_cache() -> LruCache | None:
+    if nearby is None and settings.nearby_cache_ttl_s > 0 and settings.nearby_cache_max_bytes > 0:
+        init_nearby_cache()
+    return nearby
+
+def get_dog_cache() -> LruCache | None:
+    if dogs is None and settings.dog_cache_ttl_s > 0 and settings.dog_cache_max_bytes > 0:
+        init_dog_cache()
+    return dogs
+
+def invalidate_dogs(dog_ids: list[str | None]):
+    if dogs is not None:
+        for d in dog_ids:
+            if d:
+                dogs.invalidate(f"dog:{d}")
+
+def _cache_metrics() -> list[str]:
+    caches = {name: c.stats() for name, c in (("features", features), ("nearby", nearby), ("dogs", dogs))
+              if c is not None}
+    lines = []
+    for key, kind in (("hits", "counter"), ("tier_hits", "counter"), ("misses", "counter"),
+                      ("evictions", "counter"), ("expirations", "counter"),
+                      ("entries", "gauge"), ("bytes", "gauge"), ("hit_rate", "gauge")):
+        suffix = "_total" if kind == "counter" else ""
+        lines += metrics.gauge(f"petid_cache_{key}{suffix}", f"LruCache {key}.",
+                               {name: s[key] for name, s in caches.items()}, label="cache", kind=kind)
+    return lines
+
+metrics.register_collector(_cache_metrics)
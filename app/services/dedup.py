@@ -0,0 +1,195 @@
+import time
+from itertools import combinations
+import numpy as np
+from ..config import settings
+from ..db import fetch_photo_phashes
+
+# Multi-index hashing over 64-bit pHashes: each code is split into four 16-bit
+# chunks and every chunk gets a bucket table. Two codes within Hamming distance
+# r agree to within r // 4 bits on at least one chunk (pigeonhole), so a search
+# only probes the buckets near the query's chunks and verifies those rows.
+# Tables are CSR arrays (rows sorted by chunk value + bucket offsets); rows added
+# or changed since the last rebuild sit in a tail that is scanned directly.
+
+_CHUNKS = 4
+_CHUNK_BITS = 16
+_POP8 = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+def code_from_bytes(b: bytes) -> int:
+    return int.from_bytes(b, byteorder="big", signed=False)
+
+def popcount64(x: np.ndarray) -> np.ndarray:
+    x = np.ascontiguousarray(x, dtype=np.uint64)
+    return _POP8[x.view(np.uint8)].reshape(-1, 8).sum(axis=1, dtype=np.int64)
+
+def _chunk(codes: np.ndarray, t: int) -> np.ndarray:
+    return ((codes >> np.uint64(t * _CHUNK_BITS)) & np.uint64(0xFFFF)).astype(np.int64)
+
+def _flip_masks(radius: int) -> np.ndarray:
+    masks = [0]
+    for r in range(1, radius + 1):
+        for bits in combinations(range(_CHUNK_BITS), r):
+            masks.append(sum(1 << b for b in bits))
+    return np.array(masks, dtype=np.int64)
+
+class HammingIndex:
+    def __init__(self, max_distance: int = 16):
+        self.max_distance = max_distance
+        self._masks = [_flip_masks(r) for r in range(max_distance // _CHUNKS + 1)]
+        self._reset()
+
+    def _reset(self):
+        self._codes = np.empty(0, dtype=np.uint64)
+        self._size = 0
+        self._photo_ids: list[str] = []
+        self._dog_ids: list[str | None] = []
+        self._row: dict[str, int] = {}
+        self._order: list[np.ndarray] = []
+        self._offsets: list[np.ndarray] = []
+        self._indexed = 0
+        self._tail: set[int] = set()
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _grow(self, n: int):
+        need = self._size + n
+        if need <= len(self._codes):
+            return
+        codes = np.empty(max(need, 2 * len(self._codes), 1024), dtype=np.uint64)
+        codes[:self._size] = self._codes[:self._size]
+        self._codes = codes
+
+    def rebuild(self):
+        codes = self._codes[:self._size]
+        self._order, self._offsets = [], []
+        for t in range(_CHUNKS):
+            ch = _chunk(codes, t)
+            order = np.argsort(ch, kind="stable").astype(np.int32)
+            self._order.append(order)
+            self._offsets.append(np.searchsorted(ch[order], np.arange((1 << _CHUNK_BITS) + 1)))
+        self._indexed = self._size
+        self._tail.clear()
+
+    def add(self, photo_ids: list[str], dog_ids: list[str | None], codes):
+        codes = np.asarray(codes, dtype=np.uint64).reshape(-1)
+        self._grow(len(codes))
+        for pid, did, code in zip(photo_ids, dog_ids, codes):
+            row = self._row.get(pid)
+            if row is None:
+                row = self._size
+                self._size += 1
+                self._row[pid] = row
+                self._photo_ids.append(pid)
+                self._dog_ids.append(did)
+            else:
+                if did is not None:
+                    self._dog_ids[row] = did
+                if self._codes[row] == code:
+                    continue
+            self._codes[row] = code
+            self._tail.add(row)
+        # rows re-hashed after a rebuild keep stale bucket entries; verification
+        # against the live codes filters those out
+        if len(self._tail) > max(4096, self._indexed // 8):
+            self.rebuild()
+
+    def build(self, photo_ids: list[str], dog_ids: list[str | None], codes):
+        self._reset()
+        codes = np.asarray(codes, dtype=np.uint64).reshape(-1)
+        self._row = {pid: i for i, pid in enumerate(photo_ids)}
+        if len(self._row) != len(photo_ids):
+            self._row = {}
+            self.add(photo_ids, dog_ids, codes)
+        else:
+            self._codes = codes.copy()
+            self._size = len(codes)
+            self._photo_ids = list(photo_ids)
+            self._dog_ids = list(dog_ids)
+        self.rebuild()
+
+    def _candidates(self, q: int, radius: int) -> np.ndarray:
+        parts = [np.fromiter(self._tail, dtype=np.int64, count=len(self._tail))]
+        if self._indexed:
+            # with radius = 4q + a, either one of the first a + 1 chunks is within
+            # q bits or one of the others is within q - 1
+            q_bits, a = divmod(radius, _CHUNKS)
+            for t in range(_CHUNKS):
+                r_t = q_bits if t <= a else q_bits - 1
+                if r_t < 0:
+                    continue
+                keys = ((q >> (t * _CHUNK_BITS)) & 0xFFFF) ^ self._masks[r_t]
+                lo, hi = self._offsets[t][keys], self._offsets[t][keys + 1]
+                lens = hi - lo
+                total = int(lens.sum())
+                if total:
+                    # concatenated bucket ranges without a Python loop over buckets
+                    starts = np.cumsum(lens) - lens
+                    parts.append(self._order[t][np.arange(total) + np.repeat(lo - starts, lens)])
+        rows = np.concatenate(parts).astype(np.int64, copy=False)
+        return np.unique(rows) if rows.size else rows
+
+    def search(self, code, radius: int | None = None, limit: int = 10) -> list[dict]:
+        q = code_from_bytes(code) if isinstance(code, (bytes, bytearray)) else int(code)
+        radius = self.max_distance if radius is None else min(radius, self.max_distance)
+        rows = self._candidates(q, radius)
+        if rows.size == 0:
+            return []
+        dist = popcount64(self._codes[rows] ^ np.uint64(q))
+        keep = dist <= radius
+        rows, dist = rows[keep], dist[keep]
+        order = np.lexsort((rows, dist))[:limit]
+        return [{"photo_id": self._photo_ids[r], "dog_id": self._dog_ids[r], "distance": int(d)}
+                for r, d in zip(rows[order].tolist(), dist[order].tolist())]
+
+    def search_exact(self, code, radius: int, limit: int = 10) -> list[dict]:
+        q = code_from_bytes(code) if isinstance(code, (bytes, bytearray)) else int(code)
+        dist = popcount64(self._codes[:self._size] ^ np.uint64(q))
+        rows = np.flatnonzero(dist <= radius)
+        order = np.lexsort((rows, dist[rows]))[:limit]
+        return [{"photo_id": self._photo_ids[r], "dog_id": self._dog_ids[r], "distance": int(dist[r])}
+                for r in rows[order].tolist()]
+
+    def stats(self) -> dict:
+        return {
+            "size": self._size,
+            "indexed": self._indexed,
+            "tail": len(self._tail),
+            "max_distance": self.max_distance,
+            "bytes": int(self._codes.nbytes + sum(o.nbytes for o in self._order)
+                         + sum(o.nbytes for o in self._offsets)),
+        }
+
+index: HammingIndex | None = None
+
+def enabled() -> bool:
+    return settings.dedup_enabled
+
+def find_duplicates(phash: bytes | None, max_distance: int, exclude: str | None = None,
+                    limit: int = 10) -> list[dict]:
+    if index is None or phash is None:
+        return []
+    hits = index.search(phash, max_distance, limit + (exclude is not None))
+    return [h for h in hits if h["photo_id"] != exclude][:limit]
+
+async def load_index():
+    global index
+    t0 = time.perf_counter()
+    photo_ids, dog_ids, codes = await fetch_photo_phashes()
+    idx = HammingIndex(settings.dedup_max_distance)
+    idx.build(photo_ids, dog_ids, codes)
+    index = idx
+    print(f"[dedup] Loaded {len(idx)} pHashes in {time.perf_counter() - t0:.2f}s")
+
+def on_analyze(photo_id: str, phash: bytes | None, dog_id: str | None):
+    # dog_id comes from the analysis save, which reads it in the same exchange
+    if index is None or phash is None:
+        return
+    index.add([photo_id], [dog_id], [code_from_bytes(phash)])
+
+async def on_confirm(dog_id: str | None):
+    if index is None or not dog_id:
+        return
+    photo_ids, dog_ids, codes = await fetch_photo_phashes(dog_id=dog_id)
+    if photo_ids:
+        index.add(photo_ids, dog_ids, codes)
@@ -1,37 +1,121 @@
+import asyncio
 import os
 import numpy as np
 from ..config import settings
+from ..utils.images import decode_for_embedding, preprocess_for_embedding
+from .batching import InferenceBatcher
+from . import metrics
+from .cache import content_digest, get_features_cache
+from .workers import run_cpu
+
+def _l2_normalize(m: np.ndarray) -> np.ndarray:
+    m = m.astype("float32", copy=False)
+    return m / (np.linalg.norm(m, axis=-1, keepdims=True) + 1e-9)
 
 class BaseEmbedder:
-    def embed(self, tensor: np.ndarray) -> list[float]:
+    input_shape: tuple[int, int, int] = (3, 224, 224)
+
+    def embed(self, tensor: np.ndarray) -> np.ndarray:
+        return self.embed_batch(tensor)[0]
+
+    def embed_batch(self, batch: np.ndarray) -> np.ndarray:
         raise NotImplementedError
 
+    def warmup(self, batch_sizes: tuple[int, ...] = (1,)):
+        # first runs pay for kernel selection and buffer allocation; do them before traffic
+        for n in batch_sizes:
+            self.embed_batch(np.zeros((n, *self.input_shape), dtype=np.float32))
+
 class RandomEmbedder(BaseEmbedder):
     def __init__(self, out_dim: int):
         self.out_dim = out_dim
 
-    def embed(self, tensor: np.ndarray) -> list[float]:
-        v = np.random.rand(self.out_dim).astype("float32")
-        v /= (np.linalg.norm(v) + 1e-9)
-        return v.tolist()
+    def embed_batch(self, batch: np.ndarray) -> np.ndarray:
+        return _l2_normalize(np.random.rand(batch.shape[0], self.out_dim))
+
+def _optimized_model_path(model_path: str, cache_dir: str, ort_version: str) -> str:
+    st = os.stat(model_path)
+    stem = os.path.splitext(os.path.basename(model_path))[0]
+    return os.path.join(cache_dir, f"{stem}-{st.st_size}-{int(st.st_mtime)}-ort{ort_version}.opt.onnx")
 
 class OnnxEmbedder(BaseEmbedder):
-    def __init__(self, model_path: str, out_dim: int):
+    # Graph optimization runs once: the optimized graph is written to cache_dir on
+    # the first start and loaded with optimizations off afterwards. The file is
+    # keyed by model size/mtime and onnxruntime version; ORT_ENABLE_ALL output
+    # may be specific to the CPU it was built on, so the cache belongs on local disk.
+    def __init__(self, model_path: str, out_dim: int,
+                 intra_op_threads: int = 0, inter_op_threads: int = 0, cache_dir: str | None = None):
         import onnxruntime as ort
-        self.session = ort.InferenceSession(model_path, providers=["CPUExecutionProvider"])
-        self.input_name = self.session.get_inputs()[0].name
+        self.cache_hit = False
+        cached = _optimized_model_path(model_path, cache_dir, ort.__version__) if cache_dir else None
+        if cached and os.path.exists(cached):
+            try:
+                self.session = self._session(ort, cached, ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+                                             intra_op_threads, inter_op_threads)
+                self.cache_hit = True
+            except Exception as e:
+                print(f"[embedder] Ignoring unreadable optimized model {cached}: {e}")
+                os.remove(cached)
+        if not self.cache_hit:
+            tmp = None
+            if cached:
+                os.makedirs(cache_dir, exist_ok=True)
+                tmp = f"{cached}.{os.getpid()}.tmp"
+            self.session = self._session(ort, model_path, ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+                                         intra_op_threads, inter_op_threads, save_to=tmp)
+            if tmp and os.path.exists(tmp):
+                os.replace(tmp, cached)
+        inp = self.session.get_inputs()[0]
+        self.input_name = inp.name
+        # Models exported with a fixed batch dimension of 1 get fed row by row.
+        self.fixed_batch = isinstance(inp.shape[0], int) and inp.shape[0] == 1
+        if all(isinstance(d, int) for d in inp.shape[1:]) and len(inp.shape) == 4:
+            self.input_shape = tuple(inp.shape[1:])
         self.out_dim = out_dim
 
-    def embed(self, tensor: np.ndarray) -> list[float]:
-        out = self.session.run(None, {self.input_name: tensor})[0]
-        vec = out[0].astype("float32")
-        vec /= (np.linalg.norm(vec) + 1e-9)
-        return vec.tolist()
+    @staticmethod
+    def _session(ort, path: str, level, intra_op_threads: int, inter_op_threads: int,
+                 save_to: str | None = None):
+        opts = ort.SessionOptions()
+        opts.graph_optimization_level = level
+        opts.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        if intra_op_threads > 0:
+            opts.intra_op_num_threads = intra_op_threads
+        if inter_op_threads > 0:
+            opts.inter_op_num_threads = inter_op_threads
+        if save_to:
+            opts.optimized_model_filepath = save_to
+        return ort.InferenceSession(path, sess_options=opts, providers=["CPUExecutionProvider"])
+
+    def embed_batch(self, batch: np.ndarray) -> np.ndarray:
+        batch = batch.astype("float32", copy=False)
+        if self.fixed_batch and batch.shape[0] > 1:
+            out = np.concatenate([self.session.run(None, {self.input_name: batch[i:i+1]})[0]
+                                  for i in range(batch.shape[0])], axis=0)
+        else:
+            out = self.session.run(None, {self.input_name: batch})[0]
+        return _l2_normalize(out.reshape(batch.shape[0], -1))
 
 embedder: BaseEmbedder | None = None
+batcher: InferenceBatcher | None = None
+model_id: str = ""
+
+def _model_identity(backend: str) -> str:
+    if backend != "onnx":
+        return f"{backend}-{settings.embed_vector_size}"
+    st = os.stat(settings.embed_model_path)
+    return f"onnx-{settings.embed_vector_size}-{st.st_size}-{int(st.st_mtime)}"
+
+def _warm_decode():
+    # loads the JPEG codec and resize paths once
+    import io
+    from PIL import Image
+    buf = io.BytesIO()
+    Image.new("RGB", (64, 64)).save(buf, format="JPEG")
+    decode_for_embedding(buf.getvalue())
 
 def init_embedder():
-    global embedder
+    global embedder, batcher, model_id
     backend = settings.embedder_backend.lower().strip()
     if backend == "random":
         embedder = RandomEmbedder(settings.embed_vector_size)
@@ -39,7 +123,115 @@ def init_embedder():
     elif backend == "onnx":
         if not os.path.exists(settings.embed_model_path):
             raise FileNotFoundError(f"ONNX model not found at {settings.embed_model_path}")
-        embedder = OnnxEmbedder(settings.embed_model_path, settings.embed_vector_size)
-        print("[embedder] Using OnnxEmbedder:", settings.embed_model_path)
+        embedder = OnnxEmbedder(settings.embed_model_path, settings.embed_vector_size,
+                                intra_op_threads=settings.onnx_intra_op_threads,
+                                inter_op_threads=settings.onnx_inter_op_threads,
+                                cache_dir=settings.onnx_cache_dir)
+        print("[embedder] Using OnnxEmbedder:", settings.embed_model_path,
+              "(optimized model cache hit)" if embedder.cache_hit else "")
     else:
         raise ValueError(f"Unknown EMBEDDER_BACKEND: {backend}")
+    model_id = _model_identity(backend)
+    if settings.embed_warmup:
+        embedder.warmup(tuple(sorted({1, settings.embed_max_batch})))
+        _warm_decode()
+    if batcher is not None:
+        batcher.stop()
+    label = backend
+
+    def _on_batch(n: int, seconds: float):
+        metrics.batch_sizes.observe(label, n)
+        metrics.batch_seconds.observe(label, seconds)
+
+    batcher = InferenceBatcher(embedder.embed_batch,
+                               max_batch=settings.embed_max_batch,
+                               max_wait_ms=settings.embed_max_wait_ms,
+                               on_batch=_on_batch)
+    batcher.start()
+    print(f"[embedder] Batching up to {batcher.max_batch} images / {settings.embed_max_wait_ms} ms")
+
+def close_embedder():
+    if batcher is not None:
+        batcher.stop()
+
+async def embed_async(tensor: np.ndarray) -> np.ndarray:
+    if batcher is None:
+        raise RuntimeError("Embedder not initialized")
+    return await batcher.embed(tensor)
+
+async def embed_image_bytes(data: bytes, digest: str | None = None) -> np.ndarray:
+    cache = get_features_cache()
+    key = None
+    if cache is not None:
+        key = f"emb:{model_id}:{digest or await run_cpu(content_digest, data)}"
+        vec = await cache.aget(key)
+        if vec is not None:
+            return vec
+    with metrics.stage("decode"):
+        tensor = await run_cpu(decode_for_embedding, data)
+    with metrics.stage("embed"):
+        vec = await embed_async(tensor)
+    if key is not None:
+        await cache.aput(key, vec)
+    return vec
+
+async def embed_image(img, digest: str | None = None) -> np.ndarray:
+    # for images the caller already decoded (streaming uploads); cached under the
+    # same key as embed_image_bytes when the digest of the encoded bytes is known
+    cache = get_features_cache()
+    key = f"emb:{model_id}:{digest}" if cache is not None and digest else None
+    if key is not None:
+        vec = await cache.aget(key)
+        if vec is not None:
+            return vec
+    with metrics.stage("decode"):
+        tensor = await run_cpu(preprocess_for_embedding, img)
+    with metrics.stage("embed"):
+        vec = await embed_async(tensor)
+    if key is not None:
+        await cache.aput(key, vec)
+    return vec
+
+async def embed_images_bytes(datas: list[bytes]) -> list[np.ndarray]:
+    # decodes concurrently and submits every tensor at once so they share one batch
+    cache = get_features_cache()
+    keys: list[str | None] = [None] * len(datas)
+    out: list[np.ndarray | None] = [None] * len(datas)
+    if cache is not None:
+        digests = await asyncio.gather(*(run_cpu(content_digest, d) for d in datas))
+        keys = [f"emb:{model_id}:{dg}" for dg in digests]
+        out = list(await asyncio.gather(*(cache.aget(key) for key in keys)))
+    todo = [i for i, v in enumerate(out) if v is None]
+    if todo:
+        if batcher is None:
+            raise RuntimeError("Embedder not initialized")
+        with metrics.stage("decode"):
+            tensors = await asyncio.gather(*(run_cpu(decode_for_embedding, datas[i]) for i in todo))
+        with metrics.stage("embed"):
+            vecs = await batcher.embed_many(list(tensors))
+        for i, vec in zip(todo, vecs):
+            out[i] = vec
+        if cache is not None:
+            await asyncio.gather(*(cache.aput(keys[i], out[i]) for i in todo))
+    return out
+
+async def embed_tensors(tensors: np.ndarray) -> np.ndarray:
+    # a stack of preprocessed images (e.g. patch crops) submitted together
+    if len(tensors) == 0:
+        return np.empty((0, settings.embed_vector_size), dtype=np.float32)
+    if batcher is None:
+        raise RuntimeError("Embedder not initialized")
+    with metrics.stage("embed"):
+        return np.stack(await batcher.embed_many([t[None] for t in tensors]))
+
+def _batcher_metrics() -> list[str]:
+    if batcher is None:
+        return []
+    return (metrics.gauge("petid_embed_queue_depth", "Images waiting for the inference thread.",
+                          {"": batcher.queue_depth()})
+            + metrics.gauge("petid_embed_batches_total", "Inference batches run.", {"": batcher.batches_run},
+                            kind="counter")
+            + metrics.gauge("petid_embed_items_total", "Images embedded.", {"": batcher.items_run},
+                            kind="counter"))
+
+metrics.register_collector(_batcher_metrics)
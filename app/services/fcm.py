@@ -1,48 +1,123 @@
-import os, json, time, requests
+import asyncio
+import json
+import os
+import time
 from typing import List, Dict
 
+import httpx
+from ..config import settings
+
 # Minimal FCM HTTP v1 sender using OAuth2 with service account credentials.
 # For production, you may prefer google-auth library. Here we implement a light JWT flow to avoid heavy deps.
+# The service account and the access token are cached; sends fan out over one pooled client.
+
+_SCOPE = "https://www.googleapis.com/auth/firebase.messaging"
+_REFRESH_MARGIN_S = 300
 
-import jwt  # PyJWT
-import requests
+_sa: dict | None = None
+_token: str | None = None
+_token_expires_at = 0.0
+_token_lock: asyncio.Lock | None = None
+_client: httpx.AsyncClient | None = None
 
-def _get_sa():
+def _get_sa() -> dict:
+    global _sa
+    if _sa is not None:
+        return _sa
     # Expect path in GOOGLE_APPLICATION_CREDENTIALS or inline JSON in FCM_SERVICE_ACCOUNT_JSON
     path = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
     if path and os.path.exists(path):
         with open(path, "r") as f:
-            return json.load(f)
+            _sa = json.load(f)
+        return _sa
     raw = os.getenv("FCM_SERVICE_ACCOUNT_JSON")
     if raw:
-        return json.loads(raw)
+        _sa = json.loads(raw)
+        return _sa
     raise RuntimeError("Service account not provided. Set GOOGLE_APPLICATION_CREDENTIALS or FCM_SERVICE_ACCOUNT_JSON.")
 
-def _get_access_token(sa: dict) -> str:
+def _assertion(sa: dict) -> str:
+    import jwt  # PyJWT; with cryptography only needed once a notification is sent
     iat = int(time.time())
-    exp = iat + 3600
     payload = {
         "iss": sa["client_email"],
-        "scope": "https://www.googleapis.com/auth/firebase.messaging",
+        "scope": _SCOPE,
         "aud": sa["token_uri"],
         "iat": iat,
-        "exp": exp,
+        "exp": iat + 3600,
     }
-    assertion = jwt.encode(payload, sa["private_key"], algorithm="RS256")
-    resp = requests.post(sa["token_uri"], data={
-        "grant_type": "urn:ietf:params:oauth:grant-type:jwt-bearer",
-        "assertion": assertion
-    }, timeout=20)
-    resp.raise_for_status()
-    return resp.json()["access_token"]
-
-def send_fcm(project_id: str, tokens: List[str], title: str, body: str, data: Dict[str, str] | None = None) -> dict:
-    sa = _get_sa()
-    access_token = _get_access_token(sa)
+    return jwt.encode(payload, sa["private_key"], algorithm="RS256")
+
+def _get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None:
+        try:
+            import h2  # noqa: F401
+            http2 = True
+        except ImportError:
+            http2 = False
+        _client = httpx.AsyncClient(
+            timeout=20, http2=http2,
+            limits=httpx.Limits(max_connections=settings.fcm_max_concurrency,
+                                max_keepalive_connections=settings.fcm_max_concurrency),
+        )
+    return _client
+
+async def close_fcm():
+    global _client
+    client, _client = _client, None
+    if client is not None:
+        await client.aclose()
+
+def _invalidate_token():
+    global _token, _token_expires_at
+    _token, _token_expires_at = None, 0.0
+
+async def _get_access_token() -> str:
+    global _token, _token_expires_at, _token_lock
+    if _token and time.time() < _token_expires_at - _REFRESH_MARGIN_S:
+        return _token
+    if _token_lock is None:
+        _token_lock = asyncio.Lock()
+    async with _token_lock:
+        if _token and time.time() < _token_expires_at - _REFRESH_MARGIN_S:
+            return _token
+        sa = _get_sa()
+        resp = await _get_client().post(sa["token_uri"], data={
+            "grant_type": "urn:ietf:params:oauth:grant-type:jwt-bearer",
+            "assertion": _assertion(sa),
+        })
+        resp.raise_for_status()
+        js = resp.json()
+        _token = js["access_token"]
+        _token_expires_at = time.time() + float(js.get("expires_in", 3600))
+        return _token
+
+def _error_code(resp: httpx.Response) -> tuple[str, str]:
+    try:
+        err = resp.json().get("error", {})
+    except ValueError:
+        return "", resp.text
+    code = err.get("status", "")
+    for d in err.get("details", []):
+        code = d.get("errorCode", code)
+    return code, err.get("message", "")
+
+def _is_dead(code: str, message: str) -> bool:
+    # only errors about the token itself; a bare 404 is also what a wrong project returns
+    if code == "UNREGISTERED":
+        return True
+    return code == "INVALID_ARGUMENT" and "registration token" in message.lower()
+
+async def send_fcm(project_id: str, tokens: List[str], title: str, body: str,
+                   data: Dict[str, str] | None = None) -> dict:
+    if not project_id:
+        raise RuntimeError("FCM project not configured. Set FCM_PROJECT_ID.")
     url = f"https://fcm.googleapis.com/v1/projects/{project_id}/messages:send"
-    headers = {"Authorization": f"Bearer {access_token}", "Content-Type": "application/json"}
-    results = []
-    for tok in tokens:
+    client = _get_client()
+    sem = asyncio.Semaphore(settings.fcm_max_concurrency)
+
+    async def _send(tok: str) -> dict:
         msg = {
             "message": {
                 "token": tok,
@@ -50,9 +125,22 @@ def send_fcm(project_id: str, tokens: List[str], title: str, body: str, data: Di
                 "data": data or {},
             }
         }
-        r = requests.post(url, headers=headers, json=msg, timeout=20)
-        if r.status_code >= 200 and r.status_code < 300:
-            results.append({"token": tok, "ok": True, "resp": r.json()})
-        else:
-            results.append({"token": tok, "ok": False, "status": r.status_code, "resp": r.text})
-    return {"sent": results}
+        async with sem:
+            for attempt in range(2):
+                headers = {"Authorization": f"Bearer {await _get_access_token()}"}
+                try:
+                    r = await client.post(url, headers=headers, json=msg)
+                except httpx.HTTPError as e:
+                    return {"token": tok, "ok": False, "dead": False, "error": str(e)}
+                if r.status_code == 401 and attempt == 0:
+                    _invalidate_token()
+                    continue
+                break
+        if 200 <= r.status_code < 300:
+            return {"token": tok, "ok": True, "resp": r.json()}
+        code, message = _error_code(r)
+        return {"token": tok, "ok": False, "status": r.status_code, "error": code or message,
+                "dead": _is_dead(code, message)}
+
+    results = await asyncio.gather(*(_send(t) for t in tokens))
+    return {"sent": list(results), "dead_tokens": [r["token"] for r in results if r.get("dead")]}
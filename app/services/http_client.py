@@ -0,0 +1,78 @@
+import asyncio
+from contextlib import asynccontextmanager
+from urllib.parse import urlsplit
+import httpx
+from ..config import settings
+from .metrics import timed
+
+class FetchTooLarge(ValueError):
+    pass
+
+_client: httpx.AsyncClient | None = None
+# per-host fetch limits, held only while a fetch to that host is active or waiting
+_host_slots: dict[str, list] = {}
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+def _make_client() -> httpx.AsyncClient:
+    http2 = settings.http2 and _http2_available()
+    if settings.http2 and not http2:
+        print("[http] HTTP2=true but the h2 package is missing; using HTTP/1.1")
+    return httpx.AsyncClient(
+        timeout=settings.http_timeout_s,
+        http2=http2,
+        limits=httpx.Limits(max_connections=settings.http_max_connections,
+                            max_keepalive_connections=settings.http_max_keepalive),
+    )
+
+def init_http():
+    global _client
+    if _client is None:
+        _client = _make_client()
+
+async def close_http():
+    global _client
+    client, _client = _client, None
+    _host_slots.clear()
+    if client is not None:
+        await client.aclose()
+
+def get_client() -> httpx.AsyncClient:
+    if _client is None:
+        init_http()
+    return _client
+
+@asynccontextmanager
+async def _slot(host: str):
+    entry = _host_slots.get(host)
+    if entry is None:
+        entry = _host_slots[host] = [asyncio.Semaphore(settings.fetch_per_host_concurrency), 0]
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            yield
+    finally:
+        entry[1] -= 1
+        if entry[1] == 0 and _host_slots.get(host) is entry:
+            del _host_slots[host]
+
+@timed("fetch")
+async def fetch_bytes(url: str, max_bytes: int | None = None) -> bytes:
+    limit = max_bytes or settings.fetch_max_bytes
+    async with _slot(urlsplit(url).hostname or ""):
+        async with get_client().stream("GET", url) as r:
+            r.raise_for_status()
+            declared = r.headers.get("content-length")
+            if declared and declared.isdigit() and int(declared) > limit:
+                raise FetchTooLarge(f"Remote file is {declared} bytes, limit is {limit}")
+            buf = bytearray()
+            async for chunk in r.aiter_bytes():
+                buf += chunk
+                if len(buf) > limit:
+                    raise FetchTooLarge(f"Remote file exceeds {limit} bytes")
+    return bytes(buf)
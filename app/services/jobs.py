@@ -0,0 +1,144 @@
+import asyncio
+import time
+import uuid
+from collections import OrderedDict
+from typing import Awaitable, Callable
+from ..config import settings
+from . import metrics
+
+# Bounded in-process background queue. Jobs are coroutine functions run by a
+# fixed number of worker tasks on the event loop (CPU stages inside them still
+# go through run_cpu). Submissions beyond max_pending are refused rather than
+# buffered, which also bounds the memory held by queued payloads. Job records
+# are kept for status polling until they expire; they do not survive a restart.
+
+class JobQueueFull(RuntimeError):
+    pass
+
+class JobQueue:
+    def __init__(self, workers: int = 2, max_pending: int = 64, keep_s: float = 3600.0,
+                 max_records: int = 10000):
+        self.workers = max(1, workers)
+        self.max_pending = max_pending
+        self.keep_s = keep_s
+        self.max_records = max_records
+        self._queue: asyncio.Queue | None = None
+        self._tasks: list[asyncio.Task] = []
+        self._jobs: OrderedDict[str, dict] = OrderedDict()
+        self._running = 0
+        self._reserved = 0
+        self.completed = 0
+        self.failed = 0
+
+    def _start(self):
+        loop = asyncio.get_running_loop()
+        if self._tasks and self._tasks[0].get_loop() is loop and not all(t.done() for t in self._tasks):
+            return
+        self._queue = asyncio.Queue()
+        self._tasks = [loop.create_task(self._worker()) for _ in range(self.workers)]
+
+    def pending(self) -> int:
+        return (self._queue.qsize() if self._queue is not None else 0) + self._running + self._reserved
+
+    def reserve(self):
+        # holds a slot for a job whose inputs are still being prepared; pass
+        # reserved=True to submit to use it, or release() it on failure
+        if self.pending() >= self.max_pending:
+            raise JobQueueFull(f"Background queue is full ({self.max_pending} jobs pending)")
+        self._reserved += 1
+
+    def release(self):
+        self._reserved = max(0, self._reserved - 1)
+
+    def _prune(self):
+        cutoff = time.time() - self.keep_s
+        while self._jobs:
+            job = next(iter(self._jobs.values()))
+            done = job["status"] in ("done", "failed")
+            if done and (len(self._jobs) > self.max_records or job["finished_at"] < cutoff):
+                self._jobs.popitem(last=False)
+            else:
+                break
+
+    def submit(self, kind: str, fn: Callable[..., Awaitable], *args, reserved: bool = False, **info) -> dict:
+        self._start()
+        if reserved:
+            self.release()
+        elif self.pending() >= self.max_pending:
+            raise JobQueueFull(f"Background queue is full ({self.max_pending} jobs pending)")
+        self._prune()
+        job = {"job_id": str(uuid.uuid4()), "kind": kind, "status": "queued", **info,
+               "created_at": time.time(), "started_at": None, "finished_at": None,
+               "result": None, "error": None}
+        self._jobs[job["job_id"]] = job
+        self._queue.put_nowait((job, fn, args))
+        return job
+
+    def get(self, job_id: str) -> dict | None:
+        return self._jobs.get(job_id)
+
+    async def _worker(self):
+        while True:
+            job, fn, args = await self._queue.get()
+            self._running += 1
+            job["status"], job["started_at"] = "running", time.time()
+            try:
+                job["result"] = await fn(*args)
+                job["status"] = "done"
+                self.completed += 1
+            except Exception as e:
+                job["status"], job["error"] = "failed", f"{type(e).__name__}: {e}"
+                self.failed += 1
+                print(f"[jobs] {job['kind']} {job['job_id']} failed: {job['error']}")
+            finally:
+                job["finished_at"] = time.time()
+                metrics.record_stage(f"job.{job['kind']}", job["finished_at"] - job["started_at"])
+                self._running -= 1
+                self._queue.task_done()
+
+    async def join(self):
+        if self._queue is not None:
+            await self._queue.join()
+
+    async def stop(self):
+        lost = self._queue.qsize() if self._queue is not None else 0
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if lost:
+            print(f"[jobs] Dropped {lost} queued jobs at shutdown")
+
+    def stats(self) -> dict:
+        return {"workers": self.workers, "max_pending": self.max_pending, "pending": self.pending(),
+                "running": self._running, "reserved": self._reserved, "completed": self.completed, "failed": self.failed,
+                "retained": len(self._jobs)}
+
+queue: JobQueue | None = None
+
+def init_jobs():
+    global queue
+    if queue is None:
+        queue = JobQueue(settings.ingest_workers, settings.ingest_queue_max, settings.ingest_job_ttl_s)
+        print(f"[jobs] Background queue workers={queue.workers} max_pending={queue.max_pending}")
+
+async def close_jobs():
+    global queue
+    q, queue = queue, None
+    if q is not None:
+        await q.stop()
+
+def get_queue() -> JobQueue:
+    if queue is None:
+        init_jobs()
+    return queue
+
+def _queue_metrics() -> list[str]:
+    if queue is None:
+        return []
+    st = queue.stats()
+    return (metrics.gauge("petid_jobs_pending", "Background jobs queued or running.", {"": st["pending"]})
+            + metrics.gauge("petid_jobs_total", "Background jobs finished by outcome.",
+                            {"done": st["completed"], "failed": st["failed"]}, label="status", kind="counter"))
+
+metrics.register_collector(_queue_metrics)
@@ -1,13 +1,20 @@
 from __future__ import annotations
 import numpy as np
 from PIL import Image
-from typing import List
+from functools import lru_cache
+from typing import List, Sequence
+import tracemalloc
+from ..config import settings
+from ..utils.images import preprocess_for_embedding
+from ..utils.pyramid import ImagePyramid
 
 def resize(img: Image.Image, size: int) -> Image.Image:
     return img.resize((size, size))
 
 def phash64(img: Image.Image) -> bytes:
-    g = np.asarray(resize(img, 32).convert("L"), dtype=np.float32)
+    return phash64_gray(np.asarray(resize(img, 32).convert("L"), dtype=np.float32))
+
+def phash64_gray(g: np.ndarray) -> bytes:
     F = np.fft.fft2(g)
     mag = np.abs(F)
     low = mag[:8, :8].copy()
@@ -74,11 +81,78 @@ def lbp_histogram(gray: np.ndarray) -> list[float]:
     hist, _ = np.histogram(code, bins=256, range=(0, 256), density=True)
     return hist.astype(np.float32).tolist()
 
+# Fast histogram engine (HISTOGRAM_ENGINE=lut). Works on uint8 input in row tiles so
+# temporaries stay bounded by tile_rows * width regardless of image size.
+# lbp_histogram_tiled matches lbp_histogram exactly. lab_histogram_lut quantizes RGB
+# to 7 bits per channel and looks the (L, a, b) bins up per cell, so pixels close to
+# a bin edge can land in the neighbouring bin. On photos the summed absolute
+# difference of the bin masses stays below 0.02 per channel (out of 1.0); a flat
+# single-colour image sitting on an edge can move its whole mass one bin over.
+
+_LAB_QBITS = 7
+
+def _bin_index(v: np.ndarray, lo: float, hi: float, bins: int) -> np.ndarray:
+    idx = np.floor((v - lo) / (hi - lo) * bins).astype(np.int64)
+    return np.clip(idx, 0, bins - 1).astype(np.uint8)
+
+@lru_cache(maxsize=4)
+def _lab_bin_lut(bins: int) -> np.ndarray:
+    q = 1 << _LAB_QBITS
+    step = 256 // q
+    levels = (np.arange(q, dtype=np.float32) * step + (step - 1) / 2.0) / 255.0
+    r, g, b = np.meshgrid(levels, levels, levels, indexing="ij")
+    lab = _xyz_to_lab(_rgb_to_xyz(_srgb_to_linear(np.stack([r, g, b], axis=-1)))).reshape(-1, 3)
+    return np.stack([
+        _bin_index(np.clip(lab[:, 0], 0, 100), 0, 100, bins),
+        _bin_index(np.clip(lab[:, 1], -128, 127), -128, 127, bins),
+        _bin_index(np.clip(lab[:, 2], -128, 127), -128, 127, bins),
+    ])
+
+def lab_histogram_lut(rgb: np.ndarray, bins: int = 16, tile_rows: int = 256) -> list[float]:
+    rgb = np.asarray(rgb)
+    if rgb.dtype != np.uint8:
+        rgb = np.clip(rgb, 0, 255).astype(np.uint8)
+    lut = _lab_bin_lut(bins)
+    shift = 8 - _LAB_QBITS
+    counts = np.zeros((3, bins), dtype=np.int64)
+    for r0 in range(0, rgb.shape[0], tile_rows):
+        t = rgb[r0:r0 + tile_rows]
+        idx = (t[..., 0] >> shift).astype(np.uint32) << (2 * _LAB_QBITS)
+        idx |= (t[..., 1] >> shift).astype(np.uint32) << _LAB_QBITS
+        idx |= t[..., 2] >> shift
+        idx = idx.ravel()
+        for c in range(3):
+            counts[c] += np.bincount(lut[c].take(idx), minlength=bins)
+    n = max(rgb.shape[0] * rgb.shape[1], 1)
+    widths = np.array([100 / bins, 255 / bins, 255 / bins])[:, None]
+    return (counts / (n * widths)).astype(np.float32).ravel().tolist()
+
+_LBP_NEIGHBOURS = ((0, 0), (0, 1), (0, 2), (1, 2), (2, 2), (2, 1), (2, 0), (1, 0))
+
+def lbp_histogram_tiled(gray: np.ndarray, tile_rows: int = 256) -> list[float]:
+    H, W = gray.shape
+    counts = np.zeros(256, dtype=np.int64)
+    for r0 in range(0, H, tile_rows):
+        r1 = min(r0 + tile_rows, H)
+        lo, hi = max(r0 - 1, 0), min(r1 + 1, H)
+        t = np.pad(gray[lo:hi], ((1 if r0 == 0 else 0, 1 if r1 == H else 0), (1, 1)), mode="edge")
+        h = r1 - r0
+        c = t[1:h+1, 1:W+1]
+        code = np.zeros((h, W), dtype=np.uint8)
+        bit = np.empty((h, W), dtype=np.bool_)
+        shifted = bit.view(np.uint8)
+        for k, (dy, dx) in enumerate(_LBP_NEIGHBOURS):
+            np.greater_equal(t[dy:dy+h, dx:dx+W], c, out=bit)
+            np.left_shift(shifted, 7 - k, out=shifted)
+            np.bitwise_or(code, shifted, out=code)
+        counts += np.bincount(code.ravel(), minlength=256)
+    return (counts / max(H * W, 1)).astype(np.float32).tolist()
+
 def gradient_map(gray: np.ndarray) -> np.ndarray:
     gx = np.zeros_like(gray)
     gy = np.zeros_like(gray)
-    gx[:, 1:-1] = (gray[:, 2:] - gray[:, :-2]) * 0.5
-    gy[1:-1, :] = (gray[2:, :] - gray[:-2, :]) * 0.5
+    gx[..., :, 1:-1] = (gray[..., :, 2:] - gray[..., :, :-2]) * 0.5
+    gy[..., 1:-1, :] = (gray[..., 2:, :] - gray[..., :-2, :]) * 0.5
     mag = np.sqrt(gx * gx + gy * gy)
     return mag
 
@@ -106,25 +180,153 @@ def nms_boxes(boxes: List[tuple[int,int,int,int]], scores: List[float], iou_thr:
         order = inds + 1 if hasattr(inds, "__len__") else []
     return keep
 
-def pick_distinctive_patches(img: Image.Image, k: int = 5, win: int = 64, stride: int = 32) -> List[tuple[int,int,int,int,float]]:
-    S = 256
+def integral_image(a: np.ndarray) -> np.ndarray:
+    # Summed-area table over the last two axes, padded with a leading zero row/column.
+    shape = a.shape[:-2] + (a.shape[-2] + 1, a.shape[-1] + 1)
+    sat = np.zeros(shape, dtype=np.float64)
+    np.cumsum(np.cumsum(a, axis=-2, dtype=np.float64), axis=-1, out=sat[..., 1:, 1:])
+    return sat
+
+def window_grid(h: int, w: int, wins: Sequence[int], stride: int) -> np.ndarray:
+    # (N, 4) boxes as (x, y, win, win), row-major per scale like the original scan.
+    out = []
+    for win in wins:
+        ys = np.arange(0, h - win + 1, stride)
+        xs = np.arange(0, w - win + 1, stride)
+        if ys.size == 0 or xs.size == 0:
+            continue
+        yy, xx = np.meshgrid(ys, xs, indexing="ij")
+        n = yy.size
+        out.append(np.stack([xx.ravel(), yy.ravel(), np.full(n, win), np.full(n, win)], axis=1))
+    return np.concatenate(out) if out else np.empty((0, 4), dtype=np.int64)
+
+def window_means(sat: np.ndarray, boxes: np.ndarray) -> np.ndarray:
+    x, y, w, h = boxes.T
+    s = sat[..., y + h, x + w] - sat[..., y, x + w] - sat[..., y + h, x] + sat[..., y, x]
+    return s / (w * h)
+
+def _patch_gray(img: Image.Image, S: int = 256) -> np.ndarray:
     scale = S / min(img.size)
     new_w = int(img.width * scale); new_h = int(img.height * scale)
-    im = img.resize((new_w, new_h)).convert("L")
-    g = np.asarray(im, dtype=np.float32)
-    mag = gradient_map(g)
-    boxes, scores = [], []
-    for y in range(0, new_h - win + 1, stride):
-        for x in range(0, new_w - win + 1, stride):
-            patch = mag[y:y+win, x:x+win]
-            score = float(patch.mean())
-            boxes.append((x, y, win, win))
-            scores.append(score)
-    if not boxes:
+    return np.asarray(img.resize((new_w, new_h)).convert("L"), dtype=np.float32)
+
+# SAT means are float64 while the original scan used float32 slice means. Their
+# difference is float32 summation error: bounded near 1.5e-6 of the value for
+# windows up to 128x128, measured below 3e-7.
+_RESCORE_RTOL = 4e-6
+
+def _select_patches(mag: np.ndarray, boxes: np.ndarray, scores: np.ndarray, k: int) -> List[tuple[int,int,int,int,float]]:
+    if boxes.shape[0] == 0:
         return []
-    import numpy as np
-    idxs = np.argsort(scores)[::-1][:max(50, 5*k)]
-    boxes_sel = [boxes[i] for i in idxs]
-    scores_sel = [scores[i] for i in idxs]
+    n = max(50, 5*k)
+    # Windows in a near-tie (and the top n) are re-scored with the plain slice mean.
+    # Every other pair is far enough apart that the SAT means order it the same way,
+    # so argsort sees the same comparisons as on the original scores and returns the
+    # original ranking, ties included.
+    exact = np.array(scores, dtype=np.float64)
+    srt = np.argsort(scores, kind="stable")
+    close = np.flatnonzero(np.diff(scores[srt]) <= 2 * _RESCORE_RTOL * scores.max())
+    redo = np.zeros(len(scores), dtype=bool)
+    redo[srt[close]] = redo[srt[close + 1]] = True
+    redo[srt[-n:]] = True
+    for i in np.flatnonzero(redo):
+        x, y, w, h = (int(v) for v in boxes[i])
+        exact[i] = float(mag[y:y+h, x:x+w].mean())
+    idxs = np.argsort(exact)[::-1][:n]
+    boxes_sel = [tuple(int(v) for v in boxes[i]) for i in idxs]
+    scores_sel = [float(exact[i]) for i in idxs]
     keep = nms_boxes(boxes_sel, scores_sel, iou_thr=0.4)[:k]
     return [(boxes_sel[i][0], boxes_sel[i][1], boxes_sel[i][2], boxes_sel[i][3], scores_sel[i]) for i in keep]
+
+def pick_distinctive_patches_gray(g: np.ndarray, k: int = 5, win: int = 64, stride: int = 32,
+                                  wins: Sequence[int] | None = None) -> List[tuple[int,int,int,int,float]]:
+    mag = gradient_map(g)
+    boxes = window_grid(mag.shape[0], mag.shape[1], wins or (win,), stride)
+    scores = window_means(integral_image(mag), boxes)
+    return _select_patches(mag, boxes, scores, k)
+
+def pick_distinctive_patches(img: Image.Image, k: int = 5, win: int = 64, stride: int = 32,
+                             wins: Sequence[int] | None = None) -> List[tuple[int,int,int,int,float]]:
+    return pick_distinctive_patches_gray(_patch_gray(img), k=k, win=win, stride=stride, wins=wins)
+
+def pick_distinctive_patches_batch(imgs: Sequence[Image.Image], k: int = 5, win: int = 64, stride: int = 32,
+                                   wins: Sequence[int] | None = None) -> List[List[tuple[int,int,int,int,float]]]:
+    # Images whose working resolution matches are stacked and scored together.
+    grays = [_patch_gray(im) for im in imgs]
+    out: List[List[tuple[int,int,int,int,float]]] = [[] for _ in imgs]
+    groups: dict[tuple[int, int], list[int]] = {}
+    for i, g in enumerate(grays):
+        groups.setdefault(g.shape, []).append(i)
+    for (h, w), members in groups.items():
+        mags = gradient_map(np.stack([grays[i] for i in members]))
+        boxes = window_grid(h, w, wins or (win,), stride)
+        scores = window_means(integral_image(mags), boxes)
+        for j, i in enumerate(members):
+            out[i] = _select_patches(mags[j], boxes, scores[j], k)
+    return out
+
+def phash_image_bytes(data: bytes) -> bytes:
+    # same decode path as extract_markings so both produce identical hashes
+    return phash64_gray(ImagePyramid(data, max_side=settings.analyze_max_side).gray_square(32))
+
+# patch boxes are in the coordinates of the pyramid level with this short side
+_PATCH_SIDE = 256
+
+def _markings_from_pyramid(pyr: ImagePyramid, k: int, win: int, stride: int) -> dict:
+    fast = settings.histogram_engine.lower().strip() == "lut"
+    return {
+        "phash": phash64_gray(pyr.gray_square(32)),
+        "lab": lab_histogram_lut(np.asarray(pyr.rgb), bins=16) if fast else lab_histogram(pyr.rgb, bins=16),
+        "lbp": lbp_histogram_tiled(pyr.gray()) if fast else lbp_histogram(pyr.gray()),
+        "patches": pick_distinctive_patches_gray(pyr.gray_min_side(_PATCH_SIDE), k=k, win=win, stride=stride),
+    }
+
+def _patch_crops(pyr: ImagePyramid, patches, size: int = 224) -> np.ndarray:
+    # embedder input tensors for patch boxes, cropped from the RGB base
+    f = min(pyr.rgb.size) / _PATCH_SIDE
+    crops = [preprocess_for_embedding(pyr.rgb.crop((int(x * f), int(y * f), int((x + w) * f), int((y + h) * f))), size)
+             for (x, y, w, h, *_) in patches]
+    return np.concatenate(crops) if crops else np.empty((0, 3, size, size), dtype=np.float32)
+
+def patch_tensors(data: bytes, patches) -> np.ndarray:
+    return _patch_crops(ImagePyramid(data, max_side=settings.analyze_max_side), patches)
+
+def extract_patch_tensors(data: bytes, k: int = 5, win: int = 64, stride: int = 32) -> np.ndarray:
+    # query side of part re-ranking: pick patches and crop them from one decode
+    pyr = ImagePyramid(data, max_side=settings.analyze_max_side)
+    patches = pick_distinctive_patches_gray(pyr.gray_min_side(_PATCH_SIDE), k=k, win=win, stride=stride)
+    return _patch_crops(pyr, patches)
+
+def appearance_histograms(data: bytes) -> tuple[list[float], list[float]]:
+    # the Lab/LBP part of extract_markings, for appearance queries
+    pyr = ImagePyramid(data, max_side=settings.analyze_max_side)
+    if settings.histogram_engine.lower().strip() == "lut":
+        return lab_histogram_lut(np.asarray(pyr.rgb), bins=16), lbp_histogram_tiled(pyr.gray())
+    return lab_histogram(pyr.rgb, bins=16), lbp_histogram(pyr.gray())
+
+def extract_markings(data: bytes, k: int = 5, win: int = 64, stride: int = 32) -> dict:
+    # tracemalloc is process-wide: with concurrent thread workers the traced peak is approximate
+    trace = settings.analyze_trace_memory and not tracemalloc.is_tracing()
+    if trace:
+        tracemalloc.start()
+    try:
+        pyr = ImagePyramid(data, max_side=settings.analyze_max_side)
+        feats = _markings_from_pyramid(pyr, k, win, stride)
+        feats["memory"] = pyr.stats()
+        if trace:
+            feats["memory"]["traced_peak_bytes"] = tracemalloc.get_traced_memory()[1]
+    finally:
+        if trace:
+            tracemalloc.stop()
+    return feats
+
+def extract_ingest_features(data: bytes, k: int = 5, win: int = 64, stride: int = 32,
+                            crops: bool = False) -> tuple[np.ndarray, dict]:
+    # one decode for /v1/ingest: the embedding tensor, the markings and (with crops)
+    # the patch tensors all come from the same pyramid base
+    pyr = ImagePyramid(data, max_side=settings.analyze_max_side)
+    feats = _markings_from_pyramid(pyr, k, win, stride)
+    if crops:
+        feats["patch_tensors"] = _patch_crops(pyr, feats["patches"])
+    feats["memory"] = pyr.stats()
+    return preprocess_for_embedding(pyr.rgb), feats
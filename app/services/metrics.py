@@ -0,0 +1,146 @@
+import contextvars
+import random
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+from typing import Callable
+
+from ..config import settings
+
+# Minimal Prometheus text-format metrics without a client library. Histograms
+# keep cumulative-at-render bucket counts per label value under one lock; hot
+# paths only pay a bisect, two additions and a contextvar lookup per stage.
+
+_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Histogram:
+    def __init__(self, name: str, help: str, label: str, buckets: tuple = _BUCKETS):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = buckets
+        self._series: dict[str, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label: str, value: float):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            s = self._series.get(label)
+            if s is None:
+                s = self._series[label] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            s[0][i] += 1
+            s[1] += value
+            s[2] += 1
+
+    def snapshot(self, label: str) -> dict | None:
+        with self._lock:
+            s = self._series.get(label)
+            return None if s is None else {"count": s[2], "sum": s[1]}
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {k: (list(v[0]), v[1], v[2]) for k, v in self._series.items()}
+        for label, (counts, total, n) in sorted(series.items()):
+            lv = _escape(label)
+            acc = 0
+            for le, c in zip(self.buckets, counts):
+                acc += c
+                lines.append(f'{self.name}_bucket{{{self.label}="{lv}",le="{le}"}} {acc}')
+            lines.append(f'{self.name}_bucket{{{self.label}="{lv}",le="+Inf"}} {n}')
+            lines.append(f'{self.name}_sum{{{self.label}="{lv}"}} {total}')
+            lines.append(f'{self.name}_count{{{self.label}="{lv}"}} {n}')
+        return lines
+
+def _escape(v: str) -> str:
+    return v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+requests = Histogram("petid_request_seconds", "Request latency by route and method.", "route")
+stages = Histogram("petid_stage_seconds", "Latency of named request stages.", "stage")
+batch_sizes = Histogram("petid_embed_batch_size", "Images per inference batch.", "backend",
+                        buckets=(1, 2, 4, 8, 16, 32, 64))
+batch_seconds = Histogram("petid_embed_batch_seconds", "Inference time per batch.", "backend")
+
+_collectors: list[Callable[[], list[str]]] = []
+_breakdown: contextvars.ContextVar[dict | None] = contextvars.ContextVar("petid_stage_breakdown", default=None)
+
+def register_collector(fn: Callable[[], list[str]]):
+    # fn returns Prometheus text lines and is called on every scrape
+    _collectors.append(fn)
+
+def gauge(name: str, help: str, samples: dict[str, float], label: str | None = None,
+          kind: str = "gauge") -> list[str]:
+    lines = [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+    for lv, v in samples.items():
+        lines.append(f'{name}{{{label}="{_escape(lv)}"}} {v}' if label else f"{name} {v}")
+    return lines
+
+def record_stage(name: str, seconds: float):
+    stages.observe(name, seconds)
+    bd = _breakdown.get()
+    if bd is not None:
+        bd[name] = bd.get(name, 0.0) + seconds
+
+@contextmanager
+def stage(name: str):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - t0)
+
+def timed(name: str):
+    # decorator for coroutine functions
+    def wrap(fn):
+        @wraps(fn)
+        async def inner(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                record_stage(name, time.perf_counter() - t0)
+        return inner
+    return wrap
+
+def render() -> str:
+    lines = requests.render() + stages.render() + batch_sizes.render() + batch_seconds.render()
+    for fn in _collectors:
+        try:
+            lines += fn()
+        except Exception as e:
+            lines.append(f"# collector {getattr(fn, '__name__', fn)} failed: {e}")
+    return "\n".join(lines) + "\n"
+
+class MetricsMiddleware:
+    # Plain ASGI middleware (no BaseHTTPMiddleware task/stream overhead). Routes are
+    # labelled by their template, e.g. /v1/dogs/{dog_id}, so cardinality stays bounded.
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not settings.metrics_enabled:
+            return await self.app(scope, receive, send)
+        bd: dict = {}
+        token = _breakdown.set(bd)
+        status = [0]
+
+        async def _send(msg):
+            if msg["type"] == "http.response.start":
+                status[0] = msg["status"]
+            await send(msg)
+
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            elapsed = time.perf_counter() - t0
+            _breakdown.reset(token)
+            route = scope.get("route")
+            label = f'{scope["method"]} {route.path if route is not None else "unmatched"}'
+            requests.observe(label, elapsed)
+            slow_ms = settings.metrics_slow_request_ms
+            if slow_ms > 0 and elapsed * 1000 >= slow_ms and random.random() < settings.metrics_slow_sample_rate:
+                parts = " ".join(f"{k}={v * 1000:.1f}ms" for k, v in sorted(bd.items(), key=lambda kv: -kv[1]))
+                print(f"[slow] {label} status={status[0]} total={elapsed * 1000:.1f}ms {parts}")
@@ -0,0 +1,161 @@
+from collections import OrderedDict
+import numpy as np
+from ..config import settings
+from ..db import fetch_part_centroids, on_centroids_changed
+from . import embedding, metrics
+from .markings import extract_patch_tensors
+from .workers import run_cpu
+
+# Part-centroid re-ranking. Unit-normalized centroids live in one growable
+# float32 matrix with each dog's parts in a contiguous row range, so scoring the
+# candidates of a match is one gather plus one (rows x patches) matrix multiply.
+# Dogs are loaded on first use (one query for all misses), evicted LRU past
+# max_dogs and dropped whenever their centroids are written.
+
+class PartCentroidMatrix:
+    def __init__(self, dim: int, max_dogs: int = 50000):
+        self.dim = dim
+        self.max_dogs = max_dogs
+        self._mat = np.empty((0, dim), dtype=np.float32)
+        self._used = 0
+        self._dogs: OrderedDict[str, tuple[int, int]] = OrderedDict()
+        self._live = 0
+        self.loads = 0
+
+    def __contains__(self, dog_id: str) -> bool:
+        return dog_id in self._dogs
+
+    def __len__(self) -> int:
+        return len(self._dogs)
+
+    def _compact(self):
+        order = [(d, a, b) for d, (a, b) in self._dogs.items()]
+        mat = np.empty((max(self._live, 1024), self.dim), dtype=np.float32)
+        pos = 0
+        for d, a, b in order:
+            mat[pos:pos + b - a] = self._mat[a:b]
+            self._dogs[d] = (pos, pos + b - a)
+            pos += b - a
+        self._mat, self._used = mat, pos
+
+    def _reserve(self, n: int):
+        if self._used + n <= len(self._mat):
+            return
+        if self._used - self._live > self._live:
+            self._compact()
+            if self._used + n <= len(self._mat):
+                return
+        mat = np.empty((max(self._used + n, 2 * len(self._mat), 1024), self.dim), dtype=np.float32)
+        mat[:self._used] = self._mat[:self._used]
+        self._mat = mat
+
+    def put(self, dog_id: str, centroids: np.ndarray):
+        # replaces the dog's parts; an empty array records "no centroids" so it is not refetched
+        self.drop([dog_id])
+        c = np.asarray(centroids, dtype=np.float32).reshape(-1, self.dim)
+        self._reserve(len(c))
+        a = self._used
+        self._mat[a:a + len(c)] = c / (np.linalg.norm(c, axis=1, keepdims=True) + 1e-9)
+        self._used += len(c)
+        self._live += len(c)
+        self._dogs[dog_id] = (a, a + len(c))
+        while len(self._dogs) > self.max_dogs:
+            _, (x, y) = self._dogs.popitem(last=False)
+            self._live -= y - x
+
+    def drop(self, dog_ids):
+        for d in dog_ids:
+            span = self._dogs.pop(d, None)
+            if span is not None:
+                self._live -= span[1] - span[0]
+
+    def score(self, patches: np.ndarray, dog_ids: list[str]) -> dict[str, float]:
+        # mean over query patches of the best-matching part of each dog
+        p = np.asarray(patches, dtype=np.float32).reshape(-1, self.dim)
+        if len(p) == 0:
+            return {}
+        p = p / (np.linalg.norm(p, axis=1, keepdims=True) + 1e-9)
+        spans = [(d, self._dogs[d]) for d in dog_ids if d in self._dogs and self._dogs[d][1] > self._dogs[d][0]]
+        if not spans:
+            return {}
+        for d, _ in spans:
+            self._dogs.move_to_end(d)
+        rows = np.concatenate([np.arange(a, b) for _, (a, b) in spans])
+        sims = self._mat[rows] @ p.T
+        starts = np.cumsum([0] + [b - a for _, (a, b) in spans[:-1]])
+        best = np.maximum.reduceat(sims, starts, axis=0)
+        return {d: float(s) for (d, _), s in zip(spans, best.mean(axis=1))}
+
+    def stats(self) -> dict:
+        return {"dogs": len(self._dogs), "rows": self._live, "allocated_rows": len(self._mat),
+                "bytes": int(self._mat.nbytes), "loads": self.loads}
+
+matrix: PartCentroidMatrix | None = None
+# dogs written while a fetch is in flight, one set per pending ensure()
+_changed_during_fetch: list[set[str]] = []
+
+def enabled() -> bool:
+    return settings.match_rerank
+
+def get_matrix() -> PartCentroidMatrix:
+    global matrix
+    if matrix is None:
+        matrix = PartCentroidMatrix(settings.embed_vector_size, settings.rerank_cache_max_dogs)
+    return matrix
+
+def invalidate(dog_ids):
+    for changed in _changed_during_fetch:
+        changed.update(dog_ids)
+    if matrix is not None:
+        matrix.drop(dog_ids)
+
+on_centroids_changed(invalidate)
+
+async def ensure(dog_ids: list[str]):
+    m = get_matrix()
+    missing = [d for d in dict.fromkeys(dog_ids) if d not in m]
+    if not missing:
+        return
+    changed: set[str] = set()
+    _changed_during_fetch.append(changed)
+    try:
+        rows = await fetch_part_centroids(missing)
+    finally:
+        _changed_during_fetch.remove(changed)
+    # rows of dogs written while fetching may be stale; those are loaded next time
+    by_dog: dict[str, list[np.ndarray]] = {d: [] for d in missing if d not in changed}
+    for r in rows:
+        vec = np.asarray(r["centroid"], dtype=np.float32)
+        # centroids from another embedder (e.g. legacy random patch vectors) cannot be compared
+        if vec.shape == (m.dim,) and r["dog_id"] in by_dog:
+            by_dog[r["dog_id"]].append(vec)
+    for d, vecs in by_dog.items():
+        m.put(d, np.stack(vecs) if vecs else np.empty((0, m.dim), dtype=np.float32))
+    m.loads += 1
+
+def blend(rows: list[dict], scores: dict[str, float], weight: float) -> list[dict]:
+    # final_score = (1 - weight) * final_score + weight * part for every candidate, on
+    # the scale the match query produced. Dogs without usable centroids take the mean
+    # part score of the others, so they neither gain nor lose against them.
+    neutral = float(np.mean(list(scores.values()))) if scores else None
+    out = []
+    for r in rows:
+        part = scores.get(str(r["dog_id"]))
+        r = {**r, "parts": part}
+        if neutral is not None:
+            r["final_score"] = (1 - weight) * r["final_score"] + weight * (neutral if part is None else part)
+        out.append(r)
+    out.sort(key=lambda r: -r["final_score"])
+    return out
+
+async def rerank(data: bytes, rows: list[dict], k: int) -> list[dict]:
+    if not rows:
+        return rows
+    dog_ids = [str(r["dog_id"]) for r in rows]
+    with metrics.stage("rerank.patches"):
+        tensors = await run_cpu(extract_patch_tensors, data)
+    vecs = await embedding.embed_tensors(tensors)
+    await ensure(dog_ids)
+    with metrics.stage("rerank.score"):
+        scores = get_matrix().score(vecs, dog_ids)
+    return blend(rows, scores, settings.match_rerank_weight)[:k]
@@ -0,0 +1,159 @@
+import numpy as np
+
+# Compact codes for the coarse stage of two-stage matching. Codes only rank
+# candidates; the final visual score is always the exact float cosine (rerank).
+#   int8:   per-dimension symmetric scale, scored asymmetrically (float query
+#           against int8 codes), 4x smaller than float32
+#   binary: one sign bit per dimension, scored by Hamming distance, 32x smaller
+# An optional PCA projection (pca_dim > 0) shrinks both further. Binary codes
+# without PCA are just (x > 0) bits, identical to pgvector's binary_quantize(),
+# so they can be stored next to the float vector and reloaded without the floats.
+
+_POP8 = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+_POP16 = _POP8[np.arange(1 << 16) & 0xFF] + _POP8[np.arange(1 << 16) >> 8]
+_CHUNK = 65536
+# rows per scan step; int8 rows are widened to float32, so keep that block in cache
+_SCAN_BINARY = 4096
+_SCAN_INT8 = 256
+
+def sign_bits(vecs: np.ndarray) -> np.ndarray:
+    return np.packbits(np.asarray(vecs) > 0, axis=-1)
+
+class Quantizer:
+    def __init__(self, kind: str = "int8", pca_dim: int = 0):
+        if kind not in ("int8", "binary"):
+            raise ValueError(f"Unknown quantization kind: {kind}")
+        self.kind = kind
+        self.pca_dim = pca_dim
+        self.mean: np.ndarray | None = None
+        self.components: np.ndarray | None = None
+        self.scale: np.ndarray | None = None
+
+    def fit(self, sample: np.ndarray) -> "Quantizer":
+        x = np.asarray(sample, dtype=np.float32)
+        if self.pca_dim and self.pca_dim < x.shape[1] and len(x) > self.pca_dim:
+            self.mean = x.mean(axis=0)
+            _, _, vt = np.linalg.svd(x - self.mean, full_matrices=False)
+            self.components = vt[:self.pca_dim].astype(np.float32)
+        if self.kind == "int8":
+            p = self.project(x)
+            bound = np.percentile(np.abs(p), 99.9, axis=0) if len(p) else np.ones(p.shape[1])
+            self.scale = (127.0 / np.maximum(bound, 1e-6)).astype(np.float32)
+        return self
+
+    def project(self, x: np.ndarray) -> np.ndarray:
+        x = np.asarray(x, dtype=np.float32)
+        if self.components is None:
+            return x
+        return (x - self.mean) @ self.components.T
+
+    @property
+    def code_dim(self) -> int | None:
+        return self.components.shape[0] if self.components is not None else None
+
+    def code_bytes(self, dim: int) -> int:
+        d = self.code_dim or dim
+        return d if self.kind == "int8" else (d + 7) // 8
+
+    def encode(self, x: np.ndarray) -> np.ndarray:
+        p = self.project(np.atleast_2d(x))
+        if self.kind == "binary":
+            return sign_bits(p)
+        return np.clip(np.rint(p * self.scale), -127, 127).astype(np.int8)
+
+    def scores(self, q: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        # higher is closer
+        p = self.project(np.asarray(q, dtype=np.float32).reshape(1, -1))[0]
+        out = np.empty(len(codes), dtype=np.float32)
+        if self.kind == "binary":
+            qb = sign_bits(p)
+            if codes.shape[1] % 2 == 0:
+                # 16-bit lookups halve the table reads
+                codes, qb, pop = codes.view(np.uint16), qb.view(np.uint16), _POP16
+            else:
+                pop = _POP8
+            for i in range(0, len(codes), _SCAN_BINARY):
+                c = codes[i:i + _SCAN_BINARY]
+                out[i:i + len(c)] = -pop[c ^ qb].sum(axis=1, dtype=np.int32)
+            return out
+        w = p / self.scale
+        for i in range(0, len(codes), _SCAN_INT8):
+            c = codes[i:i + _SCAN_INT8]
+            out[i:i + len(c)] = c.astype(np.float32) @ w
+        return out
+
+class QuantizedIndex:
+    # Coarse index holding only codes, photo ids and dog ids; floats stay in Postgres.
+    def __init__(self, dim: int, kind: str = "int8", pca_dim: int = 0):
+        self.dim = dim
+        self.quantizer = Quantizer(kind, pca_dim)
+        self._codes: np.ndarray | None = None
+        self._size = 0
+        self._photo_ids: list[str] = []
+        self._dog_ids: list[str | None] = []
+        self._row: dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _grow(self, n: int, width: int, dtype):
+        need = self._size + n
+        if self._codes is not None and need <= len(self._codes):
+            return
+        cap = max(need, 2 * (len(self._codes) if self._codes is not None else 0), 1024)
+        codes = np.empty((cap, width), dtype=dtype)
+        if self._codes is not None:
+            codes[:self._size] = self._codes[:self._size]
+        self._codes = codes
+
+    def build(self, photo_ids: list[str], dog_ids: list[str | None], vecs: np.ndarray,
+              train_sample: int = 20000):
+        vecs = np.asarray(vecs, dtype=np.float32).reshape(-1, self.dim)
+        rng = np.random.default_rng(0)
+        sample = vecs if len(vecs) <= train_sample else vecs[rng.choice(len(vecs), train_sample, replace=False)]
+        self.quantizer.fit(sample)
+        self._codes, self._size = None, 0
+        self._photo_ids, self._dog_ids, self._row = [], [], {}
+        self.add(photo_ids, dog_ids, vecs)
+
+    def add(self, photo_ids: list[str], dog_ids: list[str | None], vecs: np.ndarray):
+        vecs = np.asarray(vecs, dtype=np.float32).reshape(-1, self.dim)
+        codes = np.concatenate([self.quantizer.encode(vecs[i:i + _CHUNK]) for i in range(0, len(vecs), _CHUNK)]) \
+            if len(vecs) else np.empty((0, self.quantizer.code_bytes(self.dim)), dtype=np.uint8)
+        self.add_codes(photo_ids, dog_ids, codes)
+
+    def add_codes(self, photo_ids: list[str], dog_ids: list[str | None], codes: np.ndarray):
+        self._grow(len(codes), codes.shape[1], codes.dtype)
+        for pid, did, code in zip(photo_ids, dog_ids, codes):
+            row = self._row.get(pid)
+            if row is None:
+                row = self._size
+                self._size += 1
+                self._row[pid] = row
+                self._photo_ids.append(pid)
+                self._dog_ids.append(did)
+            elif did is not None:
+                self._dog_ids[row] = did
+            self._codes[row] = code
+
+    def coarse(self, vec: np.ndarray, n: int) -> list[str]:
+        # top-n photo ids by code similarity, restricted to photos that belong to a dog
+        if self._size == 0:
+            return []
+        s = self.quantizer.scores(vec, self._codes[:self._size])
+        n = min(n, self._size)
+        top = np.argpartition(-s, n - 1)[:n] if n < self._size else np.arange(self._size)
+        top = top[np.argsort(-s[top], kind="stable")]
+        return [self._photo_ids[r] for r in top.tolist() if self._dog_ids[r] is not None]
+
+    def stats(self) -> dict:
+        per = self.quantizer.code_bytes(self.dim)
+        return {
+            "size": self._size,
+            "dim": self.dim,
+            "kind": self.quantizer.kind,
+            "pca_dim": self.quantizer.code_dim or 0,
+            "code_bytes": per,
+            "bytes": per * self._size,
+            "compression": round(self.dim * 4 / per, 1),
+        }
@@ -0,0 +1,195 @@
+import asyncio
+import hashlib
+import uuid
+from collections import deque
+from typing import AsyncIterator
+import httpx
+from PIL import Image, ImageFile
+from multipart.multipart import MultipartParser, parse_options_header
+from ..config import settings
+from .http_client import get_client
+
+# Streaming uploads: request body chunks are handed to the storage request as
+# they arrive, so memory per upload is one ASGI chunk (plus the decoded image
+# when a decoder is attached) instead of the whole file.
+
+class UploadTooLarge(ValueError):
+    pass
+
+class UploadFormatError(ValueError):
+    pass
+
+async def store_object(content: bytes | AsyncIterator[bytes], content_type: str | None) -> str:
+    # uploads to the photos bucket under a fresh name and returns the public URL
+    object_name = f"{uuid.uuid4()}.jpg"
+    url = f"{settings.supabase_url}/storage/v1/object/{settings.photos_bucket}/{object_name}"
+    headers = {
+        "Authorization": f"Bearer {settings.supabase_service_key}",
+        "Content-Type": content_type or "image/jpeg",
+        "x-upsert": "true",
+    }
+    r = await get_client().post(url, headers=headers, content=content, timeout=60)
+    r.raise_for_status()
+    return f"{settings.supabase_url}/storage/v1/object/public/{settings.photos_bucket}/{object_name}"
+
+async def delete_object(public_url: str):
+    # removes an object stored by store_object; best effort, a failure is logged
+    object_name = public_url.rsplit("/", 1)[-1]
+    url = f"{settings.supabase_url}/storage/v1/object/{settings.photos_bucket}/{object_name}"
+    try:
+        r = await get_client().delete(url, headers={"Authorization": f"Bearer {settings.supabase_service_key}"})
+        r.raise_for_status()
+    except httpx.HTTPError as e:
+        print(f"[uploads] Could not delete {object_name}: {e}")
+
+class IncrementalDecoder:
+    # PIL's incremental parser fed on a worker thread; at most one chunk is being
+    # decoded while the next one is received. State lives in this process, so it
+    # uses a plain thread rather than the CPU pool (which may be a process pool).
+    def __init__(self):
+        self._parser = ImageFile.Parser()
+        self._pending: asyncio.Future | None = None
+        self.error: Exception | None = None
+
+    async def _wait(self):
+        if self._pending is not None:
+            try:
+                await self._pending
+            except Exception as e:
+                self.error = self.error or e
+            self._pending = None
+
+    async def feed(self, chunk: bytes):
+        await self._wait()
+        if self.error is None:
+            self._pending = asyncio.ensure_future(asyncio.to_thread(self._parser.feed, chunk))
+
+    async def close(self) -> Image.Image:
+        await self._wait()
+        if self.error is not None:
+            raise UploadFormatError(f"Not a decodable image: {self.error}")
+        try:
+            img = await asyncio.to_thread(self._parser.close)
+        except Exception as e:
+            raise UploadFormatError(f"Not a decodable image: {e}")
+        return img.convert("RGB")
+
+class UploadStream:
+    # Async iterator over body chunks that keeps a running digest and size,
+    # enforces max_bytes as it goes and optionally tees chunks into a decoder.
+    # The digest matches cache.content_digest of the full body.
+    def __init__(self, chunks: AsyncIterator[bytes], max_bytes: int,
+                 decoder: IncrementalDecoder | None = None):
+        self._chunks = chunks
+        self.max_bytes = max_bytes
+        self.decoder = decoder
+        self.size = 0
+        self._hash = hashlib.blake2b(digest_size=20)
+
+    @property
+    def digest(self) -> str:
+        return self._hash.hexdigest()
+
+    async def __aiter__(self):
+        async for chunk in self._chunks:
+            if not chunk:
+                continue
+            self.size += len(chunk)
+            if self.size > self.max_bytes:
+                raise UploadTooLarge(f"Upload exceeds {self.max_bytes} bytes")
+            self._hash.update(chunk)
+            if self.decoder is not None:
+                await self.decoder.feed(chunk)
+            yield chunk
+
+async def peek(chunks: AsyncIterator[bytes]) -> tuple[bytes, AsyncIterator[bytes]]:
+    # first non-empty chunk (b"" for an empty body) and an iterator that still yields it
+    it = chunks.__aiter__()
+    first = b""
+    async for chunk in it:
+        if chunk:
+            first = chunk
+            break
+
+    async def _all():
+        if first:
+            yield first
+        async for chunk in it:
+            yield chunk
+    return first, _all()
+
+async def multipart_file(body: AsyncIterator[bytes], content_type: str,
+                         field: str = "file") -> tuple[str | None, AsyncIterator[bytes]]:
+    # Parses multipart/form-data incrementally and returns the content type of the
+    # `field` file part plus an iterator over its bytes. Parts before it are
+    # skipped; the body after it is not read.
+    _, opts = parse_options_header(content_type)
+    boundary = opts.get(b"boundary")
+    if not boundary:
+        raise UploadFormatError("Missing multipart boundary")
+    st = {"headers": {}, "name": b"", "value": b"", "target": False, "found": False,
+          "ctype": None, "done": False}
+    out: deque[bytes] = deque()
+
+    def on_part_begin():
+        st["headers"], st["target"] = {}, False
+
+    def on_header_field(data, start, end):
+        st["name"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        st["value"] += data[start:end]
+
+    def on_header_end():
+        st["headers"][st["name"].lower()] = st["value"]
+        st["name"] = st["value"] = b""
+
+    def on_headers_finished():
+        _, disp = parse_options_header(st["headers"].get(b"content-disposition", b""))
+        if not st["found"] and disp.get(b"name") == field.encode() and b"filename" in disp:
+            st["target"] = st["found"] = True
+            ct = st["headers"].get(b"content-type")
+            st["ctype"] = ct.decode("latin-1") if ct else None
+
+    def on_part_data(data, start, end):
+        if st["target"]:
+            out.append(bytes(data[start:end]))
+
+    def on_part_end():
+        if st["target"]:
+            st["target"], st["done"] = False, True
+
+    parser = MultipartParser(boundary, {
+        "on_part_begin": on_part_begin, "on_header_field": on_header_field,
+        "on_header_value": on_header_value, "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished, "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+    })
+    it = body.__aiter__()
+    async for chunk in it:
+        parser.write(chunk)
+        if st["found"]:
+            break
+    if not st["found"]:
+        raise UploadFormatError(f"No file field named '{field}'")
+
+    async def _data():
+        while True:
+            while out:
+                yield out.popleft()
+            if st["done"]:
+                return
+            try:
+                chunk = await it.__anext__()
+            except StopAsyncIteration:
+                raise UploadFormatError("Multipart body ended inside the file part")
+            parser.write(chunk)
+
+    return st["ctype"], _data()
+
+async def body_file(body: AsyncIterator[bytes], content_type: str | None,
+                    field: str = "file") -> tuple[str | None, AsyncIterator[bytes]]:
+    # multipart/form-data (file in `field`) or a raw image body
+    if content_type and content_type.lower().startswith("multipart/form-data"):
+        return await multipart_file(body, content_type, field)
+    return content_type, body
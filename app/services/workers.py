@@ -0,0 +1,134 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from multiprocessing import shared_memory
+from typing import Any, Callable
+
+import numpy as np
+from ..config import settings
+from . import metrics
+
+class PoolSaturated(RuntimeError):
+    pass
+
+class SharedArray:
+    # Descriptor handed to worker processes in place of a large buffer; the
+    # worker maps the same shared memory block instead of unpickling a copy.
+    __slots__ = ("name", "shape", "dtype")
+
+    def __init__(self, name: str, shape: tuple, dtype: str):
+        self.name = name
+        self.shape = shape
+        self.dtype = dtype
+
+    @classmethod
+    def create(cls, arr: np.ndarray) -> tuple["SharedArray", shared_memory.SharedMemory]:
+        shm = shared_memory.SharedMemory(create=True, size=max(1, arr.nbytes))
+        view = np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)
+        view[...] = arr
+        return cls(shm.name, arr.shape, arr.dtype.str), shm
+
+    def attach(self) -> tuple[np.ndarray, shared_memory.SharedMemory]:
+        shm = shared_memory.SharedMemory(name=self.name)
+        return np.ndarray(self.shape, dtype=np.dtype(self.dtype), buffer=shm.buf), shm
+
+def _call_shared(fn: Callable, args: tuple, kwargs: dict):
+    # Runs inside the worker process. Results must not alias the shared buffers.
+    opened = []
+    real = []
+    for a in args:
+        if isinstance(a, SharedArray):
+            arr, shm = a.attach()
+            opened.append(shm)
+            real.append(arr)
+        else:
+            real.append(a)
+    try:
+        return fn(*real, **kwargs)
+    finally:
+        del real
+        for shm in opened:
+            shm.close()
+
+def _share_args(args: tuple, min_bytes: int) -> tuple[tuple, list[shared_memory.SharedMemory]]:
+    out, blocks = [], []
+    for a in args:
+        if isinstance(a, (bytes, bytearray, memoryview)) and len(a) >= min_bytes:
+            a = np.frombuffer(a, dtype=np.uint8)
+        if isinstance(a, np.ndarray) and a.nbytes >= min_bytes:
+            desc, shm = SharedArray.create(a)
+            blocks.append(shm)
+            out.append(desc)
+        else:
+            out.append(a)
+    return tuple(out), blocks
+
+_pool: Executor | None = None
+_lock = threading.Lock()
+_pending = 0
+
+def init_workers():
+    global _pool
+    with _lock:
+        if _pool is not None:
+            return
+        mode = settings.cpu_pool_mode.lower().strip()
+        workers = settings.cpu_pool_workers or os.cpu_count() or 1
+        if mode == "thread":
+            _pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="cpu")
+        elif mode == "process":
+            _pool = ProcessPoolExecutor(max_workers=workers)
+        elif mode != "inline":
+            raise ValueError(f"Unknown CPU_POOL_MODE: {mode}")
+    print(f"[workers] CPU pool mode={mode} workers={workers} max_pending={settings.cpu_pool_max_pending}")
+
+def close_workers():
+    global _pool
+    with _lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+def pending() -> int:
+    return _pending
+
+def _acquire():
+    global _pending
+    with _lock:
+        if _pending >= settings.cpu_pool_max_pending:
+            raise PoolSaturated("CPU worker pool is saturated")
+        _pending += 1
+
+def _release():
+    global _pending
+    with _lock:
+        _pending -= 1
+
+async def run_cpu(fn: Callable, *args, **kwargs) -> Any:
+    if _pool is None and settings.cpu_pool_mode.lower().strip() != "inline":
+        init_workers()
+    pool = _pool
+    if pool is None:
+        return fn(*args, **kwargs)
+    _acquire()
+    try:
+        loop = asyncio.get_running_loop()
+        if isinstance(pool, ProcessPoolExecutor):
+            shared, blocks = _share_args(args, settings.cpu_pool_shm_min_bytes)
+            try:
+                return await loop.run_in_executor(pool, partial(_call_shared, fn, shared, kwargs))
+            finally:
+                for shm in blocks:
+                    shm.close()
+                    shm.unlink()
+        return await loop.run_in_executor(pool, partial(fn, *args, **kwargs))
+    finally:
+        _release()
+
+def _pool_metrics() -> list[str]:
+    return metrics.gauge("petid_cpu_pool_pending", "Jobs submitted to the CPU pool and not finished.",
+                         {"": _pending})
+
+metrics.register_collector(_pool_metrics)
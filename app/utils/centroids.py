@@ -0,0 +1,50 @@
+import numpy as np
+
+# Part centroids are stored as the un-normalized mean of their patch embeddings
+# together with n_patches, so mean * n is the running sum and can be updated in
+# O(new patches). Cosine consumers are unaffected by the missing normalization.
+
+class CentroidAccumulator:
+    def __init__(self):
+        self.sums: dict[tuple[str, str], np.ndarray] = {}
+        self.counts: dict[tuple[str, str], int] = {}
+
+    def __bool__(self) -> bool:
+        return bool(self.counts)
+
+    def add(self, dog_ids: list[str], parts: list[str | None], vecs: np.ndarray, sign: int = 1):
+        if len(dog_ids) == 0:
+            return
+        keys = [f"{d}\x00{p or 'unknown'}" for d, p in zip(dog_ids, parts)]
+        uniq, inv = np.unique(np.array(keys), return_inverse=True)
+        sums = np.zeros((len(uniq), vecs.shape[1]), dtype=np.float64)
+        np.add.at(sums, inv, vecs)
+        counts = np.bincount(inv, minlength=len(uniq))
+        for i, k in enumerate(uniq):
+            key = tuple(k.split("\x00", 1))
+            prev = self.sums.get(key)
+            self.sums[key] = sign * sums[i] if prev is None else prev + sign * sums[i]
+            self.counts[key] = self.counts.get(key, 0) + sign * int(counts[i])
+
+    def add_rows(self, rows: list[dict], sign: int = 1):
+        if rows:
+            self.add([r["dog_id"] for r in rows], [r["part"] for r in rows],
+                     np.stack([r["embedding"] for r in rows]), sign=sign)
+
+    def deltas(self) -> dict[tuple[str, str], tuple[np.ndarray, int]]:
+        return {k: (self.sums[k], self.counts[k]) for k in self.counts}
+
+    def results(self) -> list[tuple[str, str, np.ndarray, int]]:
+        return [(d, p, (self.sums[(d, p)] / n).astype(np.float32), n)
+                for (d, p), n in self.counts.items() if n > 0]
+
+def merge_centroid(existing: tuple[np.ndarray, int] | None,
+                   delta_sum: np.ndarray, delta_n: int) -> tuple[np.ndarray, int]:
+    total = delta_sum.astype(np.float64)
+    n = delta_n
+    if existing is not None and existing[1] > 0 and existing[0].shape == delta_sum.shape:
+        total = total + existing[0].astype(np.float64) * existing[1]
+        n += existing[1]
+    if n <= 0:
+        return np.zeros_like(delta_sum, dtype=np.float32), 0
+    return (total / n).astype(np.float32), n
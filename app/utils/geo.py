@@ -0,0 +1,59 @@
+import math
+import numpy as np
+
+# Same sphere as PostGIS ST_DistanceSphere, so cached distances agree with SQL ones.
+EARTH_RADIUS_KM = 6370.986
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+def geohash_encode(lat: float, lon: float, precision: int = 6) -> str:
+    lat_lo, lat_hi, lon_lo, lon_hi = -90.0, 90.0, -180.0, 180.0
+    out, bits, ch, even = [], 0, 0, True
+    while len(out) < precision:
+        if even:
+            mid = (lon_lo + lon_hi) / 2
+            ch = (ch << 1) | (lon >= mid)
+            lon_lo, lon_hi = (mid, lon_hi) if lon >= mid else (lon_lo, mid)
+        else:
+            mid = (lat_lo + lat_hi) / 2
+            ch = (ch << 1) | (lat >= mid)
+            lat_lo, lat_hi = (mid, lat_hi) if lat >= mid else (lat_lo, mid)
+        even = not even
+        bits += 1
+        if bits == 5:
+            out.append(_BASE32[ch])
+            bits = ch = 0
+    return "".join(out)
+
+def geohash_bounds(gh: str) -> tuple[float, float, float, float]:
+    lat_lo, lat_hi, lon_lo, lon_hi = -90.0, 90.0, -180.0, 180.0
+    even = True
+    for c in gh:
+        v = _BASE32.index(c)
+        for shift in range(4, -1, -1):
+            bit = (v >> shift) & 1
+            if even:
+                mid = (lon_lo + lon_hi) / 2
+                lon_lo, lon_hi = (mid, lon_hi) if bit else (lon_lo, mid)
+            else:
+                mid = (lat_lo + lat_hi) / 2
+                lat_lo, lat_hi = (mid, lat_hi) if bit else (lat_lo, mid)
+            even = not even
+    return lat_lo, lat_hi, lon_lo, lon_hi
+
+def haversine_km(lat: float, lon: float, lats, lons) -> np.ndarray:
+    p1, p2 = math.radians(lat), np.radians(np.asarray(lats, dtype=np.float64))
+    dphi = p2 - p1
+    dlmb = np.radians(np.asarray(lons, dtype=np.float64)) - math.radians(lon)
+    a = np.sin(dphi / 2) ** 2 + math.cos(p1) * np.cos(p2) * np.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+def geohash_center(gh: str) -> tuple[float, float, float]:
+    # returns (lat, lon, half-diagonal km) so a circle around the centre covers the cell
+    lat_lo, lat_hi, lon_lo, lon_hi = geohash_bounds(gh)
+    clat, clon = (lat_lo + lat_hi) / 2, (lon_lo + lon_hi) / 2
+    corners = haversine_km(clat, clon, [lat_lo, lat_lo, lat_hi, lat_hi], [lon_lo, lon_hi, lon_lo, lon_hi])
+    return clat, clon, float(corners.max())
+
+def radius_bucket(radius_km: float) -> float:
+    # next power of two (in km, down to 1/8 km) so nearly identical radii share a cache entry
+    return 2.0 ** max(-3, math.ceil(math.log2(radius_km)))
@@ -13,3 +13,6 @@ def preprocess_for_embedding(img: Image.Image, size: int = 224) -> np.ndarray:
     arr = np.transpose(arr, (2, 0, 1))
     arr = np.expand_dims(arr, 0)
     return arr
+
+def decode_for_embedding(data: bytes, size: int = 224) -> np.ndarray:
+    return preprocess_for_embedding(load_image_from_bytes(data), size=size)
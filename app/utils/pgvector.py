@@ -0,0 +1,40 @@
+import struct
+import numpy as np
+from psycopg.adapt import Dumper, Loader
+from psycopg.pq import Format
+from psycopg.types import TypeInfo
+
+# pgvector binary wire format: uint16 dim, uint16 unused, dim x float4 (big-endian)
+_HEADER = struct.Struct(">HH")
+
+class VectorBinaryDumper(Dumper):
+    format = Format.BINARY
+
+    def dump(self, obj: np.ndarray) -> bytes:
+        v = np.asarray(obj, dtype=">f4")
+        if v.ndim != 1:
+            raise ValueError(f"vector must be 1-d, got shape {v.shape}")
+        return _HEADER.pack(v.shape[0], 0) + v.tobytes()
+
+class VectorBinaryLoader(Loader):
+    format = Format.BINARY
+
+    def load(self, data) -> np.ndarray:
+        dim, _ = _HEADER.unpack_from(data)
+        return np.frombuffer(data, dtype=">f4", count=dim, offset=_HEADER.size).astype(np.float32)
+
+class VectorTextLoader(Loader):
+    format = Format.TEXT
+
+    def load(self, data) -> np.ndarray:
+        return np.fromstring(bytes(data).strip(b"[]").decode(), dtype=np.float32, sep=",")
+
+async def register_vector(conn):
+    info = await TypeInfo.fetch(conn, "vector")
+    if info is None:
+        return
+    info.register(conn)
+    dumper = type("VectorDumper", (VectorBinaryDumper,), {"oid": info.oid})
+    conn.adapters.register_dumper(np.ndarray, dumper)
+    conn.adapters.register_loader(info.oid, VectorTextLoader)
+    conn.adapters.register_loader(info.oid, VectorBinaryLoader)
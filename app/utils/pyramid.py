@@ -0,0 +1,68 @@
+import io
+import math
+import numpy as np
+from PIL import Image
+
+def _image_bytes(im: Image.Image) -> int:
+    # Pillow stores RGB with 4 bytes per pixel
+    per_px = 4 if im.mode in ("RGB", "RGBA", "RGBX") else len(im.getbands())
+    return im.width * im.height * per_px
+
+class ImagePyramid:
+    # Decodes once (JPEG draft mode when the working size allows it) into an RGB
+    # base of at most max_side pixels and at least min_side on the short edge,
+    # then hands out cached grayscale/RGB levels to the feature extractors.
+    def __init__(self, data: bytes, max_side: int = 1024, min_side: int = 256):
+        im = Image.open(io.BytesIO(data))
+        self.source_size = im.size
+        w, h = im.size
+        r = min(1.0, max(max_side / max(w, h), min_side / min(w, h)))
+        target = (max(1, math.ceil(w * r)), max(1, math.ceil(h * r)))
+        if im.format == "JPEG" and r < 1.0:
+            im.draft("RGB", target)
+        self.decoded_size = im.size
+        base = im.convert("RGB")
+        decoded_bytes = _image_bytes(base)
+        if base.size != target and r < 1.0:
+            base = base.resize(target)
+        self.rgb = base
+        self._levels: dict = {}
+        self.peak_bytes = decoded_bytes + (_image_bytes(base) if base.size != self.decoded_size else 0)
+
+    def _get(self, key, build):
+        v = self._levels.get(key)
+        if v is None:
+            v = self._levels[key] = build()
+            self.peak_bytes = max(self.peak_bytes, self.nbytes())
+        return v
+
+    def rgb_square(self, n: int) -> Image.Image:
+        return self._get(("rgb_sq", n), lambda: self.rgb.resize((n, n)))
+
+    def gray_square(self, n: int) -> np.ndarray:
+        return self._get(("gray_sq", n), lambda: np.asarray(self.rgb_square(n).convert("L"), dtype=np.float32))
+
+    def gray(self) -> np.ndarray:
+        return self._get("gray", lambda: np.asarray(self.rgb.convert("L"), dtype=np.float32))
+
+    def gray_min_side(self, s: int) -> np.ndarray:
+        def build():
+            scale = s / min(self.rgb.size)
+            size = (int(self.rgb.width * scale), int(self.rgb.height * scale))
+            return np.asarray(self.rgb.resize(size).convert("L"), dtype=np.float32)
+        return self._get(("gray_min", s), build)
+
+    def nbytes(self) -> int:
+        total = _image_bytes(self.rgb)
+        for v in self._levels.values():
+            total += v.nbytes if isinstance(v, np.ndarray) else _image_bytes(v)
+        return total
+
+    def stats(self) -> dict:
+        return {
+            "source_size": list(self.source_size),
+            "decoded_size": list(self.decoded_size),
+            "base_size": list(self.rgb.size),
+            "pyramid_bytes": self.nbytes(),
+            "peak_bytes": self.peak_bytes,
+        }
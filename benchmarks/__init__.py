@@ -0,0 +1,6 @@
+import os
+
+# Settings requires these; the suites never open a real database connection.
+os.environ.setdefault("DATABASE_URL", "postgresql://bench@localhost/bench")
+os.environ.setdefault("SUPABASE_URL", "http://localhost")
+os.environ.setdefault("SUPABASE_ANON_KEY", "bench")
@@ -0,0 +1,70 @@
+import argparse
+import json
+import os
+import sys
+
+from . import common
+
+def main(argv=None) -> int:
+    p = argparse.ArgumentParser(prog="python -m benchmarks", description="API hot-path benchmarks")
+    p.add_argument("--suite", choices=["micro", "load", "quant", "all"], default="all")
+    p.add_argument("--quick", action="store_true", help="small sizes and few requests, for smoke runs")
+    p.add_argument("--out", default="benchmarks/results/latest.json")
+    p.add_argument("--baseline", help="previous results file to compare against")
+    p.add_argument("--save-baseline", help="also write these results to this path")
+    p.add_argument("--threshold", type=float, default=0.15, help="relative slowdown flagged as a regression")
+    p.add_argument("--min-delta-ms", type=float, default=0.05, help="ignore latency changes smaller than this")
+    p.add_argument("--concurrency", default="1,4,16,64")
+    p.add_argument("--requests", type=int, default=200, help="requests per concurrency level")
+    p.add_argument("--db-latency-ms", type=float, default=5.0)
+    p.add_argument("--scenarios", default="match,analyze,embed")
+    p.add_argument("--quant-size", type=int, default=100_000, help="vectors in the quantization benchmark")
+    p.add_argument("--cache", action="store_true", help="leave the feature cache enabled for load runs")
+    args = p.parse_args(argv)
+
+    results = {}
+    if args.suite in ("micro", "all"):
+        from . import micro
+        results.update(micro.run(sizes=micro.QUICK_SIZES if args.quick else None,
+                                 repeat=3 if args.quick else 10))
+    if args.suite in ("quant", "all"):
+        from . import quant
+        results.update(quant.run(n=5000 if args.quick else args.quant_size,
+                                 queries=10 if args.quick else 50, repeat=3 if args.quick else 10))
+    if args.suite in ("load", "all"):
+        from . import load
+        conc = [int(c) for c in args.concurrency.split(",") if c]
+        results.update(load.run(concurrency=conc[:2] if args.quick else conc,
+                                requests_per_level=10 if args.quick else args.requests,
+                                db_latency_ms=args.db_latency_ms,
+                                scenarios=[s for s in args.scenarios.split(",") if s],
+                                use_cache=args.cache))
+
+    report = {"meta": {**common.meta(), "suite": args.suite, "quick": args.quick,
+                       "db_latency_ms": args.db_latency_ms},
+              "results": results}
+    for path in filter(None, [args.out, args.save_baseline]):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    for name, r in sorted(results.items()):
+        extra = f"  {r['throughput_rps']:.1f} rps" if "throughput_rps" in r else ""
+        if "recall_at_k" in r:
+            extra += f"  recall {r['recall_at_k']:.3f}  {r['index_bytes'] / 2**20:.1f} MiB"
+        print(f"{name:60s} p50 {r['median_ms']:9.3f} ms  p95 {r['p95_ms']:9.3f} ms{extra}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        diffs = common.compare(report, baseline, args.threshold, min_delta_ms=args.min_delta_ms)
+        bad = [d for d in diffs if d["regression"]]
+        for d in bad:
+            print(f"REGRESSION {d['benchmark']} {d['metric']}: {d['baseline']:.3f} -> {d['current']:.3f} "
+                  f"({d['change']:+.1%})")
+        print(f"compared {len(diffs)} metrics against {args.baseline}: {len(bad)} regressions")
+        return 1 if bad else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,89 @@
+import io
+import platform
+import subprocess
+import time
+from typing import Callable
+
+import numpy as np
+from PIL import Image
+
+# Metrics ending in these suffixes get worse when they grow; everything else
+# that is compared (throughput) gets worse when it shrinks.
+_LOWER_IS_BETTER = ("_ms", "_bytes")
+
+def summarize(samples_s: list[float]) -> dict:
+    a = np.asarray(samples_s, dtype=np.float64) * 1e3
+    return {
+        "n": int(a.size),
+        "min_ms": float(a.min()),
+        "median_ms": float(np.median(a)),
+        "mean_ms": float(a.mean()),
+        "p95_ms": float(np.percentile(a, 95)),
+        "p99_ms": float(np.percentile(a, 99)),
+    }
+
+def time_call(fn: Callable, *, repeat: int = 20, warmup: int = 2, min_time_s: float = 0.0) -> dict:
+    for _ in range(warmup):
+        fn()
+    samples = []
+    t_end = time.perf_counter() + min_time_s
+    while len(samples) < repeat or time.perf_counter() < t_end:
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+    return summarize(samples)
+
+def photo_like(w: int, h: int, seed: int = 0) -> Image.Image:
+    # smooth gradients plus blobs and noise, closer to a photo than flat colour or pure noise
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:h, 0:w].astype(np.float32)
+    img = np.stack([x / w * 200, y / h * 180, (x + y) / (w + h) * 160], axis=-1)
+    for _ in range(6):
+        cx, cy, r = rng.uniform(0, w), rng.uniform(0, h), rng.uniform(0.05, 0.3) * min(w, h)
+        mask = ((x - cx) ** 2 + (y - cy) ** 2) < r * r
+        img[mask] = rng.uniform(0, 255, 3)
+    img += rng.normal(0, 8, img.shape)
+    return Image.fromarray(np.clip(img, 0, 255).astype(np.uint8))
+
+def jpeg_bytes(img: Image.Image, quality: int = 90) -> bytes:
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=quality)
+    return buf.getvalue()
+
+def meta() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "processor": platform.processor() or None,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+def compare(current: dict, baseline: dict, threshold: float = 0.15,
+            metrics: tuple[str, ...] = ("median_ms", "p95_ms", "throughput_rps"),
+            min_delta_ms: float = 0.05) -> list[dict]:
+    # Returns one entry per (benchmark, metric) present in both runs, flagged when
+    # it moved the wrong way by more than `threshold` (relative). Latency changes
+    # below `min_delta_ms` are timer noise and never flagged.
+    out = []
+    for name, cur in current.get("results", {}).items():
+        base = baseline.get("results", {}).get(name)
+        if base is None:
+            continue
+        for m in metrics:
+            if m not in cur or m not in base or not base[m]:
+                continue
+            change = (cur[m] - base[m]) / base[m]
+            if m.endswith(_LOWER_IS_BETTER):
+                regression = change > threshold and (not m.endswith("_ms") or cur[m] - base[m] > min_delta_ms)
+            else:
+                regression = -change > threshold
+            out.append({"benchmark": name, "metric": m, "baseline": base[m], "current": cur[m],
+                        "change": change, "regression": regression})
+    return out
@@ -0,0 +1,123 @@
+import asyncio
+import itertools
+import time
+from contextlib import asynccontextmanager
+
+import httpx
+
+from app import db as dbmod
+from app.config import settings
+from app.main import app
+from app.routers import analyze, match
+from app.services import cache, embedding, http_client, workers
+from .common import jpeg_bytes, photo_like, summarize
+
+# End-to-end scenarios driven through the ASGI app in-process. The database and
+# photo storage are replaced by coroutines that only sleep for the configured
+# latency, so results cover routing, decoding, feature extraction, batching and
+# the worker pool.
+
+def _install_fake_db(latency_ms: float):
+    delay = latency_ms / 1000.0
+
+    async def _rpc_store_photo_embedding(photo_id, vec):
+        await asyncio.sleep(delay)
+    async def _rpc_match_dogs(vec, lat, lon, k=5):
+        await asyncio.sleep(delay)
+        return [{"dog_id": f"00000000-0000-0000-0000-{i:012d}", "final_score": 1.0 - i / 10} for i in range(k)]
+    async def _api_save_photo_analysis(photo_id, phash_bytes, lab_hist, lbp_hist, attributes_json, patches):
+        await asyncio.sleep(delay)
+        return len(patches), {"dog_id": None, "lat": None, "lon": None}
+
+    @asynccontextmanager
+    async def _no_connection():
+        yield None
+
+    fakes = {
+        "rpc_store_photo_embedding": _rpc_store_photo_embedding,
+        "rpc_match_dogs": _rpc_match_dogs,
+        "api_save_photo_analysis": _api_save_photo_analysis,
+    }
+    # routers open connection scopes around their DB calls; with no pool those are no-ops
+    router_fakes = {"session": _no_connection, "pipeline": _no_connection}
+    saved = []
+    patches = [(mod, fakes) for mod in (dbmod, match, analyze)] + [(mod, router_fakes) for mod in (match, analyze)]
+    for mod, table in patches:
+        for name, fn in table.items():
+            if hasattr(mod, name):
+                saved.append((mod, name, getattr(mod, name)))
+                setattr(mod, name, fn)
+    return saved
+
+def _install_fake_storage(images: list[bytes], latency_ms: float):
+    # photo_url fetches are answered from memory after the same simulated latency
+    async def _handler(req: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(latency_ms / 1000.0)
+        return httpx.Response(200, content=images[int(req.url.path.rsplit("/", 1)[-1])])
+    saved = http_client._client
+    http_client._client = httpx.AsyncClient(transport=httpx.MockTransport(_handler))
+    return saved
+
+def _scenarios(images: list[bytes]):
+    cyc = itertools.count()
+
+    def _match(client):
+        i = next(cyc) % len(images)
+        return client.post("/v1/match", params={"photo_url": f"http://storage.bench/{i}", "k": 5})
+    def _analyze(client):
+        i = next(cyc) % len(images)
+        return client.post("/v1/analyze", params={"photo_id": f"p{i}"},
+                           files={"file": ("a.jpg", images[i], "image/jpeg")})
+    def _embed(client):
+        i = next(cyc) % len(images)
+        return client.post("/v1/embed", params={"photo_id": f"p{i}"},
+                           files={"file": ("a.jpg", images[i], "image/jpeg")})
+    return {"match": _match, "analyze": _analyze, "embed": _embed}
+
+async def _sweep(request, concurrency: int, total: int) -> dict:
+    transport = httpx.ASGITransport(app=app)
+    latencies, errors = [], 0
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+        remaining = itertools.count()
+
+        async def _worker():
+            nonlocal errors
+            while next(remaining) < total:
+                t0 = time.perf_counter()
+                r = await request(client)
+                latencies.append(time.perf_counter() - t0)
+                if r.status_code != 200:
+                    errors += 1
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(_worker() for _ in range(concurrency)))
+        wall = time.perf_counter() - t0
+    out = summarize(latencies)
+    out.update({"concurrency": concurrency, "errors": errors, "throughput_rps": len(latencies) / wall})
+    return out
+
+def run(concurrency=(1, 4, 16, 64), requests_per_level: int = 200, db_latency_ms: float = 5.0,
+        image_size=(640, 480), scenarios=("match", "analyze", "embed"), use_cache: bool = False) -> dict:
+    saved_cache = settings.cache_max_bytes, cache.features
+    if not use_cache:
+        # every request should pay for its features, not hit the content cache
+        settings.cache_max_bytes, cache.features = 0, None
+    saved_db = _install_fake_db(db_latency_ms)
+    if embedding.batcher is None:
+        embedding.init_embedder()
+    workers.init_workers()
+    images = [jpeg_bytes(photo_like(*image_size, seed=s)) for s in range(32)]
+    saved_http = _install_fake_storage(images, db_latency_ms)
+    table = _scenarios(images)
+    results = {}
+    try:
+        for name in scenarios:
+            for c in concurrency:
+                n = max(requests_per_level, 2 * c)
+                results[f"load.{name}.c{c}"] = asyncio.run(_sweep(table[name], c, n))
+    finally:
+        for mod, attr, fn in saved_db:
+            setattr(mod, attr, fn)
+        settings.cache_max_bytes, cache.features = saved_cache
+        http_client._client = saved_http
+    return results
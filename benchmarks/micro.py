@@ -0,0 +1,44 @@
+import numpy as np
+
+from app.config import settings
+from app.services import embedding
+from app.services.markings import (
+    extract_markings, lab_histogram, lab_histogram_lut, lbp_histogram, lbp_histogram_tiled,
+    phash64, pick_distinctive_patches,
+)
+from app.utils.images import preprocess_for_embedding
+from .common import jpeg_bytes, photo_like, time_call
+
+SIZES = [(256, 256), (640, 480), (1024, 768), (2048, 1536)]
+QUICK_SIZES = [(256, 256), (640, 480)]
+
+def run(sizes=None, repeat: int = 10, batch_sizes=(1, 8, 16)) -> dict:
+    results = {}
+    for w, h in sizes or SIZES:
+        img = photo_like(w, h, seed=w)
+        rgb = np.asarray(img)
+        gray = np.asarray(img.convert("L"), dtype=np.float32)
+        data = jpeg_bytes(img)
+        tag = f"{w}x{h}"
+        cases = {
+            "phash64": lambda: phash64(img),
+            "lab_histogram": lambda: lab_histogram(img),
+            "lab_histogram_lut": lambda: lab_histogram_lut(rgb),
+            "lbp_histogram": lambda: lbp_histogram(gray),
+            "lbp_histogram_tiled": lambda: lbp_histogram_tiled(gray),
+            "pick_distinctive_patches": lambda: pick_distinctive_patches(img),
+            "preprocess_for_embedding": lambda: preprocess_for_embedding(img),
+            "extract_markings": lambda: extract_markings(data),
+        }
+        for name, fn in cases.items():
+            results[f"micro.{name}.{tag}"] = time_call(fn, repeat=repeat)
+
+    if embedding.embedder is None:
+        embedding.init_embedder()
+    tensor = preprocess_for_embedding(photo_like(224, 224))
+    for b in batch_sizes:
+        batch = np.repeat(tensor, b, axis=0)
+        r = time_call(lambda: embedding.embedder.embed_batch(batch), repeat=repeat)
+        r["per_image_ms"] = r["median_ms"] / b
+        results[f"micro.embed_batch.{settings.embedder_backend}.b{b}"] = r
+    return results
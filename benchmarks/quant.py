@@ -0,0 +1,53 @@
+import time
+
+import numpy as np
+
+from app.services.quantize import QuantizedIndex
+from .common import time_call
+
+# Coarse/rerank trade-off on synthetic clustered embeddings: for each code type,
+# the coarse scan and the float rerank of its shortlist are timed, and recall@k
+# of the reranked top-k is measured against an exact float scan.
+
+CONFIGS = [("int8", 0), ("binary", 0), ("int8", 128), ("binary", 128)]
+
+def _dataset(n: int, dim: int, n_clusters: int = 500, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(n_clusters, dim)).astype(np.float32)
+    x = centers[rng.integers(0, n_clusters, n)] + 0.6 * rng.normal(size=(n, dim)).astype(np.float32)
+    return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+def _topk(scores: np.ndarray, k: int) -> np.ndarray:
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+def run(n: int = 100_000, dim: int = 512, queries: int = 50, k: int = 10,
+        candidates: int = 200, repeat: int = 5, configs=None) -> dict:
+    x = _dataset(n, dim)
+    rng = np.random.default_rng(1)
+    qs = x[rng.choice(n, queries, replace=False)] + 0.05 * rng.normal(size=(queries, dim)).astype(np.float32)
+    truth = [set(_topk(x @ q, k).tolist()) for q in qs]
+    ids = [str(i) for i in range(n)]
+    results = {}
+
+    r = time_call(lambda: _topk(x @ qs[0], k), repeat=repeat)
+    r.update(recall_at_k=1.0, index_bytes=int(x.nbytes))
+    results[f"quant.float32.exact.n{n}"] = r
+
+    for kind, pca in configs or CONFIGS:
+        idx = QuantizedIndex(dim, kind, pca)
+        t0 = time.perf_counter()
+        idx.build(ids, ids, x)
+        build_s = time.perf_counter() - t0
+
+        def two_stage(q):
+            rows = np.array([int(p) for p in idx.coarse(q, candidates)])
+            return rows[_topk(x[rows] @ q, k)]
+
+        hits = sum(len(truth[i] & set(two_stage(q).tolist())) for i, q in enumerate(qs))
+        coarse = time_call(lambda: idx.coarse(qs[0], candidates), repeat=repeat)
+        r = time_call(lambda: two_stage(qs[0]), repeat=repeat)
+        r.update(recall_at_k=hits / (k * queries), coarse_median_ms=coarse["median_ms"],
+                 index_bytes=idx.stats()["bytes"], build_s=build_s)
+        results[f"quant.{kind}{f'.pca{pca}' if pca else ''}.two_stage.n{n}"] = r
+    return results
@@ -0,0 +1,65 @@
+-- Latest geotagged sighting per dog, kept current by a trigger on public.photos.
+-- /v1/dogs/nearby (NEARBY_MODE=latest) reads this table through its GiST index.
+
+create table if not exists public.dog_last_seen (
+  dog_id   uuid primary key references public.dogs(id) on delete cascade,
+  photo_id uuid not null,
+  taken_at timestamptz,
+  geog     geography(Point, 4326) not null
+);
+
+create index if not exists dog_last_seen_geog_idx on public.dog_last_seen using gist (geog);
+create index if not exists photos_dog_taken_at_idx on public.photos (dog_id, taken_at desc);
+
+create or replace function public.refresh_dog_last_seen(p_dog uuid) returns void
+language plpgsql as $$
+declare
+  r record;
+begin
+  if p_dog is null then
+    return;
+  end if;
+  select id, taken_at, geom::geography as geog into r
+  from public.photos
+  where dog_id = p_dog and geom is not null
+  order by taken_at desc nulls last
+  limit 1;
+  if not found then
+    delete from public.dog_last_seen where dog_id = p_dog;
+    return;
+  end if;
+  insert into public.dog_last_seen (dog_id, photo_id, taken_at, geog)
+  values (p_dog, r.id, r.taken_at, r.geog)
+  on conflict (dog_id) do update
+    set photo_id = excluded.photo_id, taken_at = excluded.taken_at, geog = excluded.geog;
+end;
+$$;
+
+create or replace function public.photos_dog_last_seen_trg() returns trigger
+language plpgsql as $$
+begin
+  if tg_op = 'DELETE' then
+    perform public.refresh_dog_last_seen(old.dog_id);
+    return null;
+  end if;
+  if tg_op = 'UPDATE' and old.dog_id is distinct from new.dog_id then
+    perform public.refresh_dog_last_seen(old.dog_id);
+  end if;
+  perform public.refresh_dog_last_seen(new.dog_id);
+  return null;
+end;
+$$;
+
+drop trigger if exists photos_dog_last_seen on public.photos;
+create trigger photos_dog_last_seen
+after insert or delete or update of dog_id, geom, taken_at on public.photos
+for each row execute function public.photos_dog_last_seen_trg();
+
+-- backfill
+insert into public.dog_last_seen (dog_id, photo_id, taken_at, geog)
+select distinct on (dog_id) dog_id, id, taken_at, geom::geography
+from public.photos
+where dog_id is not null and geom is not null
+order by dog_id, taken_at desc nulls last
+on conflict (dog_id) do update
+  set photo_id = excluded.photo_id, taken_at = excluded.taken_at, geog = excluded.geog;
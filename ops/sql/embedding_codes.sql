@@ -0,0 +1,15 @@
+-- Binary sign codes stored next to the float embedding (QUANT_STORE_CODES=true).
+-- MATCH_MODE=two_stage with QUANT_KIND=binary and no PCA loads these instead of the
+-- float vectors (64 bytes instead of 2 KB per photo); the exact rerank still reads
+-- public.photos.embedding. Requires pgvector >= 0.7 for bit distance and
+-- binary_quantize(); adjust 512 if EMBED_VECTOR_SIZE differs.
+
+alter table public.photos add column if not exists embedding_bin bit(512);
+
+update public.photos
+set embedding_bin = binary_quantize(embedding)::bit(512)
+where embedding is not null and embedding_bin is null;
+
+-- Hamming-distance index for SQL-side coarse search (order by embedding_bin <~> ...).
+create index if not exists photos_embedding_bin_idx
+  on public.photos using hnsw (embedding_bin bit_hamming_ops);
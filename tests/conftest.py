@@ -1,8 +1,12 @@
 import pytest
+from contextlib import asynccontextmanager
 from fastapi.testclient import TestClient
 from app.main import app
 from app.services.embedding import init_embedder
 from app import db as dbmod
+from app.routers import analyze, centroids, dogs, match, notify, photos
+
+ROUTER_MODULES = [analyze, centroids, dogs, match, notify, photos]
 
 @pytest.fixture(autouse=True, scope="session")
 def init_embedder_once():
@@ -26,17 +30,114 @@ def patch_db(monkeypatch):
         return chosen_dog_id or "11111111-1111-1111-1111-111111111111"
     async def _api_upsert_photo_analysis(photo_id, phash_bytes, lab_hist, lbp_hist, attributes_json): return None
     async def _api_insert_photo_patch(photo_id, part, bbox, embedding_vec, score): return None
+    async def _api_save_photo_analysis(photo_id, phash_bytes, lab_hist, lbp_hist, attributes_json, patches):
+        return len(patches), {"dog_id": None, "lat": None, "lon": None}
     async def _api_upsert_dog_part_centroid(dog_id, part, centroid_vec, n_patches): return None
+    async def _api_upsert_dog_part_centroids(rows): return None
+    async def _fetch_photo_dog_ids(photo_ids): return {p: None for p in photo_ids}
+    @asynccontextmanager
+    async def _no_connection():
+        yield None
+
+    fakes = {
+        "init_db": _noop_init_db,
+        "close_db": _noop_close_db,
+        "exec_sql": _noop_exec_sql,
+        "rpc_store_photo_embedding": _rpc_store_photo_embedding,
+        "rpc_match_dogs": _rpc_match_dogs,
+        "rpc_confirm_match": _rpc_confirm_match,
+        "api_upsert_photo_analysis": _api_upsert_photo_analysis,
+        "api_insert_photo_patch": _api_insert_photo_patch,
+        "api_save_photo_analysis": _api_save_photo_analysis,
+        "api_upsert_dog_part_centroid": _api_upsert_dog_part_centroid,
+        "api_upsert_dog_part_centroids": _api_upsert_dog_part_centroids,
+        "fetch_photo_dog_ids": _fetch_photo_dog_ids,
+    }
+    # without a pool the routers' connection scopes become no-ops; db itself keeps the real ones
+    router_fakes = {"session": _no_connection, "pipeline": _no_connection}
+    # routers bind these names at import time, so patch them there as well
+    for mod in [dbmod, *ROUTER_MODULES]:
+        for name, fn in fakes.items():
+            if hasattr(mod, name):
+                monkeypatch.setattr(mod, name, fn)
+    for mod in ROUTER_MODULES:
+        for name, fn in router_fakes.items():
+            if hasattr(mod, name):
+                monkeypatch.setattr(mod, name, fn)
+
+class FakePool:
+    # Stands in for the psycopg pool. Checkouts and connection scopes are logged
+    # as "checkout", "pipeline" and "transaction"; statements as
+    # (method, sql, params, cursor_name). rows(sql, params, cursor_name) gives the
+    # canned result of each execute, read back through fetchone/fetchall/fetchmany.
+    def __init__(self, rows=None):
+        self.rows = rows or (lambda sql, params, name: [])
+        self.log = []
+
+    @property
+    def scopes(self) -> list[str]:
+        return [e for e in self.log if isinstance(e, str)]
+
+    @property
+    def statements(self) -> list[tuple]:
+        return [e for e in self.log if not isinstance(e, str)]
+
+    @asynccontextmanager
+    async def connection(self):
+        self.log.append("checkout")
+        yield _FakeConn(self)
+
+class _FakeConn:
+    def __init__(self, pool):
+        self.pool = pool
+
+    @asynccontextmanager
+    async def cursor(self, name=None, row_factory=None):
+        yield _FakeCursor(self.pool, name)
+
+    @asynccontextmanager
+    async def pipeline(self):
+        self.pool.log.append("pipeline")
+        yield
 
-    monkeypatch.setattr(dbmod, "init_db", _noop_init_db)
-    monkeypatch.setattr(dbmod, "close_db", _noop_close_db)
-    monkeypatch.setattr(dbmod, "exec_sql", _noop_exec_sql)
-    monkeypatch.setattr(dbmod, "rpc_store_photo_embedding", _rpc_store_photo_embedding)
-    monkeypatch.setattr(dbmod, "rpc_match_dogs", _rpc_match_dogs)
-    monkeypatch.setattr(dbmod, "rpc_confirm_match", _rpc_confirm_match)
-    monkeypatch.setattr(dbmod, "api_upsert_photo_analysis", _api_upsert_photo_analysis)
-    monkeypatch.setattr(dbmod, "api_insert_photo_patch", _api_insert_photo_patch)
-    monkeypatch.setattr(dbmod, "api_upsert_dog_part_centroid", _api_upsert_dog_part_centroid)
+    @asynccontextmanager
+    async def transaction(self):
+        self.pool.log.append("transaction")
+        yield
+
+class _FakeCursor:
+    def __init__(self, pool, name):
+        self.pool, self.name, self._rows = pool, name, []
+        self.kwargs = {}
+
+    async def execute(self, sql, params=None, **kwargs):
+        self.pool.log.append(("execute", sql, params, self.name))
+        self.kwargs = kwargs
+        self._rows = list(self.pool.rows(sql, params, self.name))
+
+    async def executemany(self, sql, rows):
+        self.pool.log.append(("executemany", sql, list(rows), self.name))
+
+    async def fetchone(self):
+        return self._rows[0] if self._rows else None
+
+    async def fetchall(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+    async def fetchmany(self, n):
+        rows, self._rows = self._rows[:n], self._rows[n:]
+        return rows
+
+@pytest.fixture()
+def fake_pool(monkeypatch):
+    # installs a FakePool as the db pool: fake_pool(rows) -> FakePool
+    def _install(rows=None) -> FakePool:
+        pool = FakePool(rows)
+        monkeypatch.setattr(dbmod, "_pool", pool)
+        monkeypatch.setattr(dbmod, "_centroid_listeners", [])
+        return pool
+    return _install
 
 @pytest.fixture()
 def client():
@@ -5,19 +5,110 @@ def test_analyze_with_url(client, monkeypatch):
     Image.new("RGB", (64,64), color=(128,80,40)).save(buf, format="JPEG")
     img_bytes = buf.getvalue()
 
-    class Resp:
-        def __init__(self, content): self.content = content
-        def raise_for_status(self): return None
-    class FakeAsyncClient:
-        async def __aenter__(self): return self
-        async def __aexit__(self, exc_type, exc, tb): return False
-        async def get(self, url): return Resp(img_bytes)
-
     import httpx
-    monkeypatch.setattr(httpx, "AsyncClient", lambda timeout=30: FakeAsyncClient())
+    from app.services import http_client
+    transport = httpx.MockTransport(lambda req: httpx.Response(200, content=img_bytes))
+    monkeypatch.setattr(http_client, "_client", httpx.AsyncClient(transport=transport))
 
     r = client.post("/v1/analyze", params={"photo_id":"11111111-1111-1111-1111-111111111111","url":"https://example.com/a.jpg"})
     assert r.status_code == 200
     js = r.json()
     assert js["photo_id"]
     assert js["patches_saved"] >= 0
+
+def test_analyze_rejects_oversized_url(client, monkeypatch):
+    import httpx
+    from app.config import settings
+    from app.services import http_client
+    transport = httpx.MockTransport(lambda req: httpx.Response(200, content=b"x" * 5000))
+    monkeypatch.setattr(http_client, "_client", httpx.AsyncClient(transport=transport))
+    monkeypatch.setattr(settings, "fetch_max_bytes", 1024)
+
+    r = client.post("/v1/analyze", params={"photo_id":"11111111-1111-1111-1111-111111111111","url":"https://example.com/big.jpg"})
+    assert r.status_code == 413
+
+def test_host_slots_are_released_after_fetch(monkeypatch):
+    import asyncio
+    import httpx
+    from app.config import settings
+    from app.services import http_client
+
+    monkeypatch.setattr(settings, "fetch_per_host_concurrency", 1)
+    active = []
+    async def _handler(req):
+        active.append(len(http_client._host_slots))
+        await asyncio.sleep(0.01)
+        return httpx.Response(200, content=b"img")
+    async def run():
+        monkeypatch.setattr(http_client, "_client", httpx.AsyncClient(transport=httpx.MockTransport(_handler)))
+        urls = [f"https://h{i % 3}.example.com/a.jpg" for i in range(9)]
+        return await asyncio.gather(*(http_client.fetch_bytes(u) for u in urls))
+    assert asyncio.run(run()) == [b"img"] * 9
+    assert max(active) == 3 and http_client._host_slots == {}
+
+def test_url_fetch_does_not_follow_redirects():
+    # photo_url is user supplied; a redirect must not bounce the fetch to another host
+    from app.services import http_client
+    assert http_client._make_client().follow_redirects is False
+
+def test_ingest_stores_then_processes_in_background(monkeypatch):
+    import io, time
+    import httpx
+    from PIL import Image
+    from fastapi import HTTPException
+    from fastapi.testclient import TestClient
+    from app import main
+    from app.config import settings
+    from app.routers import analyze as A
+    from app.services import http_client, jobs
+
+    async def _noop(): return None
+    monkeypatch.setattr(main, "init_db", _noop)
+    monkeypatch.setattr(main, "close_db", _noop)
+    monkeypatch.setattr(settings, "dedup_enabled", False)
+    monkeypatch.setattr(settings, "ingest_queue_max", 1)
+    monkeypatch.setattr(jobs, "queue", None)
+    stored, saved = [], []
+    async def _store(photo_id, vec): stored.append((photo_id, len(vec)))
+    async def _save(photo_id, phash, lab, lbp, attributes_json, patches):
+        saved.append(photo_id)
+        return len(patches), {"dog_id": None, "lat": None, "lon": None}
+    monkeypatch.setattr(A, "rpc_store_photo_embedding", _store)
+    monkeypatch.setattr(A, "api_save_photo_analysis", _save)
+
+    buf = io.BytesIO()
+    Image.new("RGB", (300, 200), color=(128, 80, 40)).save(buf, format="JPEG")
+    uploads = []
+    async def _fail_store(data, content_type):
+        raise HTTPException(502, "storage down")
+    def _storage(req):
+        uploads.append(len(req.content))
+        return httpx.Response(200, json={})
+
+    with TestClient(main.app) as c:
+        monkeypatch.setattr(http_client, "_client", httpx.AsyncClient(transport=httpx.MockTransport(_storage)))
+        r = c.post("/v1/ingest", params={"photo_id": "p1"}, files={"file": ("a.jpg", buf.getvalue(), "image/jpeg")})
+        assert r.status_code == 202, r.text
+        assert uploads == [len(buf.getvalue())] and r.json()["url"].endswith(".jpg")
+        job_id = r.json()["job_id"]
+        for _ in range(200):
+            job = c.get(f"/v1/ingest/{job_id}").json()
+            if job["status"] in ("done", "failed"):
+                break
+            time.sleep(0.01)
+        assert job["status"] == "done", job
+        assert job["result"]["embedding_dim"] == 512 and len(job["result"]["phash"]) == 16
+        assert stored == [("p1", 512)] and saved == ["p1"]
+        assert c.get("/v1/ingest/nope").status_code == 404
+
+        # a full queue refuses new work before anything is stored
+        jobs.queue.reserve()
+        r = c.post("/v1/ingest", params={"photo_id": "p2"}, files={"file": ("a.jpg", buf.getvalue(), "image/jpeg")})
+        assert r.status_code == 503 and len(uploads) == 1
+        jobs.queue.release()
+
+        # a failed store gives its slot back
+        monkeypatch.setattr(A, "store_object", _fail_store)
+        assert c.post("/v1/ingest", params={"photo_id": "p3"},
+                      files={"file": ("a.jpg", buf.getvalue(), "image/jpeg")}).status_code == 502
+        assert jobs.queue.pending() == 0
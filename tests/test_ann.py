@@ -0,0 +1,167 @@
+def _clustered(n_dogs=60, per_dog=5, dim=32, seed=1):
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(n_dogs, dim))
+    vecs, photo_ids, dog_ids = [], [], []
+    for d in range(n_dogs):
+        for j in range(per_dog):
+            vecs.append(centers[d] + 0.1 * rng.normal(size=dim))
+            photo_ids.append(f"p{d}-{j}")
+            dog_ids.append(f"d{d}")
+    return photo_ids, dog_ids, np.array(vecs, dtype=np.float32)
+
+def test_ivf_index_recall_and_incremental_add():
+    import numpy as np
+    from app.services.ann import IvfIndex
+
+    photo_ids, dog_ids, vecs = _clustered()
+    idx = IvfIndex(32, nlist=16, nprobe=4)
+    idx.build(photo_ids, dog_ids, vecs)
+    assert idx.trained and len(idx) == 300
+    assert idx.recall_at_k(k=1, samples=50) == 1.0
+    idx.nprobe = idx.nlist
+    assert idx.recall_at_k(k=5, samples=50) == 1.0
+
+    new = vecs[0] + 0.01
+    idx.add(["fresh"], ["d-new"], new[None, :])
+    assert len(idx) == 301
+    assert idx.search(new, 1)[0][0] in {"d-new", "d0"}
+    idx.add(["fresh"], [None], -new[None, :])
+    assert len(idx) == 301
+    assert idx.search(-new, 1)[0][0] == "d-new"
+
+def test_ivf_index_trains_when_it_grows_and_moves_rows_in_place():
+    import numpy as np
+    from app.services.ann import IvfIndex
+
+    photo_ids, dog_ids, vecs = _clustered()
+    idx = IvfIndex(32, nlist=16, nprobe=16)
+    idx.build(photo_ids[:5], dog_ids[:5], vecs[:5])
+    assert not idx.trained
+    for i in range(5, 300, 7):
+        idx.add(photo_ids[i:i+7], dog_ids[i:i+7], vecs[i:i+7])
+    assert idx.trained and len(idx) == 300 and sum(len(l) for l in idx._lists) == 300
+    assert idx.recall_at_k(k=5, samples=50) == 1.0
+
+    # re-embedding photos moves them between lists without leaving stale slots
+    rng = np.random.default_rng(2)
+    for i in rng.choice(300, 120, replace=False):
+        idx.add([photo_ids[i]], [None], rng.normal(size=(1, 32)).astype(np.float32))
+    for lst, rows in enumerate(idx._lists):
+        assert all(idx._assign[r] == lst and idx._pos[r] == p for p, r in enumerate(rows))
+    assert sorted(r for l in idx._lists for r in l) == list(range(300))
+
+def test_embed_indexes_only_stored_vectors(client, monkeypatch):
+    import io
+    import pytest
+    from PIL import Image
+    from app.services import ann, cache
+    from app.services.ann import IvfIndex
+    from app.services.cache import LruCache
+    from app.routers import match as M
+
+    idx = IvfIndex(512, nlist=8)
+    monkeypatch.setattr(ann, "index", idx)
+    lookups = []
+    async def _owners(ids):
+        lookups.append(ids)
+        return {i: "d1" for i in ids}
+    monkeypatch.setattr(M, "fetch_photo_dog_ids", _owners)
+    async def _store_fails(photo_id, vec): raise RuntimeError("db down")
+    monkeypatch.setattr(M, "rpc_store_photo_embedding", _store_fails)
+
+    buf = io.BytesIO()
+    Image.new("RGB", (32, 32), color=(10, 20, 30)).save(buf, format="JPEG")
+    files = {"file": ("a.jpg", buf.getvalue(), "image/jpeg")}
+    with pytest.raises(RuntimeError):
+        client.post("/v1/embed", params={"photo_id": "p1"}, files=files)
+    assert len(idx) == 0
+
+    # one owner lookup per request feeds both the index and the dog cache
+    async def _store(photo_id, vec): return None
+    monkeypatch.setattr(M, "rpc_store_photo_embedding", _store)
+    dogs = LruCache(1 << 20, 60)
+    dogs.put("dog:d1", {"id": "d1"})
+    monkeypatch.setattr(cache, "dogs", dogs)
+    assert client.post("/v1/embed", params={"photo_id": "p1"}, files=files).status_code == 200
+    assert len(idx) == 1 and lookups == [["p1"], ["p1"]] and len(dogs) == 0
+
+def test_match_uses_index_candidates(client, monkeypatch):
+    import base64, io
+    from PIL import Image
+    from app.services import ann
+    from app.services.ann import IvfIndex
+    from app.routers import match as M
+
+    photo_ids, dog_ids, vecs = _clustered(dim=512)
+    idx = IvfIndex(512, nlist=8, nprobe=8)
+    idx.build(photo_ids, dog_ids, vecs)
+    monkeypatch.setattr(ann, "index", idx)
+
+    seen = {}
+    async def _cands(cands, lat, lon, k=5):
+        seen["ids"] = [d for d, _ in cands]
+        return [{"dog_id": d, "visual": v} for d, v in cands[:k]]
+    monkeypatch.setattr(M, "rpc_match_dog_candidates", _cands)
+
+    buf = io.BytesIO()
+    Image.new("RGB", (32, 32), color=(10, 20, 30)).save(buf, format="JPEG")
+    b64 = base64.b64encode(buf.getvalue()).decode()
+    r = client.post("/v1/match", params={"photo_bytes_b64": b64, "k": 3})
+    assert r.status_code == 200
+    assert len(r.json()["candidates"]) == 3
+    assert 0 < len(seen["ids"]) <= 60
+
+    r = client.get("/v1/match/index", params={"recall_k": 5, "samples": 20})
+    assert r.json()["loaded"] and r.json()["size"] == 300
+
+def test_quantized_index_shortlist_contains_exact_neighbours():
+    import numpy as np
+    from app.services.quantize import QuantizedIndex, sign_bits
+
+    photo_ids, dog_ids, vecs = _clustered(dim=64)
+    vecs /= np.linalg.norm(vecs, axis=1, keepdims=True)
+    for kind, pca in (("int8", 0), ("binary", 0), ("int8", 16), ("binary", 32)):
+        idx = QuantizedIndex(64, kind, pca)
+        idx.build(photo_ids, dog_ids, vecs)
+        assert len(idx) == 300 and idx.stats()["compression"] >= 4
+        for r in range(0, 300, 37):
+            exact = {photo_ids[i] for i in np.argsort(-(vecs @ vecs[r]))[:5]}
+            assert exact <= set(idx.coarse(vecs[r], 20)), (kind, pca)
+
+    # stored sign codes load without refitting and rank the same way
+    idx = QuantizedIndex(64, "binary")
+    idx.add_codes(photo_ids, dog_ids, sign_bits(vecs))
+    idx.add(["orphan"], [None], vecs[:1])
+    assert idx.coarse(vecs[0], 2)[0] == "p0-0"
+    assert "orphan" not in idx.coarse(vecs[0], 301)
+
+def test_match_two_stage_reranks_shortlist(client, monkeypatch):
+    import base64, io
+    from PIL import Image
+    from app.config import settings
+    from app.services import ann
+    from app.services.quantize import QuantizedIndex
+    from app.routers import match as M
+
+    photo_ids, dog_ids, vecs = _clustered(dim=512)
+    idx = QuantizedIndex(512, "binary")
+    idx.build(photo_ids, dog_ids, vecs)
+    monkeypatch.setattr(ann, "index", idx)
+    monkeypatch.setattr(settings, "match_mode", "two_stage")
+    monkeypatch.setattr(settings, "quant_candidates", 40)
+
+    seen = {}
+    async def _photos(ids, vec, lat, lon, k=5):
+        seen["ids"] = ids
+        return [{"dog_id": "d0", "visual": 0.9}]
+    monkeypatch.setattr(M, "rpc_match_photo_candidates", _photos)
+
+    buf = io.BytesIO()
+    Image.new("RGB", (32, 32), color=(10, 20, 30)).save(buf, format="JPEG")
+    r = client.post("/v1/match", params={"photo_bytes_b64": base64.b64encode(buf.getvalue()).decode()})
+    assert r.status_code == 200 and r.json()["candidates"][0]["dog_id"] == "d0"
+    assert len(seen["ids"]) == 40 and set(seen["ids"]) <= set(photo_ids)
+
+    r = client.get("/v1/match/index", params={"recall_k": 5})
+    assert r.json()["kind"] == "binary" and r.json()["code_bytes"] == 64 and "recall_at_k" not in r.json()
@@ -0,0 +1,98 @@
+def _rows(n=300, seed=5):
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    return [{"id": f"p{i}", "dog_id": f"d{i // 3}" if i % 10 else None,
+             "lab": rng.random(48).tolist(), "lbp": rng.random(256).tolist(),
+             "lat": 45.0 + (i % 50) * 0.1, "lon": -73.0}
+            for i in range(n)]
+
+def test_appearance_index_matches_reference_distances():
+    import numpy as np
+    from app.services.appearance import AppearanceIndex, histogram_row
+
+    rows = _rows()
+    idx = AppearanceIndex()
+    assert idx.add_rows(rows[:200]) == 200 and idx.add_rows(rows[200:]) == 100
+    assert len(idx) == 300 and idx.stats()["dtype"] == "float16"
+
+    q = histogram_row(rows[42]["lab"], rows[42]["lbp"])
+    ref = np.stack([histogram_row(r["lab"], r["lbp"]) for r in rows])
+    chi2 = 0.5 * ((ref - q) ** 2 / np.maximum(ref + q, 1e-9))
+    inter = 1 - np.minimum(ref, q)[:, :48].sum(axis=1)
+    want_chi2 = 0.7 * chi2[:, :48].sum(axis=1) + 0.3 * chi2[:, 48:].sum(axis=1)
+    assert np.allclose(idx.distances(q, "chi2", 0.7), want_chi2, atol=2e-3)
+    assert np.allclose(idx.distances(q, "intersection", 1.0), inter, atol=2e-3)
+
+    hits = idx.search(q, 5)
+    assert hits[0]["photo_id"] == "p42" and hits[0]["distance"] < 1e-3
+    assert idx.search(q, 5, exclude="p42")[0]["photo_id"] != "p42"
+    # one hit per dog, unassigned photos skipped
+    by_dog = idx.search(q, 50, by_dog=True)
+    assert len({h["dog_id"] for h in by_dog}) == len(by_dog) and None not in {h["dog_id"] for h in by_dog}
+    # geo radius keeps only photos within ~12 km of 45.0 (the first two latitude steps)
+    near = idx.search(q, 300, lat=45.0, lon=-73.0, radius_km=12)
+    assert near and all(int(h["photo_id"][1:]) % 50 in (0, 1) for h in near)
+
+    # re-analysis replaces the row in place
+    idx.add_rows([{**rows[0], "lab": rows[42]["lab"], "lbp": rows[42]["lbp"]}])
+    assert len(idx) == 300 and {h["photo_id"] for h in idx.search(q, 2)} == {"p0", "p42"}
+
+    # an unassigned photo joins by-dog search once it is confirmed
+    assert rows[10]["dog_id"] is None
+    q10 = histogram_row(rows[10]["lab"], rows[10]["lbp"])
+    assert idx.search(q10, 1, by_dog=True)[0]["photo_id"] != "p10"
+    idx.add_rows([{**rows[10], "dog_id": "d-new"}])
+    hit = idx.search(q10, 1, by_dog=True)[0]
+    assert (hit["photo_id"], hit["dog_id"]) == ("p10", "d-new") and hit["distance"] < 1e-3
+
+def test_appearance_routes_and_match_fallback(client, monkeypatch):
+    import base64, io
+    from PIL import Image
+    from app.routers import match
+    from app.services import appearance
+    from app.services.appearance import AppearanceIndex
+    from app.services.markings import appearance_histograms
+
+    buf = io.BytesIO()
+    Image.radial_gradient("L").convert("RGB").save(buf, format="JPEG")
+    data = buf.getvalue()
+    lab, lbp = appearance_histograms(data)
+    idx = AppearanceIndex()
+    idx.add_rows([{"id": "same", "dog_id": "dog-1", "lab": lab, "lbp": lbp, "lat": None, "lon": None}]
+                 + [{**r, "dog_id": "dog-2"} for r in _rows(20)])
+    monkeypatch.setattr(appearance, "index", idx)
+
+    r = client.post("/v1/appearance/search", params={"k": 3, "group": "photo"},
+                    files={"file": ("a.jpg", data, "image/jpeg")})
+    body = r.json()
+    assert body["metric"] == "chi2" and body["results"][0]["photo_id"] == "same"
+    r = client.post("/v1/appearance/search", params={"photo_id": "same", "metric": "intersection"})
+    assert [h["dog_id"] for h in r.json()["results"]] == ["dog-2"]
+    assert client.post("/v1/appearance/search", params={"photo_id": "same", "metric": "l2"}).status_code == 400
+    assert client.post("/v1/appearance/search", params={"photo_id": "nope"}).status_code == 404
+    assert client.get("/v1/appearance/index").json()["size"] == 21
+
+    seen = {}
+    async def _candidates(cands, lat, lon, k):
+        seen["cands"] = cands
+        return [{"dog_id": d, "visual": s} for d, s in cands][:k]
+    monkeypatch.setattr(match, "rpc_match_dog_candidates", _candidates)
+    monkeypatch.setattr(match.settings, "embedder_backend", "random")
+    b64 = base64.b64encode(data).decode()
+    # off by default: the regular embedding match runs
+    assert "ranked_by" not in client.post("/v1/match", params={"photo_bytes_b64": b64, "k": 2}).json()
+
+    monkeypatch.setattr(match.settings, "appearance_match_fallback", True)
+    r = client.post("/v1/match", params={"photo_bytes_b64": b64, "k": 2})
+    assert r.json()["ranked_by"] == "appearance" and seen["cands"][0][0] == "dog-1"
+    assert seen["cands"][0][1] > seen["cands"][1][1]
+
+    # nothing indexed yet: no fallback
+    monkeypatch.setattr(appearance, "index", AppearanceIndex())
+    r = client.post("/v1/match", params={"photo_bytes_b64": b64, "k": 2})
+    assert "ranked_by" not in r.json() and len(r.json()["candidates"]) == 2
+
+    # analyze appends the saved histograms without reading them back
+    r = client.post("/v1/analyze", params={"photo_id": "fresh"}, files={"file": ("a.jpg", data, "image/jpeg")})
+    assert r.status_code == 200 and len(appearance.index) == 1
+    assert appearance.index.search(appearance.index.row_of("fresh"), 1)[0]["distance"] < 1e-3
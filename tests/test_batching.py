@@ -0,0 +1,34 @@
+def test_batcher_groups_concurrent_requests():
+    import asyncio
+    import numpy as np
+    from app.services.batching import InferenceBatcher
+
+    sizes = []
+    def run_batch(batch):
+        sizes.append(batch.shape[0])
+        return batch.reshape(batch.shape[0], -1)[:, :4] * 2
+
+    b = InferenceBatcher(run_batch, max_batch=8, max_wait_ms=50)
+    tensors = [np.full((1, 3, 2, 2), i, dtype=np.float32) for i in range(20)]
+
+    async def go():
+        return await b.embed_many(tensors)
+
+    out = asyncio.run(go())
+    b.stop()
+    assert [float(v[0]) for v in out] == [2.0 * i for i in range(20)]
+    assert sum(sizes) == 20 and max(sizes) <= 8 and len(sizes) < 20
+
+def test_batcher_propagates_errors():
+    import asyncio
+    import numpy as np
+    import pytest
+    from app.services.batching import InferenceBatcher
+
+    def run_batch(batch):
+        raise RuntimeError("boom")
+
+    b = InferenceBatcher(run_batch, max_batch=4, max_wait_ms=1)
+    with pytest.raises(RuntimeError):
+        asyncio.run(b.embed(np.zeros((1, 3, 2, 2), dtype=np.float32)))
+    b.stop()
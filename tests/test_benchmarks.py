@@ -0,0 +1,13 @@
+def test_compare_flags_slowdowns_and_throughput_drops():
+    from benchmarks.common import compare, summarize
+
+    s = summarize([0.001, 0.002, 0.003])
+    assert s["n"] == 3 and abs(s["median_ms"] - 2.0) < 1e-9
+    base = {"results": {"a": {"median_ms": 10.0, "p95_ms": 20.0},
+                        "b": {"median_ms": 10.0, "throughput_rps": 100.0},
+                        "gone": {"median_ms": 1.0}}}
+    cur = {"results": {"a": {"median_ms": 12.0, "p95_ms": 20.5},
+                       "b": {"median_ms": 9.0, "throughput_rps": 70.0},
+                       "new": {"median_ms": 1.0}}}
+    flagged = {(d["benchmark"], d["metric"]) for d in compare(cur, base, threshold=0.15) if d["regression"]}
+    assert flagged == {("a", "median_ms"), ("b", "throughput_rps")}
@@ -0,0 +1,42 @@
+def test_lru_cache_bounds_ttl_and_disk_tier(tmp_path, monkeypatch):
+    import numpy as np
+    from app.services import cache as C
+
+    c = C.LruCache(max_bytes=3 * (C.sizeof(np.zeros(256, dtype=np.float32))), ttl_s=60)
+    for i in range(5):
+        c.put(f"k{i}", np.full(256, i, dtype=np.float32))
+    assert len(c) == 3 and c.evictions == 2
+    assert c.get("k0") is None and c.get("k4")[0] == 4
+
+    clock = [1000.0]
+    monkeypatch.setattr(C.time, "monotonic", lambda: clock[0])
+    t = C.LruCache(max_bytes=1 << 20, ttl_s=10, tier=C.DiskTier(str(tmp_path), ttl_s=3600))
+    t.put("a", {"phash": b"12345678", "lab": [0.5] * 48})
+    clock[0] += 11
+    assert t.get("a") == {"phash": b"12345678", "lab": [0.5] * 48}
+    s = t.stats()
+    assert s["expirations"] == 1 and s["tier_hits"] == 1
+
+def test_disk_tier_io_runs_off_the_event_loop(tmp_path, monkeypatch):
+    import asyncio, threading
+    from app.services import cache as C
+
+    loop_thread = threading.get_ident()
+    seen = []
+    class _Tier(C.DiskTier):
+        def get(self, key):
+            seen.append(("get", threading.get_ident() != loop_thread))
+            return super().get(key)
+        def put(self, key, value):
+            seen.append(("put", threading.get_ident() != loop_thread))
+            super().put(key, value)
+
+    async def run():
+        c = C.LruCache(max_bytes=1 << 20, ttl_s=60, tier=_Tier(str(tmp_path), ttl_s=3600))
+        await c.aput("a", b"abc")
+        fresh = C.LruCache(max_bytes=1 << 20, ttl_s=60, tier=c.tier)
+        return await fresh.aget("a"), await fresh.aget("a"), await fresh.aget("b"), fresh.stats()
+    first, second, missing, s = asyncio.run(run())
+    assert first == second == b"abc" and missing is None
+    assert seen == [("put", True), ("get", True), ("get", True)]
+    assert (s["tier_hits"], s["hits"], s["misses"]) == (1, 1, 1)
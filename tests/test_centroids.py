@@ -1,20 +1,150 @@
-def test_refresh_centroids(client, monkeypatch):
-    class FakeCur:
-        async def execute(self, sql, params):
-            self.rows = [
-                {"part":"unknown", "embedding":[0.1,0.2,0.3]+[0.0]*125},
-                {"part":"unknown", "embedding":[0.2,0.1,0.4]+[0.0]*125},
-            ]
-        async def fetchall(self): return self.rows
-    class FakeCtx:
-        async def __aenter__(self): return (None, FakeCur())
-        async def __aexit__(self, exc_type, exc, tb): return False
-
-    from app.routers import centroids as C
-    monkeypatch.setattr(C, "get_conn", lambda: FakeCtx())
+def test_refresh_centroids_rebuilds_under_lock(client, fake_pool):
+    import numpy as np
+
+    rows = [
+        {"dog_id": "d1", "part": "unknown", "embedding": np.array([0.1,0.2,0.3]+[0.0]*125, dtype=np.float32)},
+        {"dog_id": "d1", "part": "unknown", "embedding": np.array([0.2,0.1,0.4]+[0.0]*125, dtype=np.float32)},
+    ]
+    pool = fake_pool(lambda sql, params, name: list(rows) if name else [])
 
     r = client.post("/v1/centroids/refresh-dog", params={"dog_id":"11111111-1111-1111-1111-111111111111"})
     assert r.status_code == 200
-    js = r.json()
-    assert js["dog_id"]
-    assert "parts_updated" in js
+    assert r.json()["parts_updated"] == ["unknown"]
+
+    def _step(e):
+        if isinstance(e, str):
+            return e
+        method, sql, params, name = e
+        if name:
+            return "stream"
+        if method == "executemany":
+            return "upsert"
+        return "lock" if "advisory" in sql else "for update" if "for update" in sql else sql.split()[0]
+    # lock first, then read the patches, then replace the dog's rows, all in one transaction
+    assert [_step(e) for e in pool.log] == ["checkout", "transaction", "lock", "for update", "transaction",
+                                            "stream", "delete", "upsert"]
+    (dog, part, mean, n), = pool.statements[-1][2]
+    assert part == "unknown" and n == 2
+    assert np.allclose(mean[:3], [0.15, 0.15, 0.35])
+
+def test_incremental_centroids_match_full_rebuild():
+    import numpy as np
+    from app.utils.centroids import CentroidAccumulator, merge_centroid
+
+    rng = np.random.default_rng(0)
+    vecs = rng.normal(size=(30, 16)).astype(np.float32)
+    parts = ["ear", "tail", "unknown"] * 10
+    full = CentroidAccumulator()
+    full.add(["d"] * 30, parts, vecs)
+    expected = {p: (m, n) for _, p, m, n in full.results()}
+
+    state = {}
+    for lo, hi in [(0, 7), (7, 20), (20, 30)]:
+        step = CentroidAccumulator()
+        step.add(["d"] * (hi - lo), parts[lo:hi], vecs[lo:hi])
+        for (_, p), (s, n) in step.deltas().items():
+            state[p] = merge_centroid(state.get(p), s, n)
+    for p, (m, n) in expected.items():
+        assert state[p][1] == n and np.allclose(state[p][0], m, atol=1e-6)
+
+    removed = CentroidAccumulator()
+    removed.add(["d"] * 3, parts[:3], vecs[:3], sign=-1)
+    for (_, p), (s, n) in removed.deltas().items():
+        state[p] = merge_centroid(state[p], s, n)
+    rest = CentroidAccumulator()
+    rest.add(["d"] * 27, parts[3:], vecs[3:])
+    for _, p, m, n in rest.results():
+        assert state[p][1] == n and np.allclose(state[p][0], m, atol=1e-5)
+
+def test_part_matrix_scores_and_invalidation():
+    import numpy as np
+    from app import db
+    from app.services import parts
+    from app.services.parts import PartCentroidMatrix
+
+    m = PartCentroidMatrix(4, max_dogs=3)
+    m.put("a", np.array([[1, 0, 0, 0], [0, 1, 0, 0]], dtype=np.float32))
+    m.put("b", np.array([[0, 0, 1, 0]], dtype=np.float32))
+    m.put("none", np.empty((0, 4), dtype=np.float32))
+    q = np.array([[2, 0, 0, 0], [0, 0, 0, 1]], dtype=np.float32)
+    assert m.score(q, ["a", "b", "none", "unknown"]) == {"a": 0.5, "b": 0.0}
+    m.put("a", np.array([[0, 0, 0, 1]], dtype=np.float32))
+    assert m.score(q, ["a"]) == {"a": 0.5}
+    m.put("c", np.ones((2, 4), dtype=np.float32))
+    assert "none" not in m and "b" in m and len(m) == 3  # least recently scored goes first
+
+    old = parts.matrix
+    parts.matrix = m
+    try:
+        db._centroids_changed(["a", None])
+        assert "a" not in m and "c" in m
+    finally:
+        parts.matrix = old
+
+def test_ensure_skips_only_dogs_written_during_the_fetch(monkeypatch):
+    import asyncio
+    from app import db
+    from app.services import parts
+    from app.services.parts import PartCentroidMatrix
+
+    m = PartCentroidMatrix(4)
+    monkeypatch.setattr(parts, "matrix", m)
+    async def _fetch(dog_ids):
+        db._centroids_changed(["a"])
+        return [{"dog_id": d, "centroid": [1.0, 0, 0, 0]} for d in dog_ids]
+    monkeypatch.setattr(parts, "fetch_part_centroids", _fetch)
+    asyncio.run(parts.ensure(["a", "b"]))
+    assert "a" not in m and "b" in m and m.loads == 1 and parts._changed_during_fetch == []
+
+def test_rerank_blend_mixes_dogs_with_and_without_centroids():
+    from app.services.parts import blend
+
+    rows = [{"dog_id": "a", "final_score": 0.80}, {"dog_id": "b", "final_score": 0.78},
+            {"dog_id": "c", "final_score": 0.70}, {"dog_id": "d", "final_score": 0.60}]
+    out = blend(rows, {"b": 0.9, "d": 0.5}, 0.5)
+    # a and c have no centroids and are scored against the mean part score (0.7)
+    assert [r["dog_id"] for r in out] == ["b", "a", "c", "d"]
+    got = {r["dog_id"]: r["final_score"] for r in out}
+    want = {"a": 0.75, "b": 0.84, "c": 0.70, "d": 0.55}
+    assert all(abs(got[d] - want[d]) < 1e-9 for d in want)
+    assert out[1]["parts"] is None and out[0]["parts"] == 0.9
+    # no part scores at all: order and scores unchanged, no geo/recency needed
+    assert blend(rows, {}, 0.5) == [{**r, "parts": None} for r in rows]
+
+def test_match_reranks_with_part_centroids(client, monkeypatch):
+    import base64, io
+    import numpy as np
+    from PIL import Image
+    from app.config import settings
+    from app.routers import match as M
+    from app.services import parts
+
+    monkeypatch.setattr(settings, "match_rerank", True)
+    monkeypatch.setattr(parts, "matrix", None)
+    fetched = []
+    async def _fetch(dog_ids):
+        fetched.append(list(dog_ids))
+        return [{"dog_id": "00000000-0000-0000-0000-000000000002", "part": "unknown",
+                 "centroid": np.ones(settings.embed_vector_size, dtype=np.float32)}]
+    monkeypatch.setattr(parts, "fetch_part_centroids", _fetch)
+    asked = {}
+    async def _match(vec, lat, lon, k=5):
+        asked["k"] = k
+        return [{"dog_id": "00000000-0000-0000-0000-000000000001", "visual": 0.9, "geo": 0.0, "recency": 0.0,
+                 "final_score": 0.63},
+                {"dog_id": "00000000-0000-0000-0000-000000000002", "visual": 0.88, "geo": 0.0, "recency": 0.0,
+                 "final_score": 0.616}]
+    monkeypatch.setattr(M, "rpc_match_dogs", _match)
+
+    rng = np.random.default_rng(0)
+    buf = io.BytesIO()
+    Image.fromarray(rng.integers(0, 255, (160, 160, 3), dtype=np.uint8)).save(buf, format="JPEG")
+    b64 = base64.b64encode(buf.getvalue()).decode()
+    for _ in range(2):
+        r = client.post("/v1/match", params={"photo_bytes_b64": b64, "k": 1})
+        assert r.status_code == 200, r.text
+        (row,) = r.json()["candidates"]
+        assert asked["k"] == settings.match_rerank_candidates
+        assert row["parts"] is None or -1.0 <= row["parts"] <= 1.0
+    assert len(fetched) == 1 and len(fetched[0]) == 2
+    assert client.get("/v1/match/index").json()["rerank"]["dogs"] == 2
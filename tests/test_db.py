@@ -0,0 +1,79 @@
+def test_session_shares_one_checkout_across_helpers(fake_pool):
+    import asyncio
+    from app import db as D
+
+    pool = fake_pool()
+    async def _run():
+        async with D.session():
+            async with D.get_conn() as (c1, _):
+                pass
+            async with D.get_conn() as (c2, cur):
+                await cur.execute("select 1", prepare=D.use_prepared())
+            assert c1 is c2 and cur.kwargs["prepare"] is True
+        async with D.session():
+            pass
+        async with D.get_conn():
+            pass
+    asyncio.run(_run())
+    assert pool.scopes == ["checkout", "checkout"]
+
+def test_save_photo_analyses_pipelines_one_transaction(fake_pool):
+    import asyncio
+    import numpy as np
+    from app import db as D
+
+    def _rows(sql, params, name):
+        if "from public.photos" in sql:
+            return [{"id": "p1", "dog_id": "d1", "lat": 45.5, "lon": -73.6},
+                    {"id": "p2", "dog_id": None, "lat": None, "lon": None}]
+        if "dog_part_centroids" in sql:
+            # stored: ear = [1, 0, 0, 0] over 1 patch
+            return [{"dog_id": "d1", "part": "ear", "centroid": np.array([1, 0, 0, 0], dtype=np.float32),
+                     "n_patches": 1}]
+        return []
+    pool = fake_pool(_rows)
+    changed = []
+    D.on_centroids_changed(changed.append)
+
+    def _patch(part, vec):
+        return {"part": part, "bbox": [0, 0, 8, 8], "embedding": np.array(vec, dtype=np.float32), "score": 1.0}
+    analyses = [
+        {"photo_id": "p1", "phash": b"\0" * 8, "lab": [0.0], "lbp": [0.0],
+         "patches": [_patch("ear", [0, 1, 0, 0]), _patch("ear", [0, 0, 1, 0]), _patch("tail", [0, 0, 0, 1])]},
+        {"photo_id": "p2", "patches": [_patch("ear", [1, 1, 1, 1])]},
+    ]
+    saved, photos = asyncio.run(D.api_save_photo_analyses(analyses))
+
+    log = [(sql.split()[1].split("(")[0], params) for _, sql, params, _ in pool.statements]
+    assert pool.scopes == ["checkout", "pipeline", "transaction"]
+    assert saved == 4 and photos["p1"] == {"dog_id": "d1", "lat": 45.5, "lon": -73.6}
+    assert [sql for sql, _ in log] == ["api.upsert_photo_analysis", "api.insert_photo_patch", "id::text",
+                                       "pg_advisory_xact_lock", "c.dog_id::text", "api.upsert_dog_part_centroid"]
+    assert [r[0] for r in log[0][1]] == ["p1", "p2"] and len(log[1][1]) == 4 and log[3][1] == (["d1", "d1"],)
+    # only p1's patches are folded in, merged with the stored running mean
+    merged = {part: (mean, n) for _, part, mean, n in log[5][1]}
+    assert merged.keys() == {"ear", "tail"}
+    assert merged["ear"][1] == 3 and np.allclose(merged["ear"][0], [1 / 3, 1 / 3, 1 / 3, 0])
+    assert merged["tail"][1] == 1 and np.allclose(merged["tail"][0], [0, 0, 0, 1])
+    assert changed == [{"d1"}]
+
+def test_patch_helpers_use_the_request_session(fake_pool, monkeypatch):
+    import asyncio
+    import numpy as np
+    from app import db as D
+
+    def _rows(sql, params, name):
+        return [{"dog_id": "d1", "part": "ear", "embedding": np.ones(4, dtype=np.float32)}] \
+            if "photo_patches" in sql else []
+    pool = fake_pool(_rows)
+    stages = []
+    monkeypatch.setattr(D.metrics, "record_stage", lambda name, s: stages.append(name))
+
+    async def _run():
+        async with D.session():
+            removed = await D.api_remove_photo_patches("p1")
+            streamed = [rows async for rows in D.iter_patch_embeddings(["d1"])]
+        return removed, streamed
+    removed, streamed = asyncio.run(_run())
+    assert removed["patches_removed"] == 1 and len(streamed) == 1
+    assert pool.scopes.count("checkout") == 1 and stages.count("db.checkout") == 1
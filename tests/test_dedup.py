@@ -0,0 +1,67 @@
+def _codes(n=20000, seed=3):
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, 2**63, size=n, dtype=np.int64).astype(np.uint64) * np.uint64(2) + rng.integers(0, 2, n).astype(np.uint64)
+
+def test_hamming_index_matches_exact_scan():
+    import numpy as np
+    from app.services.dedup import HammingIndex
+
+    codes = _codes()
+    rng = np.random.default_rng(4)
+    # plant near-duplicates of the first 200 codes at distances 0..10
+    near = codes[:200].copy()
+    for i in range(200):
+        for b in rng.choice(64, i % 11, replace=False):
+            near[i] ^= np.uint64(1) << np.uint64(int(b))
+    all_codes = np.concatenate([codes, near])
+    ids = [f"p{i}" for i in range(len(all_codes))]
+    idx = HammingIndex(max_distance=10)
+    idx.build(ids[:18000], [None] * 18000, all_codes[:18000])
+    idx.add(ids[18000:], ["d"] * (len(ids) - 18000), all_codes[18000:])
+    assert len(idx) == len(all_codes) and idx.stats()["tail"] == len(ids) - 18000
+
+    for i in range(0, 200, 7):
+        for r in (0, 4, 10):
+            assert idx.search(int(codes[i]), r, limit=50) == idx.search_exact(int(codes[i]), r, limit=50)
+        assert any(h["photo_id"] == f"p{20000 + i}" for h in idx.search(int(codes[i]), 10, limit=50))
+
+    # re-hashing an indexed photo moves it
+    idx.rebuild()
+    idx.add(["p0"], [None], [int(codes[1])])
+    assert {h["photo_id"] for h in idx.search(int(codes[1]), 0)} >= {"p0", "p1"}
+    assert "p0" not in {h["photo_id"] for h in idx.search(int(codes[0]), 0)}
+
+def test_analyze_and_match_exit_early_on_duplicate(client, monkeypatch):
+    import base64, io
+    from PIL import Image
+    from app.services import dedup
+    from app.services.dedup import HammingIndex, code_from_bytes
+    from app.services.markings import phash_image_bytes
+
+    buf = io.BytesIO()
+    Image.radial_gradient("L").convert("RGB").save(buf, format="JPEG")
+    data = buf.getvalue()
+    idx = HammingIndex(max_distance=10)
+    idx.build(["old"], ["dog-1"], [code_from_bytes(phash_image_bytes(data))])
+    monkeypatch.setattr(dedup, "index", idx)
+
+    r = client.post("/v1/analyze", params={"photo_id": "new", "dedup_max_distance": 2},
+                    files={"file": ("a.jpg", data, "image/jpeg")})
+    assert r.json()["duplicate_of"] == {"photo_id": "old", "dog_id": "dog-1", "distance": 0}
+
+    r = client.post("/v1/match", params={"photo_bytes_b64": base64.b64encode(data).decode(), "dedup_max_distance": 2})
+    assert r.json()["duplicate_of"]["dog_id"] == "dog-1"
+
+    # beyond what the index was built for is refused, not silently clipped
+    r = client.post("/v1/analyze", params={"photo_id": "new", "dedup_max_distance": 11},
+                    files={"file": ("a.jpg", data, "image/jpeg")})
+    assert r.status_code == 400 and "10" in r.json()["detail"]
+    r = client.post("/v1/match", params={"photo_bytes_b64": base64.b64encode(data).decode(), "dedup_max_distance": 11})
+    assert r.status_code == 400
+
+    r = client.post("/v1/analyze", params={"photo_id": "new"}, files={"file": ("a.jpg", data, "image/jpeg")})
+    assert "duplicate_of" not in r.json() and len(idx) == 2
+
+    r = client.post("/v1/duplicates", files={"file": ("a.jpg", data, "image/jpeg")})
+    assert [d["photo_id"] for d in r.json()["duplicates"]] == ["old", "new"]
@@ -0,0 +1,50 @@
+def test_geohash_and_tile_cover():
+    from app.utils.geo import geohash_encode, geohash_bounds, geohash_center, haversine_km, radius_bucket
+
+    assert geohash_encode(57.64911, 10.40744, 11) == "u4pruydqqvj"
+    lat_lo, lat_hi, lon_lo, lon_hi = geohash_bounds("u4pruy")
+    assert lat_lo <= 57.64911 <= lat_hi and lon_lo <= 10.40744 <= lon_hi
+    clat, clon, half = geohash_center("u4pruy")
+    assert haversine_km(clat, clon, [lat_hi], [lon_hi])[0] <= half + 1e-9
+    assert radius_bucket(10.0) == 16.0 and radius_bucket(16.0) == 16.0 and radius_bucket(0.01) == 0.125
+
+def test_nearby_polls_share_a_tile_query(client, monkeypatch):
+    from app.services import cache as C
+    from app.routers import dogs as D
+
+    rows = [
+        {"dog_id": "near", "last_seen_lat": 52.5201, "last_seen_lon": 13.4051, "distance_km": 0.0},
+        {"dog_id": "mid", "last_seen_lat": 52.5300, "last_seen_lon": 13.4050, "distance_km": 0.0},
+        {"dog_id": "far", "last_seen_lat": 52.6000, "last_seen_lon": 13.4050, "distance_km": 0.0},
+    ]
+    calls = []
+    async def _query(lat, lon, radius_km, limit):
+        calls.append((lat, lon, radius_km, limit))
+        return rows
+    monkeypatch.setattr(D, "_nearby_query", _query)
+    monkeypatch.setattr(C, "nearby", None)
+
+    r1 = client.get("/v1/dogs/nearby", params={"lat": 52.5200, "lon": 13.4050, "radius_km": 2})
+    r2 = client.get("/v1/dogs/nearby", params={"lat": 52.5201, "lon": 13.4051, "radius_km": 1.5, "limit": 1})
+    assert len(calls) == 1 and calls[0][2] > 2
+    assert [d["dog_id"] for d in r1.json()["results"]] == ["near", "mid"]
+    assert [d["dog_id"] for d in r2.json()["results"]] == ["near"]
+    assert r2.json()["results"][0]["distance_km"] < 0.01
+
+def test_dog_detail_is_cached_with_etag_and_invalidated(client, fake_pool, monkeypatch):
+    from app.services import cache as C
+
+    pool = fake_pool(lambda sql, params, name: [{"dog": {"id": "dog-1", "display_name": "Buddy", "photo_url": "u1",
+                                                         "photos": [{"id": "p1", "url": "u1", "taken_at": None}]}}])
+    monkeypatch.setattr(C, "dogs", None)
+
+    r = client.get("/v1/dogs/dog-1")
+    assert r.status_code == 200 and r.json()["photos"][0]["id"] == "p1"
+    etag = r.headers["etag"]
+    r = client.get("/v1/dogs/dog-1", headers={"If-None-Match": etag})
+    assert r.status_code == 304 and r.content == b""
+    assert len(pool.statements) == 1
+
+    client.post("/v1/confirm", params={"sighting_id": "s", "chosen_dog_id": "dog-1"})
+    r = client.get("/v1/dogs/dog-1", headers={"If-None-Match": f"W/{etag}"})
+    assert r.status_code == 304 and len(pool.statements) == 2
@@ -0,0 +1,44 @@
+def _fake_ort(calls):
+    import types
+    import numpy as np
+
+    class _Input:
+        name, shape = "x", ["N", 3, 224, 224]
+    class _Session:
+        def __init__(self, path, sess_options=None, providers=None):
+            calls.append((path, sess_options.graph_optimization_level))
+            if sess_options.optimized_model_filepath:
+                with open(sess_options.optimized_model_filepath, "w") as f:
+                    f.write("optimized")
+        def get_inputs(self):
+            return [_Input()]
+        def run(self, _, feeds):
+            return [np.ones((feeds["x"].shape[0], 8), dtype=np.float32)]
+    class _Options:
+        optimized_model_filepath = ""
+    ort = types.ModuleType("onnxruntime")
+    ort.__version__ = "0.test"
+    ort.SessionOptions = _Options
+    ort.InferenceSession = _Session
+    ort.GraphOptimizationLevel = types.SimpleNamespace(ORT_ENABLE_ALL="all", ORT_DISABLE_ALL="none")
+    ort.ExecutionMode = types.SimpleNamespace(ORT_SEQUENTIAL="seq")
+    return ort
+
+def test_onnx_embedder_reuses_optimized_model_and_warms_up(tmp_path, monkeypatch):
+    import sys
+    from app.services.embedding import OnnxEmbedder
+
+    calls = []
+    monkeypatch.setitem(sys.modules, "onnxruntime", _fake_ort(calls))
+    model = tmp_path / "dogid.onnx"
+    model.write_text("model")
+    cache = tmp_path / "cache"
+
+    first = OnnxEmbedder(str(model), 8, cache_dir=str(cache))
+    assert not first.cache_hit and calls[-1] == (str(model), "all")
+    assert [p.name.endswith(".opt.onnx") for p in cache.iterdir()] == [True]
+
+    second = OnnxEmbedder(str(model), 8, cache_dir=str(cache))
+    assert second.cache_hit and calls[-1][1] == "none" and calls[-1][0].startswith(str(cache))
+    second.warmup((1, 4))
+    assert second.embed_batch(__import__("numpy").zeros((2, 3, 224, 224))).shape == (2, 8)
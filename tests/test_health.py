@@ -2,3 +2,40 @@ def test_health(client):
     r = client.get("/v1/health")
     assert r.status_code == 200
     assert r.json().get("ok") is True
+
+def test_readiness_reports_pool_saturation(client, monkeypatch):
+    from app.routers import health as H
+
+    r = client.get("/v1/health", params={"ready": True})
+    assert r.status_code == 503 and r.json()["ready"] is False
+
+    status = {"min_size": 2, "max_size": 4, "size": 4, "available": 1, "waiting": 0, "saturated": False}
+    async def _ping(): return True
+    monkeypatch.setattr(H, "pool_status", lambda: status)
+    monkeypatch.setattr(H, "ping", _ping)
+    r = client.get("/v1/health", params={"ready": True})
+    assert r.status_code == 200 and r.json()["db"]["size"] == 4
+
+    status.update(available=0, waiting=3, saturated=True)
+    assert client.get("/v1/health", params={"ready": True}).status_code == 503
+    assert client.get("/v1/health").status_code == 200
+
+def test_failed_index_load_is_logged_and_startup_continues(monkeypatch, caplog):
+    import logging
+    from fastapi.testclient import TestClient
+    from app import main
+    from app.services import dedup
+
+    async def _noop(): return None
+    async def _broken(): raise RuntimeError("no photo_analysis table")
+    monkeypatch.setattr(main, "init_db", _noop)
+    monkeypatch.setattr(main, "close_db", _noop)
+    monkeypatch.setattr(dedup, "load_index", _broken)
+    monkeypatch.setattr(main.settings, "dedup_enabled", True)
+    monkeypatch.setattr(main.settings, "appearance_enabled", False)
+    with caplog.at_level(logging.ERROR, logger="uvicorn.error"):
+        with TestClient(main.app) as c:
+            assert c.get("/v1/health").status_code == 200
+    (rec,) = [r for r in caplog.records if "[dedup]" in r.getMessage()]
+    assert "Index load failed" in rec.getMessage() and rec.exc_info[0] is RuntimeError
+    assert "dedup_index" in main.startup_report
@@ -0,0 +1,102 @@
+import numpy as np
+from PIL import Image
+
+def _reference_pick(img, k=5, win=64, stride=32):
+    # the original per-window loop, kept as the oracle for the vectorized scorer
+    from app.services.markings import gradient_map, nms_boxes
+    S = 256
+    scale = S / min(img.size)
+    new_w = int(img.width * scale); new_h = int(img.height * scale)
+    g = np.asarray(img.resize((new_w, new_h)).convert("L"), dtype=np.float32)
+    mag = gradient_map(g)
+    boxes, scores = [], []
+    for y in range(0, new_h - win + 1, stride):
+        for x in range(0, new_w - win + 1, stride):
+            boxes.append((x, y, win, win))
+            scores.append(float(mag[y:y+win, x:x+win].mean()))
+    if not boxes:
+        return []
+    idxs = np.argsort(scores)[::-1][:max(50, 5*k)]
+    boxes_sel = [boxes[i] for i in idxs]
+    scores_sel = [scores[i] for i in idxs]
+    keep = nms_boxes(boxes_sel, scores_sel, iou_thr=0.4)[:k]
+    return [(*boxes_sel[i], scores_sel[i]) for i in keep]
+
+def _images():
+    rng = np.random.default_rng(3)
+    yield Image.new("RGB", (64, 64), color=(128, 80, 40))
+    yield Image.fromarray(rng.integers(0, 255, size=(300, 420, 3), dtype=np.uint8))
+    yy, xx = np.mgrid[0:480, 0:640]
+    yield Image.fromarray(np.stack([(xx * 7) % 255, (yy * 3) % 255, (xx ^ yy) % 255], -1).astype(np.uint8))
+    blob = np.zeros((512, 384, 3), dtype=np.uint8)
+    blob[100:220, 50:200] = 255
+    yield Image.fromarray(blob)
+
+def test_vectorized_patches_match_reference():
+    from app.services.markings import pick_distinctive_patches
+    for img in _images():
+        for stride in (32, 16):
+            assert pick_distinctive_patches(img, k=5, win=64, stride=stride) == _reference_pick(img, 5, 64, stride)
+
+def _tie_heavy_images():
+    # flat blocks, binary noise, stripes and ramps: many windows share a mean or
+    # differ from another only by float32 rounding
+    for seed in range(3):
+        rng = np.random.default_rng(10 + seed)
+        h, w = 220 + 60 * seed, 330 - 40 * seed
+        cell = (8, 16, 33)[seed]
+        blk = rng.integers(0, 2, size=(h // cell + 1, w // cell + 1)) * 255
+        yield Image.fromarray(np.kron(blk, np.ones((cell, cell)))[:h, :w].astype(np.uint8)).convert("RGB")
+        yield Image.fromarray((rng.integers(0, 2, size=(h, w)) * 255).astype(np.uint8)).convert("RGB")
+        yy, xx = np.mgrid[0:h, 0:w]
+        yield Image.fromarray((((xx // (3 + 5 * seed)) % 2) * 255).astype(np.uint8)).convert("RGB")
+        yield Image.fromarray(((xx * (0.7 + seed) + yy * 1.3) % 256).astype(np.uint8)).convert("RGB")
+
+def test_vectorized_patches_match_reference_on_ties():
+    from app.services.markings import pick_distinctive_patches
+    for img in _tie_heavy_images():
+        for stride in (32, 16, 8):
+            assert pick_distinctive_patches(img, k=5, win=64, stride=stride) == _reference_pick(img, 5, 64, stride)
+
+def test_batch_and_multiscale_patches():
+    from app.services.markings import pick_distinctive_patches, pick_distinctive_patches_batch
+    imgs = list(_images())
+    assert pick_distinctive_patches_batch(imgs + imgs[1:2]) == [pick_distinctive_patches(im) for im in imgs + imgs[1:2]]
+
+    multi = pick_distinctive_patches(imgs[2], k=8, stride=16, wins=(32, 64, 96))
+    assert len(multi) == 8
+    assert {w for (_, _, w, _, _) in multi} <= {32, 64, 96}
+    assert all(a[4] >= b[4] for a, b in zip(multi, multi[1:]))
+
+def test_pyramid_decodes_once_at_reduced_size():
+    import io
+    from app.services.markings import extract_markings
+    from app.utils.pyramid import ImagePyramid
+
+    rng = np.random.default_rng(5)
+    buf = io.BytesIO()
+    Image.fromarray(rng.integers(0, 255, size=(3000, 4000, 3), dtype=np.uint8)).save(buf, format="JPEG")
+    data = buf.getvalue()
+
+    pyr = ImagePyramid(data, max_side=1024)
+    assert pyr.source_size == (4000, 3000)
+    assert pyr.decoded_size[0] < 4000 and max(pyr.rgb.size) == 1024
+    assert pyr.gray_min_side(256).shape == (256, 341)
+
+    feats = extract_markings(data)
+    assert len(feats["phash"]) == 8 and len(feats["lab"]) == 48 and len(feats["lbp"]) == 256
+    assert len(feats["patches"]) == 5
+    assert feats["memory"]["peak_bytes"] < 4000 * 3000 * 4
+
+def test_fast_histograms_match_reference_within_tolerance():
+    from app.services.markings import lab_histogram, lab_histogram_lut, lbp_histogram, lbp_histogram_tiled
+    bin_width = np.array([100 / 16] * 16 + [255 / 16] * 32)
+    # the first image is a flat colour on a bin edge, the documented exception
+    for img in list(_images())[1:]:
+        rgb = np.asarray(img)
+        ref = np.array(lab_histogram(img)) * bin_width
+        fast = np.array(lab_histogram_lut(rgb, tile_rows=37)) * bin_width
+        for c in range(3):
+            assert np.abs(ref[c*16:(c+1)*16] - fast[c*16:(c+1)*16]).sum() < 0.02
+        gray = np.asarray(img.convert("L"), dtype=np.float32)
+        assert lbp_histogram_tiled(gray, tile_rows=29) == lbp_histogram(gray)
@@ -1,16 +1,16 @@
 def test_match_with_url(client, monkeypatch):
-    class Resp:
-        def __init__(self, content=b"img"): self.content = content
-        def raise_for_status(self): return None
-    class FakeAsyncClient:
-        async def __aenter__(self): return self
-        async def __aexit__(self, exc_type, exc, tb): return False
-        async def get(self, url): return Resp()
+    import io
+    from PIL import Image
+    buf = io.BytesIO()
+    Image.new("RGB", (64,64), color=(90,60,30)).save(buf, format="JPEG")
+    img_bytes = buf.getvalue()
 
     import httpx
-    monkeypatch.setattr(httpx, "AsyncClient", lambda timeout=30: FakeAsyncClient())
+    from app.services import http_client
+    transport = httpx.MockTransport(lambda req: httpx.Response(200, content=img_bytes))
+    monkeypatch.setattr(http_client, "_client", httpx.AsyncClient(transport=transport))
 
-    r = client.post("/v1/match", json={"photo_url":"https://example.com/dog.jpg","lat":12.34,"lon":56.78,"k":2})
+    r = client.post("/v1/match", params={"photo_url":"https://example.com/dog.jpg","lat":12.34,"lon":56.78,"k":2})
     assert r.status_code == 200
     js = r.json()
     assert "candidates" in js and len(js["candidates"]) == 2
@@ -19,3 +19,66 @@ def test_confirm(client):
     r = client.post("/v1/confirm", params={"sighting_id":"s1", "chosen_dog_id":"d1"})
     assert r.status_code == 200
     assert r.json()["dog_id"] == "d1"
+
+def _b64_jpeg(color):
+    import base64, io
+    from PIL import Image
+    buf = io.BytesIO()
+    Image.new("RGB", (48, 48), color=color).save(buf, format="JPEG")
+    return base64.b64encode(buf.getvalue()).decode()
+
+def test_match_batch_single_round_trip(client, monkeypatch):
+    import httpx
+    from app.routers import match as M
+    from app.services import embedding, http_client
+
+    calls = []
+    async def _batch(vecs, lat, lon, k=5, depth=20, fusion="max"):
+        calls.append((len(vecs), k, depth, fusion))
+        row = lambda shot, d, s: {"shot": shot, "dog_id": d, "display_name": None, "primary_photo_url": None,
+                                  "visual": s, "geo": 0.0, "recency": 0.0, "final_score": s}
+        return [row(0, "a", 0.9), row(0, "b", 0.7), row(1, "a", 0.9), row(1, "c", 0.8), row(1, "b", 0.1),
+                row(3, "b", 0.7)]
+    monkeypatch.setattr(M, "rpc_match_dogs_batch", _batch)
+    url_jpeg = __import__("base64").b64decode(_b64_jpeg((5, 6, 7)))
+    monkeypatch.setattr(http_client, "_client", httpx.AsyncClient(
+        transport=httpx.MockTransport(lambda req: httpx.Response(200, content=url_jpeg))))
+
+    photos = [{"photo_bytes_b64": _b64_jpeg((200, 10, 10))}, {"photo_url": "https://example.com/2.jpg"},
+              {"photo_bytes_b64": _b64_jpeg((10, 10, 200))}]
+    r = client.post("/v1/match/batch", json={"photos": photos, "k": 2, "fusion": "mean"})
+    assert r.status_code == 200, r.text
+    js = r.json()
+    assert calls == [(3, 2, 20, "mean")]
+    assert embedding.batcher.last_batch_size == 3
+    assert [c["dog_id"] for c in js["candidates"]] == ["a", "b"]
+    assert [[c["dog_id"] for c in p["candidates"]] for p in js["photos"]] == [["a", "c"], [], ["b"]]
+
+    assert client.post("/v1/match/batch", json={"photos": []}).status_code == 400
+    assert client.post("/v1/match/batch", json={"photos": photos, "fusion": "median"}).status_code == 400
+
+def test_match_batch_fuses_index_candidates(client, monkeypatch):
+    from app.routers import match as M
+    from app.services import ann
+
+    class _Index:
+        calls = 0
+        def search(self, vec, n):
+            self.calls += 1
+            return [("a", 0.9), ("b", 0.5)] if self.calls == 1 else [("b", 0.8)]
+    monkeypatch.setattr(ann, "index", _Index())
+    monkeypatch.setattr(M.settings, "match_mode", "ann")
+
+    seen = {}
+    async def _cands(cands, lat, lon, k=5):
+        seen["cands"] = cands
+        return [{"dog_id": d, "display_name": None, "primary_photo_url": None, "visual": v,
+                 "geo": 1.0 if d == "a" else 0.0, "recency": 0.0, "final_score": 0.0} for d, v in cands]
+    monkeypatch.setattr(M, "rpc_match_dog_candidates", _cands)
+
+    photos = [{"photo_bytes_b64": _b64_jpeg((1, 2, 3))}, {"photo_bytes_b64": _b64_jpeg((3, 2, 1))}]
+    js = client.post("/v1/match/batch", json={"photos": photos, "k": 5, "fusion": "mean"}).json()
+    assert dict(seen["cands"]) == {"a": 0.45, "b": 0.65}
+    fused = {c["dog_id"]: c for c in js["candidates"]}
+    assert abs(fused["a"]["final_score"] - (0.7 * 0.45 + 0.2)) < 1e-9
+    assert [c["dog_id"] for c in js["photos"][1]["candidates"]] == ["b"]
@@ -0,0 +1,30 @@
+def test_metrics_endpoint_reports_routes_stages_and_slow_requests(client, monkeypatch, capsys):
+    import base64, io
+    from PIL import Image
+    from app.config import settings
+
+    buf = io.BytesIO()
+    Image.new("RGB", (32, 32), color=(10, 20, 30)).save(buf, format="JPEG")
+    monkeypatch.setattr(settings, "metrics_slow_request_ms", 0.001)
+    r = client.post("/v1/match", params={"photo_bytes_b64": base64.b64encode(buf.getvalue()).decode()})
+    assert r.status_code == 200
+    slow = [l for l in capsys.readouterr().out.splitlines() if l.startswith("[slow] POST /v1/match")]
+    assert slow and "decode=" in slow[0] and "embed=" in slow[0]
+
+    text = client.get("/metrics").text
+    assert 'petid_request_seconds_count{route="POST /v1/match"}' in text
+    assert 'petid_stage_seconds_bucket{stage="decode",le="+Inf"}' in text
+    assert 'petid_embed_batch_size_count{backend="random"}' in text
+    assert "petid_embed_queue_depth 0" in text
+    assert "petid_cpu_pool_pending" in text
+
+def test_histogram_buckets_are_cumulative():
+    from app.services.metrics import Histogram
+    h = Histogram("x_seconds", "x", "stage", buckets=(0.1, 1.0))
+    for v in (0.05, 0.5, 5.0):
+        h.observe("a", v)
+    lines = h.render()
+    assert 'x_seconds_bucket{stage="a",le="0.1"} 1' in lines
+    assert 'x_seconds_bucket{stage="a",le="1.0"} 2' in lines
+    assert 'x_seconds_bucket{stage="a",le="+Inf"} 3' in lines
+    assert 'x_seconds_count{stage="a"} 3' in lines
@@ -0,0 +1,75 @@
+def _fake_devices(monkeypatch):
+    from app.routers import notify as N
+
+    class FakeCur:
+        async def execute(self, sql, params):
+            self.rows = [{"fcm_token": t} for t in ("tok-a", "tok-dead", "tok-b")]
+        async def fetchall(self): return self.rows
+    class FakeCtx:
+        async def __aenter__(self): return (None, FakeCur())
+        async def __aexit__(self, exc_type, exc, tb): return False
+    monkeypatch.setattr(N, "get_conn", lambda: FakeCtx())
+    deleted = []
+    async def _exec_sql(sql, params=None): deleted.append(params)
+    monkeypatch.setattr(N, "exec_sql", _exec_sql)
+    monkeypatch.setattr(N, "PROJECT_ID", "proj")
+    return deleted
+
+def _fake_fcm(monkeypatch, handler):
+    import httpx
+    from app.services import fcm
+
+    monkeypatch.setattr(fcm, "_client", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    monkeypatch.setattr(fcm, "_sa", {"client_email": "x@y", "token_uri": "https://oauth.example/token", "private_key": "k"})
+    monkeypatch.setattr(fcm, "_assertion", lambda sa: "signed")
+    monkeypatch.setattr(fcm, "_token", None)
+    monkeypatch.setattr(fcm, "_token_lock", None)
+
+def test_send_to_user_fans_out_and_prunes_dead_tokens(client, monkeypatch):
+    import json
+    import httpx
+
+    deleted = _fake_devices(monkeypatch)
+    calls = {"token": 0, "send": 0}
+    def handler(req):
+        if req.url.path == "/token":
+            calls["token"] += 1
+            return httpx.Response(200, json={"access_token": "at", "expires_in": 3600})
+        calls["send"] += 1
+        tok = json.loads(req.content)["message"]["token"]
+        if tok == "tok-dead":
+            return httpx.Response(404, json={"error": {"status": "NOT_FOUND", "message": "gone",
+                                                       "details": [{"errorCode": "UNREGISTERED"}]}})
+        return httpx.Response(200, json={"name": f"msg/{tok}"})
+
+    _fake_fcm(monkeypatch, handler)
+
+    for _ in range(2):
+        r = client.post("/v1/notify/send-to-user", params={"user_id": "u1", "title": "t", "body": "b"})
+        assert r.status_code == 200
+    js = r.json()
+    assert [s["ok"] for s in js["sent"]] == [True, False, True]
+    assert js["dead_tokens"] == ["tok-dead"] and js["pruned"] == 1
+    assert deleted[-1] == ("u1", ["tok-dead"])
+    assert calls == {"token": 1, "send": 6}
+
+def test_send_to_user_keeps_tokens_on_project_errors(client, monkeypatch):
+    import httpx
+    from app.routers import notify as N
+
+    deleted = _fake_devices(monkeypatch)
+    def handler(req):
+        if req.url.path == "/token":
+            return httpx.Response(200, json={"access_token": "at", "expires_in": 3600})
+        # what FCM answers for a project that does not exist
+        return httpx.Response(404, json={"error": {"status": "NOT_FOUND", "message": "Requested entity was not found."}})
+    _fake_fcm(monkeypatch, handler)
+
+    r = client.post("/v1/notify/send-to-user", params={"user_id": "u1", "title": "t", "body": "b"})
+    js = r.json()
+    assert [s["ok"] for s in js["sent"]] == [False] * 3
+    assert js["dead_tokens"] == [] and js["pruned"] == 0 and deleted == []
+
+    monkeypatch.setattr(N, "PROJECT_ID", "")
+    r = client.post("/v1/notify/send-to-user", params={"user_id": "u1", "title": "t", "body": "b"})
+    assert r.status_code == 500 and deleted == []
@@ -0,0 +1,12 @@
+def test_vector_binary_roundtrip():
+    import numpy as np
+    from app.utils.pgvector import VectorBinaryDumper, VectorBinaryLoader, VectorTextLoader
+
+    v = np.random.default_rng(0).normal(size=512).astype(np.float32)
+    data = VectorBinaryDumper(np.ndarray).dump(v)
+    assert len(data) == 4 + 4 * 512
+    out = VectorBinaryLoader(0).load(data)
+    assert out.dtype == np.float32 and np.array_equal(out, v)
+
+    txt = VectorTextLoader(0).load(b"[1.5,-2,0.25]")
+    assert txt.tolist() == [1.5, -2.0, 0.25]
@@ -0,0 +1,76 @@
+def _storage(monkeypatch):
+    import httpx
+    from app.services import http_client
+
+    seen = {"chunks": 0, "bytes": bytearray(), "stored": set()}
+    async def _handler(request: httpx.Request):
+        name = request.url.path.rsplit("/", 1)[-1]
+        if request.method == "DELETE":
+            seen["stored"].discard(name)
+            return httpx.Response(200, json={})
+        seen["stored"].add(name)
+        async for chunk in request.stream:
+            seen["chunks"] += 1
+            seen["bytes"] += chunk
+        seen["content_type"] = request.headers["content-type"]
+        return httpx.Response(200, json={"Key": "ok"})
+    monkeypatch.setattr(http_client, "_client", httpx.AsyncClient(transport=httpx.MockTransport(_handler)))
+    return seen
+
+def _jpeg(w=1200, h=900):
+    import io
+    import numpy as np
+    from PIL import Image
+    rng = np.random.default_rng(0)
+    buf = io.BytesIO()
+    Image.fromarray(rng.integers(0, 255, (h, w, 3), dtype=np.uint8)).save(buf, format="JPEG", quality=90)
+    return buf.getvalue()
+
+def test_stream_upload_forwards_chunks_and_embeds(client, monkeypatch):
+    from app.services.cache import content_digest
+    from app.routers import photos as P
+
+    stored = {}
+    async def _store(photo_id, vec):
+        stored[photo_id] = len(vec)
+    monkeypatch.setattr(P, "rpc_store_photo_embedding", _store)
+    seen = _storage(monkeypatch)
+    data = _jpeg()
+    r = client.post("/v1/upload/stream", params={"photo_id": "p1"},
+                    files={"file": ("dog.jpg", data, "image/jpeg")}, data={"note": "x"})
+    assert r.status_code == 200, r.text
+    body = r.json()
+    assert body["size"] == len(data) and body["digest"] == content_digest(data)
+    assert bytes(seen["bytes"]) == data and seen["content_type"] == "image/jpeg"
+    assert body["embedding_dim"] == 512 and stored == {"p1": 512}
+
+    # raw body, no embedding
+    r = client.post("/v1/upload/stream", content=data, headers={"content-type": "image/png"})
+    assert r.status_code == 200 and "embedding_dim" not in r.json()
+    assert seen["content_type"] == "image/png"
+
+def test_stream_upload_limits_and_errors(client, monkeypatch):
+    from app.config import settings
+
+    seen = _storage(monkeypatch)
+    monkeypatch.setattr(settings, "upload_max_bytes", 10_000)
+    r = client.post("/v1/upload/stream", files={"file": ("dog.jpg", _jpeg(), "image/jpeg")})
+    assert r.status_code == 413
+    r = client.post("/v1/upload/stream", files={"other": ("dog.jpg", b"abc", "image/jpeg")})
+    assert r.status_code == 400
+    r = client.post("/v1/upload/stream", params={"embed": True},
+                    files={"file": ("dog.jpg", b"not an image", "image/jpeg")})
+    # the body reached storage before the decode failed; it is removed again
+    assert r.status_code == 400 and bytes(seen["bytes"]).endswith(b"not an image")
+    assert seen["stored"] == set()
+    r = client.post("/v1/upload/stream", content=b"", headers={"content-type": "image/jpeg"})
+    assert r.status_code == 400
+
+def test_upload_returns_digest_of_stored_bytes(client, monkeypatch):
+    from app.services.cache import content_digest
+
+    seen = _storage(monkeypatch)
+    data = _jpeg(64, 48)
+    r = client.post("/v1/upload", files={"file": ("dog.jpg", data, "image/jpeg")})
+    assert r.status_code == 200, r.text
+    assert r.json()["digest"] == content_digest(data) and bytes(seen["bytes"]) == data
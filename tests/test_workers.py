@@ -0,0 +1,25 @@
+def test_process_pool_passes_arrays_through_shared_memory(monkeypatch):
+    import asyncio
+    import numpy as np
+    from app.config import settings
+    from app.services import workers
+
+    monkeypatch.setattr(settings, "cpu_pool_mode", "process")
+    monkeypatch.setattr(settings, "cpu_pool_workers", 1)
+    monkeypatch.setattr(settings, "cpu_pool_shm_min_bytes", 16)
+    workers.close_workers()
+    try:
+        arr = np.arange(10000, dtype=np.float64)
+        shared, blocks = workers._share_args((arr,), 16)
+        assert isinstance(shared[0], workers.SharedArray)
+        for shm in blocks:
+            shm.close(); shm.unlink()
+        assert asyncio.run(workers.run_cpu(np.sum, arr)) == arr.sum()
+    finally:
+        workers.close_workers()
+
+def test_saturated_pool_returns_503(client, monkeypatch):
+    from app.config import settings
+    monkeypatch.setattr(settings, "cpu_pool_max_pending", 0)
+    r = client.post("/v1/analyze", params={"photo_id": "p1"}, files={"file": ("a.jpg", b"xx", "image/jpeg")})
+    assert r.status_code == 503